@@ -13,4 +13,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'accounting_software_restful_api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# импорт после настройки Django
+from api_app.events import stock_events_app  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # поток событий остатков обслуживается в обход Django, чтобы не держать поток на каждого подписчика;
+    # Host и аутентификацию оно проверяет само, MIDDLEWARE к нему не применяются (см. api_app.events)
+    if scope['type'] == 'http' and scope['path'].startswith('/api/stock-events/'):
+        await stock_events_app(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,13 +42,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api_app.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'api_app.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api_app.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'accounting_software_restful_api.urls'
@@ -126,6 +130,48 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# JSON is rendered with orjson when it is installed; msgpack (Accept: application/msgpack or ?format=msgpack)
+# is offered only if the msgpack package is available
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api_app.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ] + (['api_app.renderers.MsgPackRenderer'] if find_spec('msgpack') else []),
+}
+
+# Number of threads running background jobs (BigDataFill and other bulk operations)
+API_JOB_WORKERS = 2
+# Seconds between a process marking its queued and running jobs as alive; jobs not marked for three
+# intervals (their process restarted or died) are set to failed
+API_JOB_HEARTBEAT = 30
+
+# Check report lines against inter-workshop routes on create/update (can be enabled per request with ?validate_routes=1)
+API_VALIDATE_ROUTES = False
+
+# How often (seconds) the in-process caches (Detail/Workshop, inventory, routes, BOM) check their version stamps in CACHES.
+# With several workers CACHES must be shared (memcached, redis) for changes to propagate.
+API_REFERENCE_CACHE_CHECK_INTERVAL = 1.0
+# Max Detail/Workshop rows (and, separately, cached representations) kept per model by the reference cache
+API_REFERENCE_CACHE_SIZE = 10000
+
+# Responses smaller than this (bytes) are sent uncompressed; streamed responses are always compressed
+API_COMPRESSION_MIN_SIZE = 1024
+
+# Objects loaded per query when a list is streamed with ?stream=1
+API_STREAM_CHUNK_SIZE = 500
+
+# Let staff users profile a single request with ?_profile=1 (or ?_profile=tottime / ncalls for the sort order):
+# the response is replaced with cProfile stats and the SQL run by the request. When off, the middleware
+# removes itself and costs nothing.
+API_PROFILING = False
+# If set, every profile is also saved there as <time>-<pid>-<path>.prof (pstats, snakeviz) and .sql
+API_PROFILE_DIR = None
+
+# Request, SQL and cache metrics served at /metrics in the Prometheus text format (per process)
+API_METRICS = True
+# If set, /metrics requires the header "Authorization: Bearer <token>"
+API_METRICS_TOKEN = None
+
 try:
     from .production_settings import *
 except ImportError:
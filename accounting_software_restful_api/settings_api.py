@@ -0,0 +1,38 @@
+"""
+Lean settings for API-only workers: DJANGO_SETTINGS_MODULE=accounting_software_restful_api.settings_api
+
+Everything from settings.py (and production_settings.py) applies, minus the parts only the admin and the
+browsable API need: admin, sessions, messages, static files, django_filters templates and the HTML renderer.
+Clients authenticate with HTTP Basic. Compare the cold start with: manage.py bench_startup
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK, TEMPLATES
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+    'django.contrib.admin',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    # only its templates are needed, for the filter form of the browsable API
+    'django_filters',
+)]
+
+# without sessions there is no session user or CSRF to check; DRF authenticates every request itself
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+)]
+
+TEMPLATES = [dict(TEMPLATES[0], OPTIONS=dict(TEMPLATES[0]['OPTIONS'], context_processors=[
+    'django.template.context_processors.debug',
+    'django.template.context_processors.request',
+]))]
+
+REST_FRAMEWORK = dict(
+    REST_FRAMEWORK,
+    DEFAULT_RENDERER_CLASSES=[renderer for renderer in REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES']
+                              if renderer != 'rest_framework.renderers.BrowsableAPIRenderer'],
+    DEFAULT_AUTHENTICATION_CLASSES=['rest_framework.authentication.BasicAuthentication'],
+)
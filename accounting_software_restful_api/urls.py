@@ -13,14 +13,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path, include
 
 from api_app import views
 
 urlpatterns = [
     path('', views.redirect_view),
-    path('admin/', admin.site.urls),
     path('api/', include('api_app.urls', namespace='api')),
+    path('metrics', views.metrics_view, name='metrics'),
     # path('api-auth/', include('rest_framework.urls')),
 ]
+
+# в облегченном профиле (settings_api) админки нет
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))
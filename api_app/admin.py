@@ -1,7 +1,218 @@
-from django.contrib import admin
+"""
+Админка для таблиц производственного размера.
+
+Строки документов (ReportLine, VedomostLine, ProgramLine, UsingLine и др.) исчисляются миллионами, поэтому:
+связанные объекты, которые показываются в списке или нужны __str__, загружаются тем же запросом
+(list_select_related), внешние ключи редактируются по id (raw_id_fields), фильтры списка есть только
+по полям, с которых начинается индекс, а число строк неотфильтрованной таблицы берется из статистики СУБД
+(EstimatedCountPaginator) вместо COUNT(*).
+"""
 from django.apps import apps
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+from api_app.models import Detail, DocNumberSequence, InterWorkshopRoutes, Job, LineOfRoute, MonthlyProduction, \
+    ProductionProgramByMonth, ProductionProgramForTheQuarterByMonth, ProductionProgramForTheQuarterByMonthLine, \
+    ProgramLine, Report, ReportLine, StockMovement, SyncCounter, SyncTombstone, UsingInstruction, UsingLine, \
+    Vedomost, VedomostLine, Workshop
+
+# меньшие таблицы считаются точно: оценка у них бывает заметно неточной, а COUNT(*) дешев
+EXACT_COUNT_LIMIT = 100000
+
+
+def estimated_count(queryset):
+    """Оценка числа строк таблицы модели по статистике СУБД или None, если СУБД ее не дает."""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('SELECT TABLE_ROWS FROM information_schema.TABLES '
+                           'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s', [table])
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для списка без фильтров число строк - оценка СУБД, если таблица большая; с фильтрами - обычный COUNT."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate >= EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # иначе на каждый отфильтрованный список приходится еще и COUNT(*) всей таблицы
+    show_full_result_count = False
+    list_per_page = 100
+
+
+class ReadOnlyAdmin(LargeTableAdmin):
+    """Служебные таблицы, которые ведет само приложение: правка руками нарушит их согласованность."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Detail)
+class DetailAdmin(LargeTableAdmin):
+    list_display = ('detail_pk', 'detail_name', 'cipher_detail')
+    search_fields = ('detail_name', 'cipher_detail')
+
+
+@admin.register(Workshop)
+class WorkshopAdmin(LargeTableAdmin):
+    list_display = ('workshop_pk', 'workshop_name', 'cipher_workshop')
+    search_fields = ('workshop_name', 'cipher_workshop')
+
+
+@admin.register(Report)
+class ReportAdmin(LargeTableAdmin):
+    list_display = ('report_pk', 'doc_num', 'date', 'workshop_sender_pk')
+    list_select_related = ('workshop_sender_pk',)
+    list_filter = ('workshop_sender_pk',)
+    readonly_fields = ('sync_token',)
+
+
+@admin.register(ReportLine)
+class ReportLineAdmin(LargeTableAdmin):
+    list_display = ('report_line_pk', 'report_pk', 'detail_pk', 'workshop_sender_pk', 'workshop_receiver_pk',
+                    'date', 'produced')
+    list_select_related = ('report_pk', 'detail_pk', 'workshop_sender_pk', 'workshop_receiver_pk')
+    # индексы report_line_sender_date и report_line_receiver_date
+    list_filter = ('workshop_sender_pk', 'workshop_receiver_pk')
+    raw_id_fields = ('report_pk', 'detail_pk', 'workshop_receiver_pk')
+    # копии полей рапорта, их выставляет save()
+    readonly_fields = ('date', 'workshop_sender_pk', 'sync_token')
+
+
+@admin.register(Vedomost)
+class VedomostAdmin(LargeTableAdmin):
+    list_display = ('vedomost_pk', 'doc_num', 'creation_date', 'workshop_pk')
+    list_select_related = ('workshop_pk',)
+    list_filter = ('workshop_pk',)
+    readonly_fields = ('sync_token',)
+
+
+@admin.register(VedomostLine)
+class VedomostLineAdmin(LargeTableAdmin):
+    list_display = ('vedomost_line_pk', 'vedomost_pk', 'detail_pk', 'workshop_pk', 'creation_date', 'amount')
+    list_select_related = ('vedomost_pk', 'detail_pk', 'workshop_pk')
+    # индекс vedomost_line_workshop_date
+    list_filter = ('workshop_pk',)
+    raw_id_fields = ('vedomost_pk', 'detail_pk')
+    # копии полей ведомости, их выставляет save()
+    readonly_fields = ('creation_date', 'workshop_pk', 'sync_token')
+
+
+@admin.register(ProductionProgramByMonth)
+class ProductionProgramByMonthAdmin(LargeTableAdmin):
+    list_display = ('production_program_pk', 'creation_date', 'start_date', 'end_date', 'workshop_pk')
+    list_select_related = ('workshop_pk',)
+    list_filter = ('workshop_pk',)
+
+
+@admin.register(ProgramLine)
+class ProgramLineAdmin(LargeTableAdmin):
+    list_display = ('program_line_pk', 'production_program_pk', 'detail_pk', 'amount')
+    list_select_related = ('production_program_pk__workshop_pk', 'detail_pk')
+    raw_id_fields = ('production_program_pk', 'detail_pk')
+
+
+@admin.register(ProductionProgramForTheQuarterByMonth)
+class QuarterProgramAdmin(LargeTableAdmin):
+    list_display = ('production_program_quarter_pk', 'quarter_number')
+
+
+@admin.register(ProductionProgramForTheQuarterByMonthLine)
+class QuarterProgramLineAdmin(LargeTableAdmin):
+    list_display = ('pk', 'production_program_quarter_pk', 'detail_pk', 'month_number')
+    list_select_related = ('production_program_quarter_pk', 'detail_pk')
+    raw_id_fields = ('production_program_quarter_pk', 'detail_pk')
+
+
+@admin.register(UsingInstruction)
+class UsingInstructionAdmin(LargeTableAdmin):
+    list_display = ('using_pk', 'detail_manufactured_pk')
+    list_select_related = ('detail_manufactured_pk',)
+    raw_id_fields = ('detail_manufactured_pk',)
+
+
+@admin.register(UsingLine)
+class UsingLineAdmin(LargeTableAdmin):
+    list_display = ('using_line_pk', 'using_pk', 'detail_pk', 'amount')
+    list_select_related = ('using_pk__detail_manufactured_pk', 'detail_pk')
+    raw_id_fields = ('using_pk', 'detail_pk')
+
+
+@admin.register(LineOfRoute)
+class LineOfRouteAdmin(LargeTableAdmin):
+    list_display = ('pk', 'detail_pk', 'workshop_sender_pk', 'workshop_receiver_pk', 'routes_pk')
+    list_select_related = ('detail_pk', 'workshop_sender_pk', 'workshop_receiver_pk', 'routes_pk')
+    raw_id_fields = ('detail_pk', 'routes_pk')
+
+
+@admin.register(InterWorkshopRoutes)
+class InterWorkshopRoutesAdmin(LargeTableAdmin):
+    list_display = ('pk', 'detail_pk')
+    list_select_related = ('detail_pk',)
+    raw_id_fields = ('detail_pk',)
+
+
+@admin.register(MonthlyProduction)
+class MonthlyProductionAdmin(ReadOnlyAdmin):
+    list_display = ('pk', 'month', 'workshop_pk', 'detail_pk', 'produced')
+    list_select_related = ('workshop_pk', 'detail_pk')
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(ReadOnlyAdmin):
+    list_display = ('movement_pk', 'date', 'workshop_pk', 'detail_pk', 'direction', 'delta')
+    list_select_related = ('workshop_pk', 'detail_pk')
+    # индекс stock_movement_workshop_date
+    list_filter = ('workshop_pk',)
+
+
+@admin.register(SyncCounter)
+class SyncCounterAdmin(ReadOnlyAdmin):
+    list_display = ('name', 'value')
+
+
+@admin.register(DocNumberSequence)
+class DocNumberSequenceAdmin(ReadOnlyAdmin):
+    list_display = ('doc_type', 'workshop_pk', 'value')
+
+
+@admin.register(SyncTombstone)
+class SyncTombstoneAdmin(ReadOnlyAdmin):
+    list_display = ('tombstone_pk', 'model', 'object_pk', 'sync_token')
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('job_pk', 'kind', 'status')
+    list_filter = ('status',)
 
-app = apps.get_app_config('api_app')
 
-for model_name, model in app.models.items():
-    admin.site.register(model)
+# модели, которым не нужно ничего особенного
+for model in apps.get_app_config('api_app').get_models():
+    if not admin.site.is_registered(model):
+        admin.site.register(model, LargeTableAdmin)
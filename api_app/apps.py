@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ApiAppConfig(AppConfig):
     name = 'api_app'
+
+    def ready(self):
+        from api_app import signals  # noqa: F401
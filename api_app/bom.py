@@ -0,0 +1,214 @@
+"""
+Состав изделий (UsingInstruction, UsingLine) в памяти процесса.
+
+Состав загружается одним запросом при первом обращении и хранится разреженной матрицей CSR
+на массивах array: строка изделия - детали состава на одно изделие. Вместе с ней считается
+транзитивное замыкание (сколько каждой детали уходит на изделие на всех уровнях) и разузлование
+до деталей без состава, так что полное раскладывание - одно умножение вектора на матрицу.
+С SciPy векторы умножаются на scipy.sparse, иначе на NumPy или циклом по строкам.
+У деталей, которые входят в цикл или ведут к нему, замыкания нет - они раскладываются по шагам.
+Кеш сбрасывается сигналами UsingInstruction и UsingLine (см. api_app.signals). Сброс увеличивает
+метку версии в кеше Django (VersionStamp), поэтому другие процессы тоже перечитывают состав.
+"""
+import threading
+from array import array
+
+from api_app import metrics
+from api_app.lazy import optional_module
+from api_app.models import UsingLine
+from api_app.reference_cache import VersionStamp
+
+numpy = optional_module('numpy')
+sparse = optional_module('scipy.sparse')
+
+
+class CSR:
+    """Квадратная разреженная матрица: строка i - data[indptr[i]:indptr[i + 1]] в столбцах indices[...]."""
+
+    def __init__(self, size, rows):
+        """rows - {строка: {столбец: значение}}."""
+        self.size = size
+        self.indptr = array('q', [0])
+        self.indices = array('q')
+        self.data = array('q')
+        for row in range(size):
+            for column, value in rows.get(row, {}).items():
+                self.indices.append(column)
+                self.data.append(value)
+            self.indptr.append(len(self.indices))
+        self._scipy = None
+        self._numpy = None
+        self._pattern = None
+
+    def pattern(self):
+        """Та же матрица с единицами на месте всех хранимых значений, включая нулевые."""
+        if self._pattern is None:
+            self._pattern = CSR(self.size, {})
+            self._pattern.indptr, self._pattern.indices = self.indptr, self.indices
+            self._pattern.data = array('q', [1] * len(self.indices))
+        return self._pattern
+
+    def row(self, row):
+        """[(столбец, значение)] строки."""
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return zip(self.indices[start:end], self.data[start:end])
+
+    def rmatvec_dict(self, vector):
+        """Произведение разреженного вектора {строка: значение} на матрицу: {столбец: значение}."""
+        result = {}
+        for row, value in vector.items():
+            for column, amount in self.row(row):
+                result[column] = result.get(column, 0) + amount * value
+        return result
+
+    def rmatvec(self, vector):
+        """Произведение плотного вектора numpy на матрицу."""
+        if sparse is not None:
+            if self._scipy is None:
+                self._scipy = sparse.csr_matrix((
+                    numpy.frombuffer(self.data, dtype=numpy.int64),
+                    numpy.frombuffer(self.indices, dtype=numpy.int64),
+                    numpy.frombuffer(self.indptr, dtype=numpy.int64),
+                ), shape=(self.size, self.size))
+            return self._scipy.T.dot(vector)
+        if self._numpy is None:
+            rows = numpy.repeat(numpy.arange(self.size), numpy.diff(numpy.frombuffer(self.indptr, dtype=numpy.int64)))
+            self._numpy = (rows, numpy.frombuffer(self.indices, dtype=numpy.int64), numpy.frombuffer(self.data, dtype=numpy.int64))
+        rows, indices, data = self._numpy
+        result = numpy.zeros(self.size, dtype=numpy.result_type(vector, data))
+        numpy.add.at(result, indices, data * vector[rows])
+        return result
+
+
+class Bom:
+    def __init__(self, rows):
+        """rows - [(detail_manufactured_pk, detail_pk, amount)] в порядке строк состава."""
+        # {detail_manufactured_pk: [(detail_pk, amount)]}
+        self.components = {}
+        for manufactured_pk, detail_pk, amount in rows:
+            self.components.setdefault(manufactured_pk, []).append((detail_pk, amount))
+        # позиции деталей в матрицах: изделия и детали состава в порядке появления
+        self.pks = array('q')
+        self.index = {}
+        for manufactured_pk, components in self.components.items():
+            self._add(manufactured_pk)
+            for detail_pk, _ in components:
+                self._add(detail_pk)
+        size = len(self.pks)
+        one_level = {}
+        for manufactured_pk, components in self.components.items():
+            row = one_level.setdefault(self.index[manufactured_pk], {})
+            for detail_pk, amount in components:
+                row[self.index[detail_pk]] = row.get(self.index[detail_pk], 0) + amount
+        self.matrix = CSR(size, one_level)
+        # manufactured[slot] - у позиции есть состав
+        self.manufactured = array('b', [slot in one_level for slot in range(size)])
+
+        # порядок "детали раньше изделий" (с листьев); то, что в него не попало, входит в цикл или ведет к нему
+        order = [slot for slot in range(size) if slot not in one_level]
+        parents = {}
+        for parent, row in one_level.items():
+            for child in row:
+                parents.setdefault(child, []).append(parent)
+        unresolved = {parent: len(row) for parent, row in one_level.items()}
+        for slot in order:
+            for parent in parents.get(slot, ()):
+                unresolved[parent] -= 1
+                if not unresolved[parent]:
+                    order.append(parent)
+        self.cyclic = [self.pks[slot] for slot in range(size) if unresolved.get(slot)]
+        # closed[slot] - у позиции есть замыкание
+        self.closed = array('b', [0] * size)
+
+        closure, explosion, depth = {}, {}, {}
+        for slot in order:
+            self.closed[slot] = 1
+            row = one_level.get(slot)
+            if row is None:
+                explosion[slot] = {slot: 1}
+                depth[slot] = 0
+                continue
+            closure[slot], explosion[slot] = {}, {}
+            for child, amount in row.items():
+                closure[slot][child] = closure[slot].get(child, 0) + amount
+                for target, value in closure.get(child, {}).items():
+                    closure[slot][target] = closure[slot].get(target, 0) + amount * value
+                for target, value in explosion[child].items():
+                    explosion[slot][target] = explosion[slot].get(target, 0) + amount * value
+            depth[slot] = 1 + max(depth[child] for child in row)
+        # closure - все детали изделия на всех уровнях, explosion - только детали без состава
+        self.closure = CSR(size, closure)
+        self.explosion = CSR(size, explosion)
+        # сколько раз изделие раскладывается до деталей без состава; при цикле - не больше числа изделий
+        self.depth = len(self.components) if self.cyclic else max(depth.values(), default=0)
+
+    def _add(self, pk):
+        if pk not in self.index:
+            self.index[pk] = len(self.pks)
+            self.pks.append(pk)
+
+    def __len__(self):
+        return len(self.components)
+
+    def explode(self, amounts):
+        """Полное раскладывание {detail_pk: amount} до деталей без состава (все детали должны иметь замыкание)."""
+        vector = {}
+        result = {}
+        for detail_pk, amount in amounts.items():
+            slot = self.index.get(detail_pk)
+            if slot is None:
+                result[detail_pk] = result.get(detail_pk, 0) + amount
+            else:
+                vector[slot] = vector.get(slot, 0) + amount
+        for slot, amount in self.explosion.rmatvec_dict(vector).items():
+            result[self.pks[slot]] = result.get(self.pks[slot], 0) + amount
+        return result
+
+    def reaches(self, detail_pks, amounts):
+        """Есть ли в amounts хоть одна из деталей detail_pks или их состава на любом уровне."""
+        for detail_pk in detail_pks:
+            if detail_pk in amounts:
+                return True
+            slot = self.index.get(detail_pk)
+            if slot is not None:
+                start, end = self.closure.indptr[slot], self.closure.indptr[slot + 1]
+                if any(self.pks[column] in amounts for column in self.closure.indices[start:end]):
+                    return True
+        return False
+
+    def is_closed(self, detail_pks):
+        return all(self.closed[self.index[detail_pk]] for detail_pk in detail_pks if detail_pk in self.index)
+
+
+_bom = None
+_version = None
+_generation = 0
+_lock = threading.Lock()
+_stamp = VersionStamp('bom')
+_stats = metrics.CacheStats('bom')
+
+
+def get_bom() -> Bom:
+    global _bom, _version
+    version = _stamp.current()
+    bom = _bom if _version == version else None
+    _stats.record(bom is not None, bom is None)
+    if bom is None:
+        with _lock:
+            bom = _bom if _version == version else None
+            if bom is None:
+                generation = _generation
+                lines = UsingLine.objects.filter(using_pk__isnull=False, detail_pk__isnull=False).order_by('using_line_pk')
+                bom = Bom(lines.values_list('using_pk__detail_manufactured_pk', 'detail_pk', 'amount'))
+                # состав мог измениться во время загрузки - тогда не кешируем
+                if generation == _generation:
+                    _bom = bom
+                    _version = version
+    return bom
+
+
+def invalidate():
+    global _bom, _generation
+    _stamp.bump()
+    _generation += 1
+    _bom = None
@@ -0,0 +1,224 @@
+"""
+Массовые операции для BigDataFill и загрузки документов. Выполняются как фоновые задачи (см. api_app.jobs).
+"""
+import datetime
+import random
+import string
+from collections import Counter
+
+from django.db import transaction
+
+from api_app import bom, doc_numbers, events, inventory, jobs, reference_cache, rollup, routes, search, stock, sync
+from api_app.deletion import chunked_delete
+from api_app.models import Detail, Report, ReportLine, Vedomost, VedomostLine, Workshop
+
+BATCH_SIZE = 50
+
+
+def _dates(start_date, end_date, interval):
+    start_date = datetime.date.fromisoformat(start_date)
+    end_date = datetime.date.fromisoformat(end_date)
+    return [start_date + datetime.timedelta(i) for i in range(0, (end_date - start_date).days + 1, interval)]
+
+
+def _bulk_create(model, objects, progress):
+    for i in range(0, len(objects), BATCH_SIZE):
+        batch = objects[i:i + BATCH_SIZE]
+        sync.bulk_create(model, batch)
+        progress.advance(len(batch))
+
+
+def _create_report_lines(lines):
+    """Строки рапортов в обход save: итоги и журнал остатков, которые иначе ведут сигналы строк, - той же транзакцией."""
+    with transaction.atomic():
+        sync.bulk_create(ReportLine, lines)
+        rows = [(line.pk, line.workshop_sender_pk_id, line.workshop_receiver_pk_id, line.detail_pk_id, line.produced,
+                 line.date) for line in lines]
+        rollup.lines_created(rows)
+        stock.lines_created(rows)
+
+
+@jobs.register('fill_reports')
+def fill_reports(progress, start_date, end_date, interval, workshop_pk, lines_from, lines_to):
+    dates = _dates(start_date, end_date, interval)
+    progress.set_total(len(dates))
+    reports = doc_numbers.assign([Report(date=date, workshop_sender_pk_id=workshop_pk) for date in dates])
+    _bulk_create(Report, reports, progress)
+
+    detail = Detail.objects.all()[0]
+    progress.add_total(len(reports))
+    objects = []
+    for report in reports:
+        objects.extend([
+            ReportLine(report_pk=report, detail_pk=detail, workshop_receiver_pk_id=workshop_pk, produced=5,
+                       date=report.date, workshop_sender_pk_id=report.workshop_sender_pk_id)
+            for _ in range(random.randint(lines_from, lines_to))
+        ])
+        if len(objects) > BATCH_SIZE:
+            _create_report_lines(objects)
+            objects.clear()
+        progress.advance()
+    _create_report_lines(objects)
+    # строки созданы в обход сигналов, событий по ним не было
+    events.reset([workshop_pk])
+    return {'reports': len(dates)}
+
+
+@jobs.register('fill_vedomosts')
+def fill_vedomosts(progress, start_date, end_date, interval, workshop_pk, lines_from, lines_to):
+    dates = _dates(start_date, end_date, interval)
+    progress.set_total(len(dates))
+    vedomosts = doc_numbers.assign([Vedomost(creation_date=date, workshop_pk_id=workshop_pk) for date in dates])
+    _bulk_create(Vedomost, vedomosts, progress)
+
+    detail = Detail.objects.all()[0]
+    progress.add_total(len(vedomosts))
+    objects = []
+    for vedomost in vedomosts:
+        objects.extend([
+            VedomostLine(vedomost_pk=vedomost, detail_pk=detail, amount=5,
+                         creation_date=vedomost.creation_date, workshop_pk_id=vedomost.workshop_pk_id)
+            for _ in range(random.randint(lines_from, lines_to))
+        ])
+        if len(objects) > BATCH_SIZE:
+            sync.bulk_create(VedomostLine, objects)
+            objects.clear()
+        progress.advance()
+    sync.bulk_create(VedomostLine, objects)
+    inventory.invalidate()
+    events.reset([workshop_pk])
+    return {'vedomosts': len(dates)}
+
+
+@jobs.register('fill_details')
+def fill_details(progress, amount, name_length):
+    progress.set_total(amount)
+    details = []
+    for i in range(amount):
+        details.append(Detail(
+            detail_name=''.join(random.choices(string.ascii_letters, k=name_length)),
+            cipher_detail=''.join(random.choices(string.digits, k=name_length))
+        ))
+        if len(details) > BATCH_SIZE:
+            Detail.objects.bulk_create(details)
+            progress.advance(len(details))
+            details.clear()
+    Detail.objects.bulk_create(details)
+    progress.advance(len(details))
+    search.rebuild(Detail)
+    return {'details': amount}
+
+
+def _missing(model, pks):
+    pks = sorted(pk for pk in set(pks) if pk is not None)
+    existing = set()
+    for i in range(0, len(pks), 1000):
+        existing.update(model.objects.filter(pk__in=pks[i:i + 1000]).values_list('pk', flat=True))
+    return [pk for pk in pks if pk not in existing]
+
+
+def _check_references(reports, vedomosts):
+    """Все детали и цеха документов должны существовать - иначе задача завершается ошибкой до записи."""
+    details = [line['detail_pk'] for report in reports for line in report.get('report_lines', [])]
+    details += [line['detail_pk'] for vedomost in vedomosts for line in vedomost.get('vedomost_lines', [])]
+    workshops = [report.get('workshop_sender_pk') for report in reports]
+    workshops += [line.get('workshop_receiver_pk') for report in reports for line in report.get('report_lines', [])]
+    workshops += [vedomost.get('workshop_pk') for vedomost in vedomosts]
+    for model, pks in ((Detail, details), (Workshop, workshops)):
+        missing = _missing(model, pks)
+        if missing:
+            raise ValueError(f'Unknown {model._meta.pk.name}: {", ".join(map(str, missing[:20]))}'
+                             f'{" ..." if len(missing) > 20 else ""}')
+
+
+def _check_doc_nums(model, items, field):
+    """Номера, заданные в загрузке, не должны повторяться внутри цеха - ни в загрузке, ни в базе."""
+    numbers = [(item.get(field), item['doc_num']) for item in items if item.get('doc_num') is not None]
+    duplicates = {pair for pair, count in Counter(numbers).items() if count > 1} | doc_numbers.taken(model, numbers)
+    if duplicates:
+        duplicates = sorted(duplicates, key=lambda pair: (pair[0] is not None, pair))
+        raise ValueError(f'Duplicate {model._meta.db_table} doc_num (workshop, doc_num): '
+                         f'{", ".join(map(str, duplicates[:20]))}{" ..." if len(duplicates) > 20 else ""}')
+
+
+def _import_reports(items):
+    with transaction.atomic():
+        reports = doc_numbers.assign([
+            Report(doc_num=item.get('doc_num'), date=datetime.date.fromisoformat(item['date']),
+                   workshop_sender_pk_id=item.get('workshop_sender_pk'))
+            for item in items
+        ])
+        sync.bulk_create(Report, reports)
+        lines = [
+            ReportLine(report_pk_id=report.pk, date=report.date, workshop_sender_pk_id=report.workshop_sender_pk_id,
+                       detail_pk_id=line['detail_pk'], workshop_receiver_pk_id=line.get('workshop_receiver_pk'),
+                       produced=line['produced'])
+            for report, item in zip(reports, items) for line in item.get('report_lines', [])
+        ]
+        _create_report_lines(lines)
+
+
+def _import_vedomosts(items):
+    with transaction.atomic():
+        vedomosts = doc_numbers.assign([
+            Vedomost(doc_num=item.get('doc_num'), creation_date=datetime.date.fromisoformat(item['creation_date']),
+                     workshop_pk_id=item.get('workshop_pk'))
+            for item in items
+        ])
+        sync.bulk_create(Vedomost, vedomosts)
+        sync.bulk_create(VedomostLine, [
+            VedomostLine(vedomost_pk_id=vedomost.pk, creation_date=vedomost.creation_date,
+                         workshop_pk_id=vedomost.workshop_pk_id, detail_pk_id=line['detail_pk'], amount=line['amount'])
+            for vedomost, item in zip(vedomosts, items) for line in item.get('vedomost_lines', [])
+        ])
+
+
+@jobs.register('import_documents')
+def import_documents(progress, reports=(), vedomosts=()):
+    """
+    Загрузка рапортов и ведомостей со строками (формат - DocumentImportSerializer).
+    Каждые BATCH_SIZE документов со своими строками записываются одной транзакцией,
+    так что прерванная загрузка оставляет только целые документы.
+    """
+    _check_references(reports, vedomosts)
+    _check_doc_nums(Report, reports, 'workshop_sender_pk')
+    _check_doc_nums(Vedomost, vedomosts, 'workshop_pk')
+    progress.set_total(len(reports) + len(vedomosts))
+    for i in range(0, len(reports), BATCH_SIZE):
+        _import_reports(reports[i:i + BATCH_SIZE])
+        progress.advance(len(reports[i:i + BATCH_SIZE]))
+    for i in range(0, len(vedomosts), BATCH_SIZE):
+        _import_vedomosts(vedomosts[i:i + BATCH_SIZE])
+        progress.advance(len(vedomosts[i:i + BATCH_SIZE]))
+    if vedomosts:
+        inventory.invalidate()
+    events.reset({report.get('workshop_sender_pk') for report in reports} |
+                 {line.get('workshop_receiver_pk') for report in reports for line in report.get('report_lines', [])} |
+                 {vedomost.get('workshop_pk') for vedomost in vedomosts})
+    return {'reports': len(reports), 'vedomosts': len(vedomosts)}
+
+
+CLEAR_MODELS = {
+    'clear_all': (Report, Vedomost, Detail),
+    'clear_details': (Detail,),
+    'clear_reports': (Report,),
+    'clear_vedomosts': (Vedomost,),
+}
+
+
+@jobs.register('clear')
+def clear(progress, mode):
+    deleted = {}
+    for model in CLEAR_MODELS[mode]:
+        for label, count in chunked_delete(model.objects.all(), progress=progress).items():
+            deleted[label] = deleted.get(label, 0) + count
+    # строки рапортов, ведомости и детали удалены в обход сигналов
+    rollup.rebuild()
+    search.rebuild(Detail)
+    reference_cache.invalidate(Detail)
+    inventory.invalidate()
+    # с деталями удалены их состав и маршруты
+    bom.invalidate()
+    routes.invalidate()
+    events.reset()
+    return {'deleted': deleted}
@@ -0,0 +1,129 @@
+"""
+Массовое удаление без Collector'а Django.
+
+Collector перед удалением загружает в память все связанные строки, чтобы эмулировать CASCADE.
+Здесь план удаления строится по метаданным моделей: сначала дочерние таблицы, потом родители,
+и каждая таблица удаляется сырыми DELETE пачками по pk: граница пачки - chunk_size-й pk после
+предыдущей пачки, так что пустых запросов не бывает, какими бы редкими ни были pk. Память не зависит
+от размера таблиц. Каждая пачка коммитится отдельно, а так как дети удаляются раньше родителей,
+прерванное удаление не оставляет висящих ссылок.
+
+SET_NULL и SET_DEFAULT выполняются такими же пачками UPDATE. Для связей с PROTECT, RESTRICT и SET(...)
+родитель удаляется обычным delete() пачками: проверки и значения остаются за Collector'ом.
+
+Сигналы pre_delete/post_delete при сыром удалении не отправляются. Для документов, отслеживаемых
+синхронизацией (api_app.sync), записи об удалении пишутся в той же транзакции, что и пачка,
+а измененные UPDATE строки получают новые токены.
+"""
+from typing import NamedTuple
+
+from django.db import models, transaction
+from django.db.models import QuerySet
+
+from api_app import sync
+
+CHUNK_SIZE = 5000
+
+DELETE = 'delete'
+UPDATE = 'update'
+COLLECT = 'collect'
+
+
+class Step(NamedTuple):
+    queryset: QuerySet
+    # DELETE - сырой DELETE, UPDATE - присвоить values, COLLECT - delete() через Collector
+    action: str = DELETE
+    values: dict = None
+
+
+def build_plan(queryset):
+    """Список шагов (Step) в порядке выполнения: потомки раньше родителей."""
+    model = queryset.model
+    plan = []
+    for relation in model._meta.related_objects:
+        on_delete = relation.on_delete
+        if on_delete is models.DO_NOTHING:
+            continue
+        children = relation.related_model._base_manager.using(queryset.db)
+        if queryset.query.where:
+            children = children.filter(**{f'{relation.field.name}__in': queryset.values(model._meta.pk.name)})
+        else:
+            # удаляются все родители - подзапрос не нужен
+            children = children.filter(**{f'{relation.field.name}__isnull': False})
+        if on_delete is models.CASCADE:
+            plan.extend(build_plan(children))
+        elif on_delete is models.SET_NULL:
+            plan.append(Step(children, UPDATE, {relation.field.name: None}))
+        elif on_delete is models.SET_DEFAULT:
+            plan.append(Step(children, UPDATE, {relation.field.name: relation.field.get_default()}))
+        else:
+            # PROTECT, RESTRICT, SET(...): все связи родителя обработает Collector
+            return [Step(queryset, COLLECT)]
+    plan.append(Step(queryset))
+    return plan
+
+
+def chunks(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Делит queryset на пачки по pk без OFFSET от начала таблицы: граница каждой - chunk_size-й pk
+    после предыдущей. Генератор querysets; строки пачки можно удалять или менять до запроса следующей.
+    """
+    pk_name = queryset.model._meta.pk.name
+    last = None
+    while True:
+        rest = queryset if last is None else queryset.filter(**{f'{pk_name}__gt': last})
+        bound = list(rest.order_by(pk_name).values_list(pk_name, flat=True)[chunk_size - 1:chunk_size])
+        if not bound:
+            yield rest
+            return
+        last = bound[0]
+        yield rest.filter(**{f'{pk_name}__lte': last})
+
+
+def run_step(step, chunk_size=CHUNK_SIZE):
+    """Выполняет шаг плана пачками. Генератор: отдает {label модели: количество строк} по каждой пачке."""
+    model = step.queryset.model
+    label = model._meta.label
+    for chunk in chunks(step.queryset, chunk_size):
+        if step.action == UPDATE and model in sync.TRACKED_MODELS:
+            count = {label: sync.update(chunk, **step.values)}
+        elif step.action == UPDATE:
+            count = {label: chunk.update(**step.values)}
+        elif step.action == COLLECT:
+            count = chunk.delete()[1]
+        elif model in sync.TRACKED_MODELS:
+            with transaction.atomic(using=chunk.db):
+                sync.write_tombstones(model, chunk.values_list(model._meta.pk.name, flat=True))
+                count = {label: chunk._raw_delete(chunk.db)}
+        else:
+            count = {label: chunk._raw_delete(chunk.db)}
+        if any(count.values()):
+            yield count
+
+
+def chunked_delete(queryset, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Удаляет queryset вместе со всеми CASCADE-потомками.
+    progress - необязательный объект с методами add_total(n) и advance(n) (см. api_app.jobs.Progress).
+    Возвращает словарь {label модели: количество удаленных строк}; строки, у которых только
+    обнулена ссылка (SET_NULL, SET_DEFAULT), не считаются.
+    """
+    plan = build_plan(queryset)
+    expected = 0
+    if progress is not None:
+        expected = sum(step.queryset.count() for step in plan if step.action != UPDATE)
+        progress.add_total(expected)
+    deleted = {}
+    for step in plan:
+        for counts in run_step(step, chunk_size):
+            if step.action == UPDATE:
+                continue
+            for label, count in counts.items():
+                deleted[label] = deleted.get(label, 0) + count
+                if progress is not None:
+                    progress.advance(count)
+    if progress is not None:
+        # одна таблица может попасть в план несколько раз (UsingLine через Detail и UsingInstruction),
+        # а Collector удаляет и потомков, поэтому заранее посчитанный итог расходится с фактическим
+        progress.add_total(sum(deleted.values()) - expected)
+    return deleted
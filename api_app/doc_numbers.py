@@ -0,0 +1,87 @@
+"""
+Номера документов.
+
+Номера рапортов и ведомостей идут подряд внутри цеха (для рапорта - цеха-отправителя), своя
+последовательность на каждый тип документа. Счетчик хранится в DocNumberSequence и выдает номера
+блоками под блокировкой строки, поэтому одновременно созданные документы не получают одинаковых
+номеров, а массовая загрузка занимает весь блок номеров одним запросом. Новая последовательность
+начинается после наибольшего номера, который уже есть у документов цеха.
+
+Номер уникален внутри цеха (документы без цеха считаются одним цехом). Номер, заданный клиентом,
+сдвигает последовательность цеха вперед, так что выданные дальше номера с ним не совпадут.
+"""
+from django.db.models import Max
+
+from api_app.models import DocNumberSequence, Report, Vedomost
+
+# модель -> тип документа в DocNumberSequence и поле цеха
+DOCUMENTS = {
+    Report: ('report', 'workshop_sender_pk'),
+    Vedomost: ('vedomost', 'workshop_pk'),
+}
+
+
+def _last_used(model, workshop_pk):
+    _, field = DOCUMENTS[model]
+    documents = model.objects.filter(**{field: workshop_pk})
+    return documents.aggregate(last=Max('doc_num'))['last'] or 0
+
+
+def reserve(model, workshop_pk, count=1):
+    """Первый из count подряд идущих свободных номеров документов model цеха workshop_pk (None - без цеха)."""
+    doc_type, _ = DOCUMENTS[model]
+    return DocNumberSequence.reserve(doc_type, workshop_pk or 0, count, lambda: _last_used(model, workshop_pk))
+
+
+def claim(model, workshop_pk, doc_num):
+    """Номер doc_num, выбранный клиентом: следующие выданные номера цеха будут больше него."""
+    doc_type, _ = DOCUMENTS[model]
+    DocNumberSequence.advance(doc_type, workshop_pk or 0, doc_num, lambda: _last_used(model, workshop_pk))
+
+
+def number(model, workshop_pk, doc_num=None):
+    """Номер нового документа: doc_num клиента (последовательность сдвигается на него) или следующий свободный."""
+    if doc_num is None:
+        return reserve(model, workshop_pk)
+    claim(model, workshop_pk, doc_num)
+    return doc_num
+
+
+def taken(model, numbers, exclude_pk=None):
+    """Какие из пар (workshop_pk, doc_num) уже заняты документами model (кроме документа exclude_pk)."""
+    _, field = DOCUMENTS[model]
+    by_workshop = {}
+    for workshop_pk, doc_num in numbers:
+        by_workshop.setdefault(workshop_pk, set()).add(doc_num)
+    result = set()
+    for workshop_pk, doc_nums in by_workshop.items():
+        doc_nums = sorted(doc_nums)
+        for i in range(0, len(doc_nums), 1000):
+            documents = model.objects.filter(**{field: workshop_pk}, doc_num__in=doc_nums[i:i + 1000])
+            if exclude_pk is not None:
+                documents = documents.exclude(pk=exclude_pk)
+            result.update((workshop_pk, doc_num) for doc_num in documents.values_list('doc_num', flat=True))
+    return result
+
+
+def assign(documents):
+    """
+    Проставляет номера несохраненным документам без doc_num: по одному блоку номеров на модель и цех.
+    Номера, которые у документов уже есть, сначала сдвигают последовательности своих цехов.
+    """
+    by_workshop = {}
+    claimed = {}
+    for document in documents:
+        _, field = DOCUMENTS[type(document)]
+        key = (type(document), getattr(document, f'{field}_id'))
+        if document.doc_num is None:
+            by_workshop.setdefault(key, []).append(document)
+        else:
+            claimed[key] = max(document.doc_num, claimed.get(key, document.doc_num))
+    for (model, workshop_pk), doc_num in claimed.items():
+        claim(model, workshop_pk, doc_num)
+    for (model, workshop_pk), group in by_workshop.items():
+        first = reserve(model, workshop_pk, len(group))
+        for offset, document in enumerate(group):
+            document.doc_num = first + offset
+    return documents
@@ -0,0 +1,38 @@
+"""
+Копии полей документа в его строках.
+
+Строки рапорта хранят date и workshop_sender_pk рапорта, строки ведомости - creation_date и workshop_pk
+ведомости, чтобы выборки по периоду и цеху обходились без join. Строка берет их из документа в своем save(),
+а при изменении самого документа копии во всех его строках обновляются пачкой UPDATE с новыми токенами
+синхронизации (sync.update) - в обход save() и сигналов строк. Поэтому все, что сигналы строк ведут
+по этим полям (итоги выпуска, журнал остатков, события остатков), при изменении документа обновляется здесь.
+Вызывается из post_save документа (api_app.signals); массовое изменение документов в обход save()
+должно делать то же самое.
+"""
+from api_app import events, rollup, stock, sync
+from api_app.models import Report, Vedomost
+
+
+def _moved(document, attnames):
+    """Изменилось ли хоть одно поле после загрузки. Для документа, не загруженного из БД, это неизвестно - считаем, что да."""
+    if document._loaded_values is None:
+        return True
+    return any(document.loaded_value(attname) != getattr(document, attname) for attname in attnames)
+
+
+def report_saved(report: Report):
+    if not _moved(report, ('date', 'workshop_sender_pk_id')):
+        return
+    # строки еще со старыми копиями: пересчет берет старые значения из report.loaded_value()
+    rollup.report_saved(report)
+    stock.report_saved(report)
+    events.report_saved(report)
+    sync.update(report.reportline_set.all(), date=report.date, workshop_sender_pk=report.workshop_sender_pk_id)
+
+
+def vedomost_saved(vedomost: Vedomost):
+    if not _moved(vedomost, ('creation_date', 'workshop_pk_id')):
+        return
+    events.vedomost_moved(vedomost.loaded_value('workshop_pk_id'), vedomost.workshop_pk_id)
+    sync.update(vedomost.vedomostline_set.all(), creation_date=vedomost.creation_date,
+                workshop_pk=vedomost.workshop_pk_id)
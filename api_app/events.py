@@ -0,0 +1,275 @@
+"""
+Поток изменений остатков по цеху (server-sent events), только под ASGI:
+/api/stock-events/<workshop_pk>/
+
+Сигналы ReportLine, Report и VedomostLine (см. api_app.signals) после коммита публикуют события
+в брокер в памяти процесса, а он раздает их подписчикам, по одному вызову call_soon_threadsafe
+на цикл событий. Каждое событие кодируется один раз, сколько бы ни было подписчиков.
+
+События:
+movement - движение детали по строке рапорта: {workshop_pk, detail_pk, amount, date}, amount > 0 - пришло в цех,
+amount < 0 - ушло из него. Это не изменение остатка: /api/leftovers/ раскладывает ушедшие изделия по составу
+и считает от последней ведомости, поэтому сумма movement с остатками сервера не сходится;
+inventory - строка ведомости инвентаризации: {workshop_pk, vedomost_pk, detail_pk, amount, date},
+reset - клиент отстал, ведомость перенесена или документы изменены массовой операцией (api_app.bulk).
+События только сообщают, что остатки цеха изменились: клиент перезапрашивает их через /api/leftovers/,
+а не применяет события к загруженным остаткам.
+
+Доступ: Host проверяется по ALLOWED_HOSTS (иначе 400), пользователь определяется теми же способами
+аутентификации, что у представлений DRF (DEFAULT_AUTHENTICATION_CLASSES, сессия - через SessionMiddleware
+и AuthenticationMiddleware), анонимный получает 403.
+
+Ограничения:
+- доставка только в пределах одного процесса: событие получают подписчики, подключенные к тому же процессу,
+  который закоммитил изменение (в том числе фоновые задачи api_app.jobs - они выполняются в его потоках).
+  Изменения, сделанные другим воркером, подписчик не увидит, поэтому поток событий рассчитан на развертывание
+  с одним процессом ASGI либо требует общего брокера (например, Redis pub/sub) вместо Broker;
+- stock_events_app подключается в asgi.py в обход Django: кроме проверки Host и аутентификации,
+  MIDDLEWARE к нему не применяются (SecurityMiddleware, метрики, сжатие и т.д.).
+"""
+import asyncio
+import io
+import json
+import re
+import threading
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, transaction
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from api_app.models import Report, ReportLine, VedomostLine
+
+PATH_RE = re.compile(r'^/api/stock-events/(?P<workshop_pk>\d+)/?$')
+QUEUE_SIZE = 1000
+KEEPALIVE_INTERVAL = 15
+
+RESET = b'event: reset\ndata: {}\n\n'
+
+
+def encode(event, data, event_id=None):
+    message = f'event: {event}\n'
+    if event_id is not None:
+        message += f'id: {event_id}\n'
+    return (message + f'data: {json.dumps(data, default=str)}\n\n').encode()
+
+
+def _deliver(items):
+    """Выполняется в цикле событий подписчиков."""
+    for queues, message in items:
+        for queue in queues:
+            if queue.full():
+                # подписчик не успевает - сбрасываем очередь и просим перезапросить остатки
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESET)
+            else:
+                queue.put_nowait(message)
+
+
+class Broker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # workshop_pk -> {цикл событий: множество очередей}
+        self.subscribers = {}
+
+    @property
+    def active(self):
+        return bool(self.subscribers)
+
+    def subscribe(self, workshop_pk, queue):
+        loop = asyncio.get_event_loop()
+        with self.lock:
+            self.subscribers.setdefault(workshop_pk, {}).setdefault(loop, set()).add(queue)
+
+    def unsubscribe(self, workshop_pk, queue):
+        loop = asyncio.get_event_loop()
+        with self.lock:
+            loops = self.subscribers.get(workshop_pk, {})
+            queues = loops.get(loop, set())
+            queues.discard(queue)
+            if not queues:
+                loops.pop(loop, None)
+            if not loops:
+                self.subscribers.pop(workshop_pk, None)
+
+    def publish(self, messages):
+        """messages - [(workshop_pk, закодированное событие)]. Можно вызывать из любого потока."""
+        by_loop = {}
+        with self.lock:
+            for workshop_pk, message in messages:
+                for loop, queues in self.subscribers.get(workshop_pk, {}).items():
+                    by_loop.setdefault(loop, []).append((tuple(queues), message))
+        for loop, items in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, items)
+            except RuntimeError:
+                # цикл уже закрыт
+                pass
+
+
+broker = Broker()
+
+
+def _publish_on_commit(messages):
+    if messages:
+        transaction.on_commit(lambda: broker.publish(messages))
+
+
+def _line_moves(sender_pk, receiver_pk, detail_pk, produced, date, sign):
+    """Движения по строке рапорта: отправитель теряет produced, получатель получает."""
+    return [(sender_pk, detail_pk, date, -sign * produced), (receiver_pk, detail_pk, date, sign * produced)]
+
+
+def _publish_moves(moves, event_id=None):
+    totals = {}
+    for workshop_pk, detail_pk, date, amount in moves:
+        if workshop_pk is None or detail_pk is None:
+            continue
+        key = (workshop_pk, detail_pk, date)
+        totals[key] = totals.get(key, 0) + amount
+    _publish_on_commit([
+        (workshop_pk, encode('movement', {'workshop_pk': workshop_pk, 'detail_pk': detail_pk, 'amount': amount, 'date': date}, event_id))
+        for (workshop_pk, detail_pk, date), amount in totals.items() if amount
+    ])
+
+
+def _loaded_line(line: ReportLine):
+    return (line.loaded_value('workshop_sender_pk_id'), line.loaded_value('workshop_receiver_pk_id'),
+            line.loaded_value('detail_pk_id'), line.loaded_value('produced') or 0, line.loaded_value('date'))
+
+
+def report_line_saved(line: ReportLine):
+    if not broker.active:
+        return
+    moves = []
+    if line._loaded_values is not None:
+        moves += _line_moves(*_loaded_line(line), sign=-1)
+    moves += _line_moves(line.workshop_sender_pk_id, line.workshop_receiver_pk_id, line.detail_pk_id,
+                         line.produced, line.date, sign=1)
+    _publish_moves(moves, line.sync_token)
+
+
+def report_line_deleted(line: ReportLine):
+    if not broker.active:
+        return
+    if line._loaded_values is not None:
+        moves = _line_moves(*_loaded_line(line), sign=-1)
+    else:
+        moves = _line_moves(line.workshop_sender_pk_id, line.workshop_receiver_pk_id, line.detail_pk_id,
+                            line.produced, line.date, sign=-1)
+    _publish_moves(moves)
+
+
+def report_saved(report: Report):
+    """Смена даты или отправителя переносит все строки рапорта."""
+    if not broker.active or report._loaded_values is None:
+        return
+    old_sender_pk, old_date = report.loaded_value('workshop_sender_pk_id'), report.loaded_value('date')
+    if (old_sender_pk, old_date) == (report.workshop_sender_pk_id, report.date):
+        return
+    moves = []
+    for receiver_pk, detail_pk, produced in report.reportline_set.values_list('workshop_receiver_pk', 'detail_pk', 'produced'):
+        moves += _line_moves(old_sender_pk, receiver_pk, detail_pk, produced, old_date, sign=-1)
+        moves += _line_moves(report.workshop_sender_pk_id, receiver_pk, detail_pk, produced, report.date, sign=1)
+    _publish_moves(moves, report.sync_token)
+
+
+def vedomost_line_changed(line: VedomostLine, deleted=False):
+    if not broker.active or line.workshop_pk_id is None:
+        return
+    data = {'workshop_pk': line.workshop_pk_id, 'vedomost_pk': line.vedomost_pk_id, 'detail_pk': line.detail_pk_id,
+            'amount': 0 if deleted else line.amount, 'date': line.creation_date}
+    _publish_on_commit([(line.workshop_pk_id, encode('inventory', data, None if deleted else line.sync_token))])
+
+
+def vedomost_moved(*workshop_pks):
+    """Ведомость перенесена в другой цех или на другую дату - остатки пересчитываются заново."""
+    reset(workshop_pks)
+
+
+def reset(workshop_pks=None):
+    """Просит подписчиков цехов (None - всех) перезапросить остатки: после изменений в обход сигналов."""
+    if not broker.active:
+        return
+    if workshop_pks is None:
+        with broker.lock:
+            workshop_pks = list(broker.subscribers)
+    _publish_on_commit([(workshop_pk, RESET) for workshop_pk in set(workshop_pks) if workshop_pk is not None])
+
+
+def authenticate(scope):
+    """
+    Пользователь запроса scope, определенный способами аутентификации DRF, или None для анонимного.
+    Host не из ALLOWED_HOSTS - DisallowedHost.
+    """
+    request = ASGIRequest(scope, io.BytesIO())
+    request.get_host()
+    try:
+        SessionMiddleware(lambda request: None).process_request(request)
+        AuthenticationMiddleware(lambda request: None).process_request(request)
+        try:
+            user = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]).user
+        except APIException:
+            return None
+        return user if user is not None and user.is_authenticated else None
+    finally:
+        close_old_connections()
+
+
+async def _respond(send, status, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def stock_events_app(scope, receive, send):
+    """ASGI-приложение потока событий для одного цеха."""
+    match = PATH_RE.match(scope['path'])
+    if scope['type'] != 'http' or match is None:
+        await _respond(send, 404, b'Not found')
+        return
+    try:
+        user = await sync_to_async(authenticate)(scope)
+    except DisallowedHost:
+        await _respond(send, 400, b'Bad Request')
+        return
+    if user is None:
+        await _respond(send, 403, b'Authentication credentials were not provided.')
+        return
+    workshop_pk = int(match.group('workshop_pk'))
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    broker.subscribe(workshop_pk, queue)
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+        while not disconnected.is_set():
+            try:
+                message = await asyncio.wait_for(queue.get(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                message = b': keepalive\n\n'
+            if message is None:
+                break
+            await send({'type': 'http.response.body', 'body': message, 'more_body': True})
+    finally:
+        broker.unsubscribe(workshop_pk, queue)
+        watcher.cancel()
@@ -0,0 +1,31 @@
+from rest_framework import filters
+
+from api_app import search
+from api_app.lazy import LazyModule
+
+django_filters = LazyModule('django_filters.rest_framework')
+
+
+class IndexedSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter, который ищет через индекс api_app.search, а не LIKE '%term%' по всей таблице.
+    Если модель или какое-то из search_fields не индексируется, работает как обычный SearchFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        index = search.get_index(queryset.model)
+        if not search_fields or not search_terms or index is None or not set(search_fields) <= set(index.fields):
+            return super().filter_queryset(request, queryset, view)
+        return index.filter(queryset, search_terms, search_fields)
+
+
+class DjangoFilterBackend:
+    """
+    django_filters.rest_framework.DjangoFilterBackend, который импортирует django_filters при первом
+    использовании фильтра, а не при загрузке представлений.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        return django_filters.DjangoFilterBackend(*args, **kwargs)
@@ -0,0 +1,108 @@
+"""
+Ведомости инвентаризации по цехам в памяти процесса.
+
+Для каждого цеха при первом обращении двумя запросами строится хронология: отсортированные даты
+ведомостей и их строки в компактных массивах. Ведомость, действующая на дату, находится
+бинарным поиском без обращения к базе. Любое изменение Vedomost или VedomostLine сбрасывает
+хронологии всех цехов через метку версии в кеше Django (см. api_app.signals и api_app.reference_cache),
+массовые операции в обход сигналов должны вызывать invalidate().
+
+Возвращаемые объекты общие для всех запросов - изменять их нельзя.
+"""
+import threading
+from array import array
+from bisect import bisect_right
+from typing import NamedTuple
+
+from api_app import metrics
+from api_app.models import Vedomost, VedomostLine, Workshop
+from api_app.reference_cache import VersionStamp
+
+
+class Inventory(NamedTuple):
+    vedomost_pk: int
+    workshop_pk: int
+    date: object
+    details: array
+    amounts: array
+
+    def stock(self):
+        """{detail_pk: amount} без нулевых строк."""
+        return dict(zip(self.details, self.amounts))
+
+
+class Timeline:
+    def __init__(self, workshop_pk, vedomosts, lines):
+        """
+        vedomosts - [(vedomost_pk, creation_date)], lines - [(vedomost_pk, detail_pk, amount)] в порядке строк.
+        Из нескольких ведомостей на одну дату действует последняя созданная.
+        """
+        amounts = {}
+        for vedomost_pk, detail_pk, amount in lines:
+            # повтор детали в ведомости заменяет прежнюю строку
+            amounts.setdefault(vedomost_pk, {})[detail_pk] = amount
+        by_date = {}
+        for vedomost_pk, date in vedomosts:
+            by_date[date] = max(vedomost_pk, by_date.get(date, vedomost_pk))
+        self.dates = sorted(by_date)
+        self.entries = []
+        for date in self.dates:
+            vedomost_pk = by_date[date]
+            stock = {detail_pk: amount for detail_pk, amount in amounts.get(vedomost_pk, {}).items() if amount}
+            self.entries.append(Inventory(vedomost_pk, workshop_pk, date,
+                                          array('q', stock.keys()), array('q', stock.values())))
+
+    def at(self, date):
+        """Последняя ведомость на дату включительно или None."""
+        index = bisect_right(self.dates, date)
+        return self.entries[index - 1] if index else None
+
+
+class InventoryCache:
+    def __init__(self):
+        self.stamp = VersionStamp('inventory')
+        self.lock = threading.Lock()
+        self.timelines = {}
+        self.version = None
+        self.stats = metrics.CacheStats('inventory')
+
+    def _timelines(self):
+        version = self.stamp.current()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.timelines = {}
+                    self.version = version
+        return self.timelines
+
+    def timeline(self, workshop_pk):
+        timelines = self._timelines()
+        timeline = timelines.get(workshop_pk)
+        self.stats.record(timeline is not None, timeline is None)
+        if timeline is None:
+            vedomosts = Vedomost.objects.filter(workshop_pk=workshop_pk, creation_date__isnull=False) \
+                .values_list('vedomost_pk', 'creation_date').order_by()
+            lines = VedomostLine.objects.filter(workshop_pk=workshop_pk, creation_date__isnull=False,
+                                                detail_pk__isnull=False) \
+                .values_list('vedomost_pk', 'detail_pk', 'amount').order_by('vedomost_line_pk')
+            timeline = Timeline(workshop_pk, vedomosts, lines)
+            timelines[workshop_pk] = timeline
+        return timeline
+
+    def invalidate(self):
+        self.stamp.bump()
+        with self.lock:
+            self.timelines = {}
+            self.version = self.stamp.local
+
+
+_cache = InventoryCache()
+
+
+def at(workshop_pk, date):
+    """Ведомость инвентаризации цеха, действующая на дату (Inventory), или None."""
+    return _cache.timeline(Workshop._meta.pk.to_python(workshop_pk)).at(date)
+
+
+def invalidate():
+    _cache.invalidate()
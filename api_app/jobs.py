@@ -0,0 +1,166 @@
+"""
+Фоновые задачи: долгие операции (генерация, массовое удаление, импорт) выполняются
+в пуле потоков процесса, а состояние и прогресс хранятся в таблице job.
+Количество потоков задается настройкой API_JOB_WORKERS.
+
+Очередь живет только в памяти процесса, который создал задачу. Пока в процессе есть задачи,
+он раз в API_JOB_HEARTBEAT секунд отмечает их в heartbeat_at. Задачи, которые никто не отмечал
+три интервала (процесс перезапущен или упал), помечаются как failed - при запуске пула задач,
+на каждом интервале и перед выдачей списка и состояния задач. Заново они не запускаются:
+после массовой операции, прерванной на середине, ее нужно отправить еще раз.
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api_app.models import Job
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = (Job.STATUS_QUEUED, Job.STATUS_RUNNING)
+ABANDONED_ERROR = 'The process running the job stopped before it finished'
+
+_registry = {}
+_executor = None
+_executor_lock = threading.Lock()
+_worker = None
+_checked_at = float('-inf')
+
+
+def register(kind):
+    """Декоратор: регистрирует функцию func(progress, **params) как задачу типа kind."""
+    def decorator(func):
+        _registry[kind] = func
+        return func
+    return decorator
+
+
+def worker_id():
+    """Идентификатор процесса в Job.worker; после fork у дочернего процесса свой."""
+    global _worker
+    if _worker is None or _worker[0] != os.getpid():
+        _worker = (os.getpid(), f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}')
+    return _worker[1]
+
+
+def heartbeat_interval():
+    return getattr(settings, 'API_JOB_HEARTBEAT', 30)
+
+
+def fail_abandoned():
+    """Помечает failed задачи, которые никто не отмечал три интервала. Возвращает их количество."""
+    now = timezone.now()
+    deadline = now - datetime.timedelta(seconds=3 * heartbeat_interval())
+    # у задач, созданных до появления heartbeat_at, его нет
+    stale = Q(heartbeat_at__lt=deadline) | Q(heartbeat_at__isnull=True, created_at__lt=deadline)
+    return Job.objects.filter(stale, status__in=ACTIVE_STATUSES).exclude(worker=worker_id()) \
+        .update(status=Job.STATUS_FAILED, error=ABANDONED_ERROR, finished_at=now)
+
+
+def check_abandoned():
+    """fail_abandoned() не чаще раза в интервал на процесс - для представлений, которые часто опрашивают."""
+    global _checked_at
+    now = time.monotonic()
+    if now - _checked_at >= heartbeat_interval():
+        _checked_at = now
+        fail_abandoned()
+
+
+def _heartbeat():
+    """Поток процесса с пулом задач: отмечает свои задачи и закрывает брошенные чужие."""
+    while True:
+        time.sleep(heartbeat_interval())
+        try:
+            Job.objects.filter(worker=worker_id(), status__in=ACTIVE_STATUSES).update(heartbeat_at=timezone.now())
+            fail_abandoned()
+        except Exception:
+            logger.exception('Job heartbeat failed')
+        finally:
+            connection.close()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'API_JOB_WORKERS', 2),
+                thread_name_prefix='api-job',
+            )
+            threading.Thread(target=_heartbeat, name='api-job-heartbeat', daemon=True).start()
+            fail_abandoned()
+        return _executor
+
+
+def submit(kind, **params):
+    """Создает запись задачи и ставит ее в очередь после коммита текущей транзакции."""
+    if kind not in _registry:
+        raise KeyError(f'Unknown job kind: {kind}')
+    job = Job.objects.create(kind=kind, params=params, worker=worker_id(), heartbeat_at=timezone.now())
+    transaction.on_commit(lambda: get_executor().submit(_run_in_pool, job.job_pk))
+    return job
+
+
+class Progress:
+    """Отчет о прогрессе задачи. Запись в БД не чаще, чем раз в interval секунд."""
+
+    def __init__(self, job: Job, interval=0.5):
+        self.job = job
+        self.interval = interval
+        self._saved_at = 0.0
+
+    def set_total(self, total):
+        self.job.total = total
+        self._save(force=True)
+
+    def add_total(self, amount):
+        self.set_total((self.job.total or 0) + amount)
+
+    def advance(self, amount=1):
+        self.job.progress += amount
+        self._save()
+
+    def _save(self, force=False):
+        now = time.monotonic()
+        if force or now - self._saved_at >= self.interval:
+            self._saved_at = now
+            Job.objects.filter(job_pk=self.job.job_pk).update(progress=self.job.progress, total=self.job.total,
+                                                              heartbeat_at=timezone.now())
+
+
+def run(job_pk):
+    """Выполняет задачу в текущем потоке. Вызывается пулом, но годится и для синхронного запуска."""
+    job = Job.objects.get(job_pk=job_pk)
+    job.status = Job.STATUS_RUNNING
+    job.started_at = job.heartbeat_at = timezone.now()
+    job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+    try:
+        job.result = _registry[job.kind](Progress(job), **job.params)
+        job.status = Job.STATUS_DONE
+    except Exception as e:
+        # трассировка остается в логе, в задаче (ее видят клиенты) - только сообщение
+        logger.exception('Job %s (%s) failed', job.job_pk, job.kind)
+        job.error = str(e) or type(e).__name__
+        job.status = Job.STATUS_FAILED
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def _run_in_pool(job_pk):
+    close_old_connections()
+    try:
+        run(job_pk)
+    finally:
+        # у потоков пула свои соединения, не оставляем их открытыми
+        connection.close()
@@ -0,0 +1,33 @@
+"""
+Отложенный импорт тяжелых необязательных модулей (numpy, scipy.sparse, django_filters).
+
+optional_module(name) возвращает заместителя модуля, если пакет установлен, иначе None - так что
+проверки "numpy is None" работают как с обычным try/except ImportError, а сам импорт происходит
+при первом обращении к атрибуту, а не при запуске воркера.
+"""
+import importlib
+from importlib.util import find_spec
+
+
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        # дальше атрибут берется из __dict__ заместителя без __getattr__
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
+
+
+def optional_module(name):
+    """Заместитель модуля name или None, если пакет не установлен."""
+    try:
+        if find_spec(name.partition('.')[0]) is None:
+            return None
+    except ValueError:
+        return None
+    return LazyModule(name)
@@ -0,0 +1,50 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api_app import stock
+from api_app.bom import Bom
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает списание остатков на словарях и на векторах NumPy на синтетических данных (без БД).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--details', type=int, default=20000)
+        parser.add_argument('--stock', type=int, default=5000, help='деталей в остатке')
+        parser.add_argument('--outgoing', type=int, default=2000, help='ушедших деталей')
+        parser.add_argument('--products', type=int, default=500, help='изделий с составом')
+        parser.add_argument('--components', type=int, default=8, help='деталей в составе изделия')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        pks = range(1, options['details'] + 1)
+        stock_amounts = {pk: rng.randint(1, 1000) for pk in rng.sample(pks, options['stock'])}
+        outgoing = {pk: rng.randint(1, 1500) for pk in rng.sample(pks, options['outgoing'])}
+        # изделия собираются из деталей с большими номерами, так что состав без циклов
+        rows = []
+        for pk in rng.sample(range(1, options['details'] // 2), options['products']):
+            rows += [(pk, rng.randint(pk + 1, options['details']), rng.randint(1, 5)) for _ in range(options['components'])]
+        started = time.perf_counter()
+        bom = Bom(rows)
+        self.stdout.write(f'{len(stock_amounts)} in stock, {len(outgoing)} outgoing, {len(bom)} products, '
+                          f'BOM depth {bom.depth}, closure built in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+        results = {}
+        implementations = [('python', stock.resolve_python)]
+        if stock.numpy is not None:
+            implementations.append(('numpy', stock.resolve_numpy))
+        else:
+            self.stdout.write(self.style.WARNING('NumPy is not installed, only the python implementation is measured'))
+        for name, resolve in implementations:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                results[name] = resolve(stock_amounts, outgoing, bom)
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(f'{name:>8}: best {min(timings) * 1000:.1f} ms')
+        if 'numpy' in results and results['numpy'] != results['python']:
+            self.stderr.write(self.style.ERROR('results differ'))
@@ -0,0 +1,49 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api_app import planning
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает расчет плана в цикле и на NumPy на синтетических программах (без БД).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--programs', type=int, default=20000)
+        parser.add_argument('--lines', type=int, default=10, help='строк в программе')
+        parser.add_argument('--details', type=int, default=2000)
+        parser.add_argument('--workshops', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        first_day = datetime.date(2015, 1, 1)
+        programs, lines = [], []
+        for program_pk in range(1, options['programs'] + 1):
+            start_date = first_day + datetime.timedelta(rng.randrange(3650))
+            end_date = start_date + datetime.timedelta(rng.randrange(28, 92))
+            programs.append((program_pk, rng.randint(1, options['workshops']), start_date, end_date))
+            for _ in range(options['lines']):
+                lines.append((program_pk, rng.randint(1, options['details']), rng.randint(1, 1000)))
+        start_date, end_date = first_day, first_day + datetime.timedelta(3650)
+        self.stdout.write(f'{options["programs"]} programs, {len(lines)} lines')
+
+        results = {}
+        implementations = [('python', planning.compute_python)]
+        if planning.numpy is not None:
+            implementations.append(('numpy', planning.compute_numpy))
+        else:
+            self.stdout.write(self.style.WARNING('NumPy is not installed, only the python implementation is measured'))
+        for name, compute in implementations:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                results[name] = compute(programs, lines, start_date, end_date)
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(f'{name:>8}: best {min(timings) * 1000:.1f} ms, '
+                              f'{len(lines) / min(timings) / 1e6:.2f} M lines/s')
+        if 'numpy' in results and results['numpy'] != results['python']:
+            self.stderr.write(self.style.ERROR('results differ'))
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api_app import renderers
+from api_app.views import ReportLineList
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает рендереры на ответе /api/report-lines/ из текущей БД: только рендеринг и запрос целиком.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--host', default='localhost', help='Host для запросов (должен быть в ALLOWED_HOSTS)')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        view = ReportLineList.as_view()
+        candidates = [('json (stdlib)', JSONRenderer), ('json (fast)', renderers.FastJSONRenderer)]
+        if renderers.orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed, fast json falls back to stdlib'))
+        if renderers.msgpack is not None:
+            candidates.append(('msgpack', renderers.MsgPackRenderer))
+        else:
+            self.stdout.write(self.style.WARNING('msgpack is not installed, skipped'))
+
+        response = view(factory.get('/api/report-lines/', HTTP_HOST=options['host']))
+        data = response.data
+        self.stdout.write(f'{len(data)} report lines')
+
+        for name, renderer_class in candidates:
+            renderer = renderer_class()
+            render_timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                body = renderer.render(data, renderer.media_type, {})
+                render_timings.append(time.perf_counter() - started)
+
+            view = ReportLineList.as_view(renderer_classes=[renderer_class])
+            request_timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                view(factory.get('/api/report-lines/', HTTP_HOST=options['host'])).render()
+                request_timings.append(time.perf_counter() - started)
+            self.stdout.write(f'{name:>14}: {len(body) / 1024:.0f} KiB, render best {min(render_timings) * 1000:.1f} ms '
+                              f'({len(data) / min(render_timings) / 1e3:.0f}k lines/s), '
+                              f'request best {min(request_timings) * 1000:.1f} ms '
+                              f'({1 / min(request_timings):.1f} req/s)')
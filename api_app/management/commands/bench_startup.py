@@ -0,0 +1,72 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# выполняется в новом интерпретаторе: загрузка WSGI-приложения и первый запрос к нему
+CHILD = '''
+import time
+started = time.perf_counter()
+import json, sys, wsgiref.util
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+loaded = time.perf_counter()
+environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'QUERY_STRING': sys.argv[2],
+           'HTTP_HOST': sys.argv[3], 'HTTP_ACCEPT': 'application/json'}
+wsgiref.util.setup_testing_defaults(environ)
+status = []
+response = application(environ, lambda code, headers, exc_info=None: status.append(code))
+size = sum(len(chunk) for chunk in response)
+response.close()
+print(json.dumps({'setup': loaded - started, 'first_response': time.perf_counter() - loaded,
+                  'status': status[0], 'size': size, 'modules': len(sys.modules)}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Холодный старт воркера: время от запуска интерпретатора до первого ответа '
+            'для нескольких профилей настроек, каждый в новом процессе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settings-module', action='append', dest='modules',
+                            help='модуль настроек, можно несколько раз; по умолчанию settings и settings_api')
+        parser.add_argument('--url', default='/api/details/?limit=1')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or ['accounting_software_restful_api.settings', 'accounting_software_restful_api.settings_api']
+        path, _, query = options['url'].partition('?')
+        for module in modules:
+            runs = [self.run(module, path, query, options['host']) for _ in range(options['repeat'])]
+            last = runs[-1]
+            self.stdout.write(
+                f'{module}: total {self.median(runs, "total")} ms '
+                f'(interpreter and Django setup {self.median(runs, "setup")} ms, '
+                f'first response {self.median(runs, "first_response")} ms), '
+                f'HTTP {last["status"]}, {last["size"]} bytes, {last["modules"]} modules loaded'
+            )
+
+    @staticmethod
+    def run(module, path, query, host):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=module)
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', CHILD, path, query, host], cwd=settings.BASE_DIR, env=env,
+                                capture_output=True, text=True)
+        total = time.perf_counter() - started
+        if result.returncode:
+            raise CommandError(f'{module}: {result.stderr.strip()}')
+        data = json.loads(result.stdout.strip().splitlines()[-1])
+        # до started внутри дочернего процесса - запуск интерпретатора
+        data['setup'] = total - data['first_response']
+        data['total'] = total
+        return data
+
+    @staticmethod
+    def median(runs, key):
+        return f'{statistics.median(run[key] for run in runs) * 1000:.0f}'
@@ -0,0 +1,64 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api_app import inventory, stock
+from api_app.bom import get_bom
+from api_app.models import Report, Vedomost
+
+
+class Command(BaseCommand):
+    help = ('Сверяет журнал StockMovement со строками рапортов, хронологию ведомостей с базой и остатки '
+            'по журналу с прежним расчетом на даты ведомостей и рапортов (или на --date).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workshop', type=int, action='append', help='цех, можно несколько раз; по умолчанию все')
+        parser.add_argument('--date', type=datetime.date.fromisoformat, action='append', help='дата, можно несколько раз')
+        parser.add_argument('--max-dates', type=int, default=50, help='дат на цех, если --date не указан')
+
+    def handle(self, *args, **options):
+        problems = 0
+        for workshop_pk, detail_pk, direction, actual, expected in stock.check_ledger():
+            self.stdout.write(f'ledger: workshop {workshop_pk}, detail {detail_pk}, direction {direction}: '
+                              f'{actual} in ledger, {expected} in report lines')
+            problems += 1
+
+        vedomosts = Vedomost.objects.exclude(workshop_pk=None).exclude(creation_date=None)
+        if options['workshop']:
+            vedomosts = vedomosts.filter(workshop_pk__in=options['workshop'])
+        workshop_pks = sorted(set(vedomosts.values_list('workshop_pk', flat=True)))
+        bom = get_bom()
+        if bom.cyclic:
+            self.stdout.write(self.style.WARNING(f'BOM cycles through details {bom.cyclic}, they are split step by step'))
+        checked = 0
+        for workshop_pk in workshop_pks:
+            dates = options['date'] or self.sample_dates(workshop_pk, options['max_dates'])
+            for date in dates:
+                vedomost = vedomosts.filter(workshop_pk=workshop_pk, creation_date__lte=date) \
+                    .order_by('creation_date', 'vedomost_pk').last()
+                entry = inventory.at(workshop_pk, date)
+                if (vedomost and vedomost.pk) != (entry and entry.vedomost_pk):
+                    problems += 1
+                    self.stdout.write(f'inventory: workshop {workshop_pk} on {date}: vedomost '
+                                      f'{entry and entry.vedomost_pk} in timeline, {vedomost and vedomost.pk} in database')
+                if vedomost is None or entry is None:
+                    continue
+                checked += 1
+                ledger = stock.leftovers(entry, date, bom)
+                legacy = stock.legacy_leftovers(vedomost, date)
+                if ledger != legacy:
+                    problems += 1
+                    self.stdout.write(f'leftovers: workshop {workshop_pk} on {date}: ledger {ledger}, legacy {legacy}')
+
+        if problems:
+            raise CommandError(f'{problems} mismatches, {checked} leftovers checked')
+        self.stdout.write(self.style.SUCCESS(f'OK, {checked} leftovers checked'))
+
+    @staticmethod
+    def sample_dates(workshop_pk, limit):
+        dates = set(Vedomost.objects.filter(workshop_pk=workshop_pk).values_list('creation_date', flat=True))
+        dates |= set(Report.objects.filter(reportline__workshop_receiver_pk=workshop_pk).values_list('date', flat=True))
+        dates |= set(Report.objects.filter(workshop_sender_pk=workshop_pk).values_list('date', flat=True))
+        dates = sorted(date for date in dates if date)
+        step = max(len(dates) // limit, 1)
+        return dates[::step][:limit]
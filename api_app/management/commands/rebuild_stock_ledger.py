@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api_app import stock
+from api_app.models import StockMovement
+
+
+class Command(BaseCommand):
+    help = 'Пересоздает журнал движений StockMovement по строкам рапортов (сворачивает сторно).'
+
+    def handle(self, *args, **options):
+        before = StockMovement.objects.count()
+        stock.rebuild()
+        self.stdout.write(f'{before} -> {StockMovement.objects.count()} movements')
@@ -0,0 +1,164 @@
+"""
+Метрики процесса в формате Prometheus (text exposition format 0.0.4), отдаются на /metrics.
+
+Счетчики и гистограммы хранятся в памяти процесса. Значения с набором меток создаются один раз
+(labels()) и дальше меняются под собственной блокировкой, так что запись метрики - несколько
+сложений. При нескольких воркерах каждый отдает свои значения: их нужно собирать с каждого
+процесса отдельно или суммировать в Prometheus по метке instance.
+
+Запросы, их длительность и SQL по представлениям считает MetricsMiddleware (api_app.middleware),
+попадания в кеши - сами кеши (reference_cache, inventory, bom, routes).
+"""
+import threading
+from bisect import bisect_left
+
+# границы гистограммы длительности по умолчанию, секунды (как в клиентах Prometheus)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values):
+        """Значение метрики для набора меток; его стоит сохранять, а не искать на каждый вызов."""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in sorted(self.children.items()):
+            lines.extend(self.render_child(values, child))
+        return lines
+
+
+class _CounterValue:
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def new_child(self):
+        return _CounterValue()
+
+    def render_child(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}']
+
+
+class _HistogramValue:
+    __slots__ = ('lock', 'bounds', 'buckets', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.buckets[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def render_child(self, values, child):
+        with child.lock:
+            buckets, total, count = list(child.buckets), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, amount in zip(self.bounds + (float('inf'),), buckets):
+            cumulative += amount
+            labels = _format_labels(self.labelnames, values, [f'le="{_format_value(float(bound))}"'])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+requests_total = Counter('api_requests_total', 'HTTP requests by view, method and status', ('view', 'method', 'status'))
+request_duration = Histogram('api_request_duration_seconds', 'Time until the response is returned, or closed if streamed, seconds',
+                             ('view',))
+db_queries_total = Counter('api_db_queries_total', 'SQL queries run while handling requests', ('view',))
+db_query_seconds_total = Counter('api_db_query_seconds_total', 'Time spent in SQL queries while handling requests, seconds',
+                                 ('view',))
+cache_requests_total = Counter('api_cache_requests_total', 'In-process cache lookups by cache and result', ('cache', 'result'))
+
+
+class CacheStats:
+    """Счетчики попаданий и промахов одного кеша."""
+
+    def __init__(self, name):
+        self.hit = cache_requests_total.labels(name, 'hit')
+        self.miss = cache_requests_total.labels(name, 'miss')
+
+    def record(self, hits, misses=0):
+        if hits:
+            self.hit.inc(hits)
+        if misses:
+            self.miss.inc(misses)
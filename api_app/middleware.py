@@ -0,0 +1,339 @@
+"""
+Промежуточные слои API.
+
+CompressionMiddleware сжимает ответы алгоритмом, выбранным по Accept-Encoding: zstd (пакет zstandard),
+br (пакет brotli) или gzip. Ответы меньше API_COMPRESSION_MIN_SIZE байт не сжимаются.
+Потоковые ответы сжимаются по частям: каждая часть сразу сбрасывается клиенту,
+так что весь ответ ни в каком виде не собирается в памяти.
+
+ProfilingMiddleware по ?_profile=1 выполняет запрос сотрудника (is_staff) под cProfile и вместо ответа
+возвращает отчет: статистику функций и все SQL-запросы со временем. Включается настройкой API_PROFILING,
+без нее слой исключается из цепочки и ничего не стоит остальным запросам.
+
+MetricsMiddleware считает запросы, их длительность и SQL-запросы по представлениям (api_app.metrics).
+Потоковый ответ засекается до закрытия ответа сервером, вместе с SQL-запросами, выполненными при его чтении.
+Метод вне стандартного набора HTTP попадает в метку method="other", чтобы произвольные методы
+не порождали новые ряды метрик.
+"""
+import cProfile
+import io
+import os
+import pstats
+import time
+import zlib
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from api_app import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_accept_encoding_re = _lazy_re_compile(r'^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+class GzipCompressor:
+    def __init__(self):
+        # wbits=31 - формат gzip; время в заголовке нулевое, как в django.utils.text.compress_string
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self):
+        self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+def available_encodings():
+    """Поддерживаемые кодировки в порядке предпочтения сервера."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append(('zstd', ZstdCompressor))
+    if brotli is not None:
+        encodings.append(('br', BrotliCompressor))
+    encodings.append(('gzip', GzipCompressor))
+    return encodings
+
+
+def negotiate(accept_encoding, encodings):
+    """Кодировка с наибольшим q из Accept-Encoding, при равенстве - по порядку encodings, или None."""
+    weights = {}
+    for item in accept_encoding.split(','):
+        match = _accept_encoding_re.match(item)
+        if not match:
+            continue
+        try:
+            weights[match.group(1).lower()] = float(match.group(2)) if match.group(2) else 1.0
+        except ValueError:
+            continue
+    best, best_weight = None, 0.0
+    for name, compressor_class in encodings:
+        weight = weights.get(name, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = (name, compressor_class), weight
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.encodings = available_encodings()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < getattr(settings, 'API_COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        chosen = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+        if chosen is None:
+            return response
+        name, compressor_class = chosen
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(response.streaming_content, compressor_class())
+            del response['Content-Length']
+        else:
+            compressor = compressor_class()
+            content = compressor.compress(response.content) + compressor.finish()
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # сжатое представление отличается от исходного побайтно, ETag становится слабым
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = name
+        return response
+
+    @staticmethod
+    def compress_stream(chunks, compressor):
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class QueryLog:
+    """Обертка execute_wrapper: собирает SQL-запросы со временем выполнения."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((context['connection'].alias, time.perf_counter() - started, sql, params))
+
+
+class ProfilingMiddleware:
+    SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+    LIMIT = 60
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'API_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if '_profile' not in request.GET or not self.is_staff(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        query_log = QueryLog()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+                # потоковый ответ выполняется при чтении - читаем его здесь же
+                if response.streaming:
+                    size = sum(len(chunk) for chunk in response.streaming_content)
+                else:
+                    size = len(response.content)
+            finally:
+                profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        sort = request.GET.get('_profile')
+        report = io.StringIO()
+        sql_time = sum(duration for _, duration, _, _ in query_log.queries)
+        report.write(f'{request.method} {request.get_full_path()}: {response.status_code}, {size} bytes, '
+                     f'{elapsed * 1000:.1f} ms, {len(query_log.queries)} SQL queries ({sql_time * 1000:.1f} ms)\n')
+        saved = self.save(request, profiler, query_log)
+        if saved:
+            report.write(f'saved to {saved}.prof and {saved}.sql\n')
+        report.write('\n')
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats(sort if sort in self.SORT_KEYS else 'cumulative').print_stats(self.LIMIT)
+        report.write('SQL:\n')
+        self.write_queries(report, query_log)
+        return HttpResponse(report.getvalue(), content_type='text/plain; charset=utf-8')
+
+    @staticmethod
+    def is_staff(request):
+        # те же способы аутентификации, что и у представлений DRF
+        try:
+            user = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]).user
+        except APIException:
+            return False
+        return bool(user and user.is_staff)
+
+    @staticmethod
+    def write_queries(stream, query_log):
+        for alias, duration, sql, params in query_log.queries:
+            stream.write(f'{duration * 1000:8.2f} ms  [{alias}] {sql}')
+            if params:
+                stream.write(f'  -- {params!r}')
+            stream.write('\n')
+
+    def save(self, request, profiler, query_log):
+        """Сохраняет профиль (.prof для pstats/snakeviz) и SQL в API_PROFILE_DIR, если он задан."""
+        directory = getattr(settings, 'API_PROFILE_DIR', None)
+        if not directory:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        name = request.path.strip('/').replace('/', '-') or 'root'
+        path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{name}')
+        profiler.dump_stats(path + '.prof')
+        with open(path + '.sql', 'w', encoding='utf-8') as stream:
+            self.write_queries(stream, query_log)
+        return path
+
+
+class QueryCounter:
+    """Обертка execute_wrapper: число SQL-запросов и их суммарное время."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+def count_queries(counter):
+    """Контекст, в котором SQL-запросы всех подключений проходят через обертку counter."""
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(counter))
+    return stack
+
+
+class TimedStream:
+    """
+    Части потокового ответа: SQL при чтении каждой части считаются в queries, закрытие ответа
+    вызывает finish() один раз. Ответ закрывает сервер, даже если клиент не дочитал его.
+    """
+
+    def __init__(self, chunks, queries, finish):
+        self.chunks = iter(chunks)
+        self.queries = queries
+        self.finish = finish
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with count_queries(self.queries):
+            return next(self.chunks)
+
+    def close(self):
+        finish, self.finish = self.finish, None
+        if finish is not None:
+            finish()
+
+
+class MetricsMiddleware:
+    METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'API_METRICS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # значения метрик по представлению: (длительность, SQL-запросы, время SQL)
+        self.view_metrics = {}
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        started = time.perf_counter()
+        with count_queries(queries):
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unmatched'
+        view_metrics = self.view_metrics.get(view)
+        if view_metrics is None:
+            view_metrics = self.view_metrics.setdefault(view, (
+                metrics.request_duration.labels(view),
+                metrics.db_queries_total.labels(view),
+                metrics.db_query_seconds_total.labels(view),
+            ))
+        method = request.method if request.method in self.METHODS else 'other'
+        metrics.requests_total.labels(view, method, response.status_code).inc()
+        if response.streaming:
+            response.streaming_content = TimedStream(response.streaming_content, queries,
+                                                     lambda: self.record(view_metrics, started, queries))
+        else:
+            self.record(view_metrics, started, queries)
+        return response
+
+    @staticmethod
+    def record(view_metrics, started, queries):
+        duration, db_queries, db_seconds = view_metrics
+        duration.observe(time.perf_counter() - started)
+        if queries.count:
+            db_queries.inc(queries.count)
+            db_seconds.inc(queries.duration)
@@ -0,0 +1,63 @@
+# Generated by Django 3.2 on 2026-10-19 14:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0006_alter_vedomost_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('job_pk', models.AutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=50)),
+                ('params', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='queued', max_length=20)),
+                ('progress', models.IntegerField(default=0)),
+                ('total', models.IntegerField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'job',
+            },
+        ),
+        migrations.AlterField(
+            model_name='programline',
+            name='detail_pk',
+            field=models.ForeignKey(db_column='detail_pk', on_delete=django.db.models.deletion.CASCADE, to='api_app.detail'),
+        ),
+        migrations.AlterField(
+            model_name='programline',
+            name='production_program_pk',
+            field=models.ForeignKey(db_column='production_program_pk', on_delete=django.db.models.deletion.CASCADE, to='api_app.productionprogrambymonth'),
+        ),
+        migrations.AlterField(
+            model_name='reportline',
+            name='detail_pk',
+            field=models.ForeignKey(blank=True, db_column='detail_pk', null=True, on_delete=django.db.models.deletion.CASCADE, to='api_app.detail'),
+        ),
+        migrations.AlterField(
+            model_name='usinginstruction',
+            name='detail_manufactured_pk',
+            field=models.OneToOneField(db_column='detail_manufactured_pk', on_delete=django.db.models.deletion.CASCADE, to='api_app.detail'),
+        ),
+        migrations.AlterField(
+            model_name='usingline',
+            name='detail_pk',
+            field=models.ForeignKey(blank=True, db_column='detail_pk', null=True, on_delete=django.db.models.deletion.CASCADE, to='api_app.detail'),
+        ),
+        migrations.AlterField(
+            model_name='usingline',
+            name='using_pk',
+            field=models.ForeignKey(blank=True, db_column='using_pk', null=True, on_delete=django.db.models.deletion.CASCADE, to='api_app.usinginstruction'),
+        ),
+    ]
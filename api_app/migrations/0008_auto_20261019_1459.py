@@ -0,0 +1,46 @@
+# Generated by Django 3.2 on 2026-10-19 14:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0007_auto_20261019_1458'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportline',
+            name='date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='reportline',
+            name='workshop_sender_pk',
+            field=models.ForeignKey(blank=True, db_column='workshop_sender_pk', db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='sent_report_lines', to='api_app.workshop'),
+        ),
+        migrations.AddField(
+            model_name='vedomostline',
+            name='creation_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vedomostline',
+            name='workshop_pk',
+            field=models.ForeignKey(blank=True, db_column='workshop_pk', db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='vedomost_lines', to='api_app.workshop'),
+        ),
+        migrations.AddIndex(
+            model_name='reportline',
+            index=models.Index(fields=['workshop_sender_pk', 'date', 'detail_pk', 'produced'], name='report_line_sender_date'),
+        ),
+        migrations.AddIndex(
+            model_name='reportline',
+            index=models.Index(fields=['workshop_receiver_pk', 'date', 'detail_pk', 'produced'], name='report_line_receiver_date'),
+        ),
+        migrations.AddIndex(
+            model_name='vedomostline',
+            index=models.Index(fields=['workshop_pk', 'creation_date', 'detail_pk', 'amount'], name='vedomost_line_workshop_date'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2 on 2026-10-19 15:00
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill(apps, schema_editor):
+    Report = apps.get_model('api_app', 'Report')
+    ReportLine = apps.get_model('api_app', 'ReportLine')
+    Vedomost = apps.get_model('api_app', 'Vedomost')
+    VedomostLine = apps.get_model('api_app', 'VedomostLine')
+
+    report = Report.objects.filter(report_pk=OuterRef('report_pk'))
+    ReportLine.objects.filter(report_pk__isnull=False).update(
+        date=Subquery(report.values('date')[:1]),
+        workshop_sender_pk=Subquery(report.values('workshop_sender_pk')[:1]),
+    )
+    vedomost = Vedomost.objects.filter(vedomost_pk=OuterRef('vedomost_pk'))
+    VedomostLine.objects.filter(vedomost_pk__isnull=False).update(
+        creation_date=Subquery(vedomost.values('creation_date')[:1]),
+        workshop_pk=Subquery(vedomost.values('workshop_pk')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0008_auto_20261019_1459'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
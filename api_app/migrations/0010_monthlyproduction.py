@@ -0,0 +1,28 @@
+# Generated by Django 3.2 on 2026-10-19 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0009_backfill_line_dates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyProduction',
+            fields=[
+                ('monthly_production_pk', models.AutoField(primary_key=True, serialize=False)),
+                ('month', models.DateField()),
+                ('produced', models.IntegerField(default=0)),
+                ('detail_pk', models.ForeignKey(db_column='detail_pk', on_delete=django.db.models.deletion.CASCADE, to='api_app.detail')),
+                ('workshop_pk', models.ForeignKey(db_column='workshop_pk', on_delete=django.db.models.deletion.DO_NOTHING, related_name='monthly_production', to='api_app.workshop')),
+            ],
+            options={
+                'db_table': 'monthly_production',
+                'unique_together': {('workshop_pk', 'month', 'detail_pk')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2 on 2026-10-19 15:10
+
+from django.db import migrations
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+
+def backfill(apps, schema_editor):
+    MonthlyProduction = apps.get_model('api_app', 'MonthlyProduction')
+    ReportLine = apps.get_model('api_app', 'ReportLine')
+
+    totals = ReportLine.objects.filter(
+        workshop_sender_pk__isnull=False, detail_pk__isnull=False, date__isnull=False
+    ).values('workshop_sender_pk', 'detail_pk', month=TruncMonth('date')).annotate(total=Sum('produced')).order_by()
+    MonthlyProduction.objects.bulk_create([
+        MonthlyProduction(workshop_pk_id=row['workshop_sender_pk'], detail_pk_id=row['detail_pk'],
+                          month=row['month'], produced=row['total'])
+        for row in totals.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0010_monthlyproduction'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
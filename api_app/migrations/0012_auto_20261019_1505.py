@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-19 15:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0011_backfill_monthly_production'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productionprogramforthequarterbymonthline',
+            name='production_program_quarter_pk',
+            field=models.ForeignKey(db_column='production_program_quarter_pk', on_delete=django.db.models.deletion.CASCADE, to='api_app.productionprogramforthequarterbymonth'),
+        ),
+        migrations.AddIndex(
+            model_name='productionprogramforthequarterbymonthline',
+            index=models.Index(fields=['production_program_quarter_pk', 'detail_pk', 'month_number'], name='quarter_line_matrix'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2 on 2026-10-19 15:20
+
+import sqlite3
+
+from django.db import migrations
+
+# таблицы FTS5 на момент миграции, дальше их ведет api_app.search
+INDEXED_FIELDS = {
+    'detail': ('detail_name', 'cipher_detail'),
+    'workshop': ('workshop_name', 'cipher_workshop'),
+}
+PK_COLUMNS = {'detail': 'detail_pk', 'workshop': 'workshop_pk'}
+
+
+def fts_supported(schema_editor):
+    return schema_editor.connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def create_tables(apps, schema_editor):
+    if not fts_supported(schema_editor):
+        return
+    quote = schema_editor.quote_name
+    for db_table, fields in INDEXED_FIELDS.items():
+        columns = ', '.join(quote(field) for field in fields)
+        search_table = quote(f'{db_table}_search')
+        prefix_table = quote(f'{db_table}_prefix')
+        schema_editor.execute(f'CREATE VIRTUAL TABLE {search_table} USING fts5({columns}, tokenize="trigram")')
+        schema_editor.execute(f'CREATE VIRTUAL TABLE {prefix_table} '
+                              f'USING fts5({columns}, tokenize="unicode61", prefix="1 2 3")')
+        for table in (search_table, prefix_table):
+            schema_editor.execute(f'INSERT INTO {table} (rowid, {columns}) '
+                                  f'SELECT {quote(PK_COLUMNS[db_table])}, {columns} FROM {quote(db_table)}')
+
+
+def drop_tables(apps, schema_editor):
+    if not fts_supported(schema_editor):
+        return
+    for db_table in INDEXED_FIELDS:
+        schema_editor.execute(f'DROP TABLE IF EXISTS {schema_editor.quote_name(f"{db_table}_search")}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {schema_editor.quote_name(f"{db_table}_prefix")}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0012_auto_20261019_1505'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_tables, drop_tables),
+    ]
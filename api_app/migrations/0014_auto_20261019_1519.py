@@ -0,0 +1,56 @@
+# Generated by Django 3.2 on 2026-10-19 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0013_search_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCounter',
+            fields=[
+                ('counter_pk', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'sync_counter',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('tombstone_pk', models.AutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=20)),
+                ('object_pk', models.IntegerField()),
+                ('sync_token', models.BigIntegerField(db_index=True)),
+            ],
+            options={
+                'db_table': 'sync_tombstone',
+            },
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='sync_token',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='reportline',
+            name='sync_token',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='vedomost',
+            name='sync_token',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='vedomostline',
+            name='sync_token',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-19 15:20
+
+from django.db import migrations
+from django.db.models import F, Max
+
+
+def backfill(apps, schema_editor):
+    SyncCounter = apps.get_model('api_app', 'SyncCounter')
+    # существующие записи получают токены по порядку pk, модель за моделью
+    offset = 0
+    for name in ('Report', 'ReportLine', 'Vedomost', 'VedomostLine'):
+        model = apps.get_model('api_app', name)
+        high = model.objects.aggregate(high=Max('pk'))['high']
+        if high is None:
+            continue
+        model.objects.update(sync_token=F('pk') + offset)
+        offset += high
+    SyncCounter.objects.update_or_create(name='documents', defaults={'value': offset})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0014_auto_20261019_1519'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2 on 2026-10-19 15:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0015_backfill_sync_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('movement_pk', models.AutoField(primary_key=True, serialize=False)),
+                ('direction', models.PositiveSmallIntegerField(choices=[(1, 'received'), (2, 'sent')])),
+                ('date', models.DateField()),
+                ('delta', models.IntegerField()),
+                ('detail_pk', models.ForeignKey(db_column='detail_pk', db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='stock_movements', to='api_app.detail')),
+                ('report_line_pk', models.ForeignKey(db_column='report_line_pk', on_delete=django.db.models.deletion.CASCADE, to='api_app.reportline')),
+                ('workshop_pk', models.ForeignKey(db_column='workshop_pk', db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='stock_movements', to='api_app.workshop')),
+            ],
+            options={
+                'db_table': 'stock_movement',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['workshop_pk', 'date', 'direction', 'detail_pk', 'delta'], name='stock_movement_workshop_date'),
+        ),
+    ]
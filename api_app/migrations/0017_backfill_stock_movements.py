@@ -0,0 +1,38 @@
+# Generated by Django 3.2 on 2026-10-19 15:25
+
+from django.db import migrations
+
+RECEIVED = 1
+SENT = 2
+
+
+def backfill(apps, schema_editor):
+    ReportLine = apps.get_model('api_app', 'ReportLine')
+    StockMovement = apps.get_model('api_app', 'StockMovement')
+
+    lines = ReportLine.objects.exclude(produced=0).filter(detail_pk__isnull=False, date__isnull=False).values_list(
+        'report_line_pk', 'workshop_sender_pk', 'workshop_receiver_pk', 'detail_pk', 'produced', 'date'
+    )
+    batch = []
+    for line_pk, sender_pk, receiver_pk, detail_pk, produced, date in lines.iterator():
+        if receiver_pk is not None:
+            batch.append(StockMovement(report_line_pk_id=line_pk, workshop_pk_id=receiver_pk, detail_pk_id=detail_pk,
+                                       direction=RECEIVED, date=date, delta=produced))
+        if sender_pk is not None:
+            batch.append(StockMovement(report_line_pk_id=line_pk, workshop_pk_id=sender_pk, detail_pk_id=detail_pk,
+                                       direction=SENT, date=date, delta=-produced))
+        if len(batch) >= 1000:
+            StockMovement.objects.bulk_create(batch)
+            batch.clear()
+    StockMovement.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0016_stockmovement'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
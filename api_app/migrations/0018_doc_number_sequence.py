@@ -0,0 +1,37 @@
+# Generated by Django 3.2 on 2026-10-19 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0017_backfill_stock_movements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocNumberSequence',
+            fields=[
+                ('sequence_pk', models.AutoField(primary_key=True, serialize=False)),
+                ('doc_type', models.CharField(max_length=20)),
+                ('workshop_pk', models.IntegerField()),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'doc_number_sequence',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['workshop_sender_pk', 'doc_num'], name='report_workshop_doc_num'),
+        ),
+        migrations.AddIndex(
+            model_name='vedomost',
+            index=models.Index(fields=['workshop_pk', 'doc_num'], name='vedomost_workshop_doc_num'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='docnumbersequence',
+            unique_together={('doc_type', 'workshop_pk')},
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+NGRAM = 3
+INDEXED_FIELDS = {
+    'Detail': ('detail_name', 'cipher_detail'),
+    'Workshop': ('workshop_name', 'cipher_workshop'),
+}
+
+
+def backfill(apps, schema_editor):
+    """Заполняет n-граммы там, где поиск не идет через таблицы FTS5 (см. 0013_search_tables)."""
+    SearchGram = apps.get_model('api_app', 'SearchGram')
+    table_names = schema_editor.connection.introspection.table_names()
+    for model_name, fields in INDEXED_FIELDS.items():
+        model = apps.get_model('api_app', model_name)
+        db_table = model._meta.db_table
+        if f'{db_table}_search' in table_names:
+            continue
+        batch = []
+        for row in model.objects.values_list('pk', *fields).iterator():
+            for field, value in zip(fields, row[1:]):
+                value = (value or '').lower()
+                grams = {value[i:i + size] for size in range(1, NGRAM + 1) for i in range(len(value) - size + 1)}
+                batch += [SearchGram(model=db_table, field=field, gram=gram, object_pk=row[0]) for gram in grams]
+                batch += [SearchGram(model=db_table, field=f'^{field}', gram=value[:size], object_pk=row[0])
+                          for size in range(1, min(len(value), NGRAM) + 1)]
+            if len(batch) >= 5000:
+                SearchGram.objects.bulk_create(batch)
+                batch.clear()
+        SearchGram.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0019_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchGram',
+            fields=[
+                ('gram_pk', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=64)),
+                ('field', models.CharField(max_length=64)),
+                ('gram', models.CharField(max_length=3)),
+                ('object_pk', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'search_gram',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchgram',
+            index=models.Index(fields=['model', 'gram', 'field', 'object_pk'], name='search_gram_lookup'),
+        ),
+        migrations.AddIndex(
+            model_name='searchgram',
+            index=models.Index(fields=['model', 'object_pk'], name='search_gram_object'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2 on 2026-10-19 16:21
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+DOCUMENTS = (
+    ('Report', 'report', 'workshop_sender_pk'),
+    ('Vedomost', 'vedomost', 'workshop_pk'),
+)
+
+
+def renumber_duplicates(apps, schema_editor):
+    """
+    Повторы номера в цехе (случайные номера прежней CreateVedomost, нумерация прежних задач заполнения)
+    получают следующие номера своего цеха, первый по pk документ сохраняет номер.
+    """
+    SyncCounter = apps.get_model('api_app', 'SyncCounter')
+    DocNumberSequence = apps.get_model('api_app', 'DocNumberSequence')
+    for name, doc_type, field in DOCUMENTS:
+        model = apps.get_model('api_app', name)
+        duplicates = model.objects.order_by().values(field, 'doc_num').annotate(count=Count('pk')).filter(count__gt=1)
+        for row in list(duplicates):
+            workshop_pk = row[field]
+            documents = list(model.objects.filter(**{field: workshop_pk}, doc_num=row['doc_num']).order_by('pk')[1:])
+            last = model.objects.filter(**{field: workshop_pk}).aggregate(last=Max('doc_num'))['last']
+            # новые номера должны дойти до клиентов синхронизации
+            counter, _ = SyncCounter.objects.get_or_create(name='documents')
+            for document in documents:
+                last += 1
+                counter.value += 1
+                document.doc_num = last
+                document.sync_token = counter.value
+            counter.save(update_fields=['value'])
+            model.objects.bulk_update(documents, ['doc_num', 'sync_token'], batch_size=500)
+            DocNumberSequence.objects.filter(doc_type=doc_type, workshop_pk=workshop_pk or 0, value__lt=last) \
+                .update(value=last)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_app', '0020_search_gram'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='report',
+            name='report_workshop_doc_num',
+        ),
+        migrations.RemoveIndex(
+            model_name='vedomost',
+            name='vedomost_workshop_doc_num',
+        ),
+        migrations.AlterUniqueTogether(
+            name='report',
+            unique_together={('workshop_sender_pk', 'doc_num')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='vedomost',
+            unique_together={('workshop_pk', 'doc_num')},
+        ),
+    ]
@@ -7,7 +7,47 @@
 # Feel free to rename the models, but don't rename db_table values or field names.
 from datetime import date
 
-from django.db import models
+from django.db import models, transaction
+
+
+class LoadedValuesMixin:
+    """Хранит значения полей на момент загрузки из БД или последнего сохранения в self._loaded_values."""
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    def loaded_value(self, attname):
+        """Значение поля из БД, для нового объекта - None."""
+        if self._loaded_values is None:
+            return None
+        return self._loaded_values.get(attname)
+
+
+class SyncTokenMixin:
+    """
+    Проставляет sync_token из SyncCounter при каждом сохранении (см. api_app.sync).
+    Токен выделяется последним шагом перед INSERT/UPDATE - после pre_save и сохранения родителей.
+    Строка счетчика заблокирована до конца транзакции, поэтому токены появляются в БД по возрастанию;
+    без внешней транзакции это конец save() вместе с обработчиками post_save, которым нужен уже выданный
+    токен (id событий) и которые должны закоммититься вместе с записью.
+    """
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = list(kwargs['update_fields']) + ['sync_token']
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def _save_table(self, raw=False, cls=None, force_insert=False, force_update=False, using=None, update_fields=None):
+        self.sync_token = SyncCounter.reserve(using=using)
+        return super()._save_table(raw, cls, force_insert, force_update, using, update_fields)
 
 
 class Detail(models.Model):
@@ -30,6 +70,40 @@ class InterWorkshopRoutes(models.Model):
         db_table = 'inter_workshop_routes'
 
 
+class Job(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    )
+
+    job_pk = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.IntegerField(default=0)
+    total = models.IntegerField(blank=True, null=True)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    # процесс, в очереди которого задача (см. api_app.jobs), и когда он последний раз ее отмечал
+    worker = models.CharField(max_length=100, blank=True, default='')
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.kind} #{self.job_pk} ({self.status})'
+
+    class Meta:
+        db_table = 'job'
+
+
 class LineOfRoute(models.Model):
     string_route_pk = models.AutoField(primary_key=True)
     workshop_sender_pk = models.ForeignKey('Workshop', models.DO_NOTHING, db_column='workshop_sender_pk', blank=True, null=True, related_name='line_sender')
@@ -42,6 +116,21 @@ class LineOfRoute(models.Model):
         db_table = 'line_of_route'
 
 
+class MonthlyProduction(models.Model):
+    monthly_production_pk = models.AutoField(primary_key=True)
+    workshop_pk = models.ForeignKey('Workshop', models.DO_NOTHING, db_column='workshop_pk', related_name='monthly_production')
+    detail_pk = models.ForeignKey(Detail, models.CASCADE, db_column='detail_pk')
+    month = models.DateField()
+    produced = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.month:%Y-%m} - {self.detail_pk_id} #{self.produced}'
+
+    class Meta:
+        db_table = 'monthly_production'
+        unique_together = (('workshop_pk', 'month', 'detail_pk'),)
+
+
 class ProductionProgramByMonth(models.Model):
     production_program_pk = models.AutoField(primary_key=True)
     start_date = models.DateField()
@@ -61,6 +150,9 @@ class ProductionProgramForTheQuarterByMonth(models.Model):
     production_program_quarter_pk = models.AutoField(primary_key=True)
     quarter_number = models.IntegerField()
 
+    def __str__(self):
+        return f'Квартал {self.quarter_number} (#{self.production_program_quarter_pk})'
+
     class Meta:
         db_table = 'production_program_for_the_quarter_by_month'
 
@@ -68,13 +160,16 @@ class ProductionProgramForTheQuarterByMonth(models.Model):
 class ProductionProgramForTheQuarterByMonthLine(models.Model):
     line_pk = models.AutoField(primary_key=True)
     detail_pk = models.ForeignKey(Detail, models.DO_NOTHING, db_column='detail_pk')
-    production_program_quarter_pk = models.ForeignKey(ProductionProgramForTheQuarterByMonth, models.DO_NOTHING, db_column='production_program_quarter_pk')
+    production_program_quarter_pk = models.ForeignKey(ProductionProgramForTheQuarterByMonth, models.CASCADE, db_column='production_program_quarter_pk')
     amount = models.IntegerField(blank=True, null=True)
     month_number = models.IntegerField(blank=True, null=True)
 
     class Meta:
         db_table = 'production_program_for_the_quarter_by_month_line'
         unique_together = (('line_pk', 'detail_pk', 'production_program_quarter_pk'),)
+        indexes = [
+            models.Index(fields=['production_program_quarter_pk', 'detail_pk', 'month_number'], name='quarter_line_matrix'),
+        ]
 
 
 class ProgramLine(models.Model):
@@ -91,32 +186,182 @@ class ProgramLine(models.Model):
         unique_together = (('program_line_pk', 'production_program_pk', 'detail_pk'),)
 
 
-class Report(models.Model):
+class Report(SyncTokenMixin, LoadedValuesMixin, models.Model):
+    """Дату и цех-отправителя копируют строки; при их изменении копии обновляет api_app.documents."""
     report_pk = models.AutoField(primary_key=True)
     # doc_num = models.CharField(max_length=20)
     doc_num = models.IntegerField()
     date = models.DateField(default=date.today)
     workshop_sender_pk = models.ForeignKey('Workshop', models.DO_NOTHING, db_column='workshop_sender_pk', blank=True, null=True)
+    sync_token = models.BigIntegerField(default=0, db_index=True)
 
     def __str__(self):
         return f'#{self.doc_num} от: {self.date}'
 
     class Meta:
         db_table = 'report'
+        # номера выдает api_app.doc_numbers
+        unique_together = (('workshop_sender_pk', 'doc_num'),)
 
 
-class ReportLine(models.Model):
+class ReportLine(SyncTokenMixin, LoadedValuesMixin, models.Model):
     report_line_pk = models.AutoField(primary_key=True)
     report_pk = models.ForeignKey(Report, models.CASCADE, db_column='report_pk', blank=True, null=True)
     detail_pk = models.ForeignKey(Detail, models.CASCADE, db_column='detail_pk', blank=True, null=True)
     workshop_receiver_pk = models.ForeignKey('Workshop', models.DO_NOTHING, db_column='workshop_receiver_pk', blank=True, null=True)
     produced = models.IntegerField(default=0)
+    # копии report_pk.date и report_pk.workshop_sender_pk, чтобы выборки по периоду обходились без join
+    date = models.DateField(blank=True, null=True)
+    workshop_sender_pk = models.ForeignKey('Workshop', models.DO_NOTHING, db_column='workshop_sender_pk', blank=True, null=True, db_index=False, related_name='sent_report_lines')
+    sync_token = models.BigIntegerField(default=0, db_index=True)
 
     def __str__(self):
         return f'Отчет #{self.report_pk.doc_num}, Деталь {self.detail_pk.detail_name}'
 
+    def save(self, *args, **kwargs):
+        if self.report_pk_id:
+            # у несохраненного заново рапорта дата может быть строкой
+            self.date = self._meta.get_field('date').to_python(self.report_pk.date)
+            self.workshop_sender_pk_id = self.report_pk.workshop_sender_pk_id
+        super().save(*args, **kwargs)
+
     class Meta:
         db_table = 'report_line'
+        indexes = [
+            models.Index(fields=['workshop_sender_pk', 'date', 'detail_pk', 'produced'], name='report_line_sender_date'),
+            models.Index(fields=['workshop_receiver_pk', 'date', 'detail_pk', 'produced'], name='report_line_receiver_date'),
+        ]
+
+
+class SearchGram(models.Model):
+    """
+    N-граммы индексируемых полей для поиска на СУБД без FTS5 (см. api_app.search): подстроки длиной 1..3
+    значения поля в нижнем регистре, а с полем '^<поле>' - начала значения для подсказок.
+    """
+    gram_pk = models.BigAutoField(primary_key=True)
+    # db_table модели
+    model = models.CharField(max_length=64)
+    field = models.CharField(max_length=64)
+    gram = models.CharField(max_length=3)
+    object_pk = models.IntegerField()
+
+    def __str__(self):
+        return f'{self.model}.{self.field} #{self.object_pk}: {self.gram}'
+
+    class Meta:
+        db_table = 'search_gram'
+        indexes = [
+            models.Index(fields=['model', 'gram', 'field', 'object_pk'], name='search_gram_lookup'),
+            models.Index(fields=['model', 'object_pk'], name='search_gram_object'),
+        ]
+
+
+class StockMovement(models.Model):
+    """
+    Движение детали по цеху из строки рапорта: получатель +produced, отправитель -produced.
+    Записи только добавляются - изменение строки дописывает сторно старых значений и новые движения
+    (см. api_app.stock), а удаляются они только вместе со строкой.
+    """
+    RECEIVED = 1
+    SENT = 2
+    DIRECTIONS = ((RECEIVED, 'received'), (SENT, 'sent'))
+
+    movement_pk = models.AutoField(primary_key=True)
+    report_line_pk = models.ForeignKey(ReportLine, models.CASCADE, db_column='report_line_pk')
+    workshop_pk = models.ForeignKey('Workshop', models.DO_NOTHING, db_column='workshop_pk', db_index=False, related_name='stock_movements')
+    detail_pk = models.ForeignKey(Detail, models.DO_NOTHING, db_column='detail_pk', db_index=False, related_name='stock_movements')
+    direction = models.PositiveSmallIntegerField(choices=DIRECTIONS)
+    date = models.DateField()
+    delta = models.IntegerField()
+
+    def __str__(self):
+        return f'{self.date} - {self.workshop_pk_id}: {self.detail_pk_id} {self.delta:+}'
+
+    class Meta:
+        db_table = 'stock_movement'
+        indexes = [
+            models.Index(fields=['workshop_pk', 'date', 'direction', 'detail_pk', 'delta'], name='stock_movement_workshop_date'),
+        ]
+
+
+class SyncCounter(models.Model):
+    """Счетчик токенов синхронизации, одна строка на name."""
+    counter_pk = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+    @classmethod
+    def reserve(cls, count=1, name='documents', using=None):
+        """
+        Выделяет count подряд идущих токенов и возвращает первый.
+        Строка блокируется до конца внешней транзакции - вызывать внутри transaction.atomic().
+        """
+        with transaction.atomic(using=using):
+            counter, _ = cls.objects.using(using).select_for_update().get_or_create(name=name)
+            counter.value += count
+            counter.save(update_fields=['value'])
+        return counter.value - count + 1
+
+    class Meta:
+        db_table = 'sync_counter'
+
+
+class DocNumberSequence(models.Model):
+    """Последний выданный номер документов doc_type цеха, одна строка на пару (см. api_app.doc_numbers)."""
+    sequence_pk = models.AutoField(primary_key=True)
+    doc_type = models.CharField(max_length=20)
+    # 0 - документы без цеха
+    workshop_pk = models.IntegerField()
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.doc_type} {self.workshop_pk}: {self.value}'
+
+    @classmethod
+    def reserve(cls, doc_type, workshop_pk, count=1, last_used=0, using=None):
+        """
+        Выделяет count подряд идущих номеров и возвращает первый.
+        last_used - последний уже занятый номер (или функция, которая его вернет), с него начинается новая пара.
+        Строка блокируется до конца внешней транзакции - вызывать внутри transaction.atomic().
+        """
+        with transaction.atomic(using=using):
+            sequence, _ = cls.objects.using(using).select_for_update().get_or_create(
+                doc_type=doc_type, workshop_pk=workshop_pk, defaults={'value': last_used})
+            sequence.value += count
+            sequence.save(update_fields=['value'])
+        return sequence.value - count + 1
+
+    @classmethod
+    def advance(cls, doc_type, workshop_pk, value, last_used=0, using=None):
+        """Сдвигает последовательность так, чтобы следующий номер был больше value (номер, выбранный клиентом)."""
+        with transaction.atomic(using=using):
+            sequence, _ = cls.objects.using(using).select_for_update().get_or_create(
+                doc_type=doc_type, workshop_pk=workshop_pk, defaults={'value': last_used})
+            if sequence.value < value:
+                sequence.value = value
+                sequence.save(update_fields=['value'])
+
+    class Meta:
+        db_table = 'doc_number_sequence'
+        unique_together = (('doc_type', 'workshop_pk'),)
+
+
+class SyncTombstone(models.Model):
+    """Запись об удалении документа или строки для /api/sync/."""
+    tombstone_pk = models.AutoField(primary_key=True)
+    # ключ раздела ответа синхронизации: reports, report_lines, vedomosts, vedomost_lines
+    model = models.CharField(max_length=20)
+    object_pk = models.IntegerField()
+    sync_token = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f'{self.model} #{self.object_pk} ({self.sync_token})'
+
+    class Meta:
+        db_table = 'sync_tombstone'
 
 
 class UsingInstruction(models.Model):
@@ -143,31 +388,49 @@ class UsingLine(models.Model):
         db_table = 'using_line'
 
 
-class Vedomost(models.Model):
+class Vedomost(SyncTokenMixin, LoadedValuesMixin, models.Model):
+    """Дату и цех копируют строки; при их изменении копии обновляет api_app.documents."""
     vedomost_pk = models.AutoField(primary_key=True)
     doc_num = models.IntegerField()
     creation_date = models.DateField(blank=True, null=True, default=date.today)
     workshop_pk = models.ForeignKey('Workshop', models.DO_NOTHING, db_column='workshop_pk', blank=True, null=True)
+    sync_token = models.BigIntegerField(default=0, db_index=True)
 
     def __str__(self):
         return f'#{self.doc_num} от: {self.creation_date}'
 
     class Meta:
         db_table = 'vedomost'
+        # номера выдает api_app.doc_numbers
+        unique_together = (('workshop_pk', 'doc_num'),)
         get_latest_by = 'creation_date'
 
 
-class VedomostLine(models.Model):
+class VedomostLine(SyncTokenMixin, models.Model):
     vedomost_line_pk = models.AutoField(primary_key=True)
     vedomost_pk = models.ForeignKey(Vedomost, models.CASCADE, db_column='vedomost_pk', blank=True, null=True)
     amount = models.IntegerField(default=0)
     detail_pk = models.ForeignKey(Detail, models.DO_NOTHING, db_column='detail_pk', blank=True, null=True)
+    # копии vedomost_pk.creation_date и vedomost_pk.workshop_pk
+    creation_date = models.DateField(blank=True, null=True)
+    workshop_pk = models.ForeignKey('Workshop', models.DO_NOTHING, db_column='workshop_pk', blank=True, null=True, db_index=False, related_name='vedomost_lines')
+    sync_token = models.BigIntegerField(default=0, db_index=True)
 
     def __str__(self):
         return f'#{self.vedomost_pk.doc_num} - {self.detail_pk.detail_name} x {self.amount}'
 
+    def save(self, *args, **kwargs):
+        if self.vedomost_pk_id:
+            # у несохраненной заново ведомости дата может быть строкой
+            self.creation_date = self._meta.get_field('creation_date').to_python(self.vedomost_pk.creation_date)
+            self.workshop_pk_id = self.vedomost_pk.workshop_pk_id
+        super().save(*args, **kwargs)
+
     class Meta:
         db_table = 'vedomost_line'
+        indexes = [
+            models.Index(fields=['workshop_pk', 'creation_date', 'detail_pk', 'amount'], name='vedomost_line_workshop_date'),
+        ]
 
 
 class Workshop(models.Model):
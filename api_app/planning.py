@@ -0,0 +1,88 @@
+"""
+Плановое количество по производственным программам.
+
+Программа за период [start_date, end_date] учитывается пропорционально пересечению
+с запрошенным периодом: amount * (дней пересечения / дней программы), с округлением по строке.
+Окна программ и строки загружаются двумя запросами и считаются одним векторным шагом на NumPy.
+Без NumPy используется тот же расчет в цикле.
+"""
+import datetime
+import itertools
+
+from api_app.lazy import optional_module
+from api_app.models import ProductionProgramByMonth, ProgramLine
+
+numpy = optional_module('numpy')
+
+
+def load(workshop_pks, start_date, end_date):
+    """
+    Программы, пересекающие период, и их строки:
+    programs - [(production_program_pk, workshop_pk, start_date, end_date)],
+    lines - [(production_program_pk, detail_pk, amount)].
+    """
+    programs = ProductionProgramByMonth.objects.filter(
+        workshop_pk__in=workshop_pks, start_date__lte=end_date, end_date__gte=start_date
+    )
+    lines = ProgramLine.objects.filter(production_program_pk__in=programs.values('production_program_pk')).exclude(amount=0)
+    return (
+        list(programs.values_list('production_program_pk', 'workshop_pk', 'start_date', 'end_date')),
+        list(lines.values_list('production_program_pk', 'detail_pk', 'amount')),
+    )
+
+
+def compute_python(programs, lines, start_date: datetime.date, end_date: datetime.date):
+    coefficients = {}
+    for program_pk, workshop_pk, program_start, program_end in programs:
+        left_border = max(start_date, program_start)
+        right_border = min(end_date, program_end)
+        coefficient = ((right_border - left_border).days + 1) / ((program_end - program_start).days + 1)
+        coefficients[program_pk] = (workshop_pk, coefficient)
+    planned = {}
+    for program_pk, detail_pk, amount in lines:
+        workshop_pk, coefficient = coefficients[program_pk]
+        key = (workshop_pk, detail_pk)
+        planned[key] = planned.get(key, 0) + round(amount * coefficient)
+    return planned
+
+
+def compute_numpy(programs, lines, start_date: datetime.date, end_date: datetime.date):
+    if not lines:
+        return {}
+    count = len(programs)
+    program_pks = numpy.fromiter((program[0] for program in programs), dtype=numpy.int64, count=count)
+    workshops = numpy.fromiter((program[1] for program in programs), dtype=numpy.int64, count=count)
+    starts = numpy.fromiter((program[2].toordinal() for program in programs), dtype=numpy.int64, count=count)
+    ends = numpy.fromiter((program[3].toordinal() for program in programs), dtype=numpy.int64, count=count)
+    left_border = numpy.maximum(starts, start_date.toordinal())
+    right_border = numpy.minimum(ends, end_date.toordinal())
+    coefficients = (right_border - left_border + 1) / (ends - starts + 1)
+
+    line_array = numpy.fromiter(itertools.chain.from_iterable(lines), dtype=numpy.int64, count=len(lines) * 3).reshape(-1, 3)
+    order = numpy.argsort(program_pks)
+    program_index = order[numpy.searchsorted(program_pks, line_array[:, 0], sorter=order)]
+    # numpy.rint, как и round(), округляет половины к четному
+    planned = numpy.rint(line_array[:, 2] * coefficients[program_index])
+
+    # ключ (цех, деталь) упаковывается в одно int64
+    keys = (workshops[program_index] << 32) | line_array[:, 1]
+    keys, inverse = numpy.unique(keys, return_inverse=True)
+    totals = numpy.bincount(inverse, weights=planned).astype(numpy.int64)
+    return {(key >> 32, key & 0xFFFFFFFF): total for key, total in zip(keys.tolist(), totals.tolist())}
+
+
+def compute(programs, lines, start_date, end_date):
+    """{(workshop_pk, detail_pk): planned_amount} по загруженным программам и строкам."""
+    if numpy is None:
+        return compute_python(programs, lines, start_date, end_date)
+    return compute_numpy(programs, lines, start_date, end_date)
+
+
+def planned_amounts(workshop_pks, start_date, end_date):
+    """План по цехам и деталям за период: {(workshop_pk, detail_pk): planned_amount}."""
+    return compute(*load(workshop_pks, start_date, end_date), start_date, end_date)
+
+
+def planned_by_detail(workshop_pk, start_date, end_date):
+    """План одного цеха за период: {detail_pk: planned_amount}."""
+    return {detail_pk: amount for (_, detail_pk), amount in planned_amounts([workshop_pk], start_date, end_date).items()}
@@ -0,0 +1,73 @@
+"""
+Квартальная программа как матрица деталь x месяц.
+Чтение - один запрос со всеми строками и данными деталей, запись - bulk_create/bulk_update/delete.
+"""
+from django.db import transaction
+
+from api_app.models import ProductionProgramForTheQuarterByMonth, ProductionProgramForTheQuarterByMonthLine
+
+
+def load_matrix(program: ProductionProgramForTheQuarterByMonth):
+    """Строки программы, развернутые по месяцам: [{detail_pk, detail_name, cipher_detail, months: {месяц: amount}}]."""
+    cells = ProductionProgramForTheQuarterByMonthLine.objects.filter(
+        production_program_quarter_pk=program
+    ).order_by('detail_pk', 'month_number', 'line_pk').values_list(
+        'detail_pk', 'detail_pk__detail_name', 'detail_pk__cipher_detail', 'month_number', 'amount'
+    )
+    rows = {}
+    for detail_pk, detail_name, cipher_detail, month_number, amount in cells:
+        row = rows.get(detail_pk)
+        if row is None:
+            row = rows[detail_pk] = {
+                'detail_pk': detail_pk,
+                'detail_name': detail_name,
+                'cipher_detail': cipher_detail,
+                'months': {},
+            }
+        row['months'].setdefault(month_number, amount)
+    return list(rows.values())
+
+
+def quarter_months(quarter_number):
+    """Номера месяцев, допустимые в программе квартала; для номера квартала вне 1..4 - любой месяц года."""
+    if quarter_number in (1, 2, 3, 4):
+        return range(3 * quarter_number - 2, 3 * quarter_number + 1)
+    return range(1, 13)
+
+
+@transaction.atomic
+def store_matrix(program: ProductionProgramForTheQuarterByMonth, rows, replace=True):
+    """
+    Записывает матрицу [{detail_pk, months: {месяц: amount}}] в строки программы.
+    replace=True - ячейки, которых нет в матрице, удаляются; иначе остаются как есть.
+    """
+    existing = {}
+    duplicates = []
+    for line in ProductionProgramForTheQuarterByMonthLine.objects.filter(production_program_quarter_pk=program).order_by('line_pk'):
+        key = (line.detail_pk_id, line.month_number)
+        if key in existing:
+            duplicates.append(line.line_pk)
+        else:
+            existing[key] = line
+
+    to_create = []
+    to_update = []
+    for row in rows:
+        for month_number, amount in row['months'].items():
+            line = existing.pop((row['detail_pk'], month_number), None)
+            if line is None:
+                to_create.append(ProductionProgramForTheQuarterByMonthLine(
+                    production_program_quarter_pk=program, detail_pk_id=row['detail_pk'],
+                    month_number=month_number, amount=amount
+                ))
+            elif line.amount != amount:
+                line.amount = amount
+                to_update.append(line)
+
+    to_delete = duplicates
+    if replace:
+        to_delete += [line.line_pk for line in existing.values()]
+    if to_delete:
+        ProductionProgramForTheQuarterByMonthLine.objects.filter(line_pk__in=to_delete).delete()
+    ProductionProgramForTheQuarterByMonthLine.objects.bulk_update(to_update, ['amount'], batch_size=500)
+    ProductionProgramForTheQuarterByMonthLine.objects.bulk_create(to_create, batch_size=500)
@@ -0,0 +1,188 @@
+"""
+Кеш справочных данных (Detail, Workshop) в памяти процесса.
+
+Каждый кеш связан с меткой версии в кеше Django (settings.CACHES). Сохранение или удаление
+записи увеличивает метку (см. api_app.signals), и процессы, увидев новую версию, очищают
+свои копии. Чтобы не обращаться к общему кешу на каждый вызов, метка перепроверяется
+не чаще, чем раз в API_REFERENCE_CACHE_CHECK_INTERVAL секунд; изменения в своем процессе
+видны сразу. Для согласованности между воркерами CACHES должен быть общим (memcached, redis).
+Там же хранятся готовые представления сериализаторов (representation), сбрасываемые вместе с записями.
+Число записей и представлений ограничено API_REFERENCE_CACHE_SIZE, давно не использованные вытесняются.
+
+Возвращаемые объекты общие для всех запросов - изменять их нельзя.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import get_script_prefix
+from rest_framework.settings import api_settings
+
+from api_app import metrics
+from api_app.models import Detail, Workshop
+
+
+class VersionStamp:
+    """Метка версии в кеше Django с локальной копией и редкой перепроверкой."""
+
+    def __init__(self, name):
+        self.key = f'api_app:version:{name}'
+        self.local = None
+        self.checked_at = 0.0
+
+    def current(self):
+        now = time.monotonic()
+        if self.local is None or now - self.checked_at >= getattr(settings, 'API_REFERENCE_CACHE_CHECK_INTERVAL', 1.0):
+            version = cache.get(self.key)
+            if version is None:
+                cache.add(self.key, 1, timeout=None)
+                version = cache.get(self.key, 1)
+            self.local = version
+            self.checked_at = now
+        return self.local
+
+    def bump(self):
+        try:
+            self.local = cache.incr(self.key)
+        except ValueError:
+            cache.add(self.key, 1, timeout=None)
+            self.local = cache.incr(self.key)
+        self.checked_at = time.monotonic()
+
+
+class LRUCache:
+    """Словарь ограниченного размера: при переполнении вытесняются давно не использованные ключи."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def update(self, items):
+        with self.lock:
+            for key, value in items.items():
+                self.data[key] = value
+                self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+
+def cache_size():
+    return getattr(settings, 'API_REFERENCE_CACHE_SIZE', 10000)
+
+
+def link_base(request):
+    """То, от чего зависят ссылки reverse() DRF: начало адреса и ?format= запроса."""
+    format_kwarg = api_settings.URL_FORMAT_OVERRIDE
+    query_params = getattr(request, 'query_params', request.GET)
+    return request.build_absolute_uri(get_script_prefix()), query_params.get(format_kwarg) if format_kwarg else None
+
+
+class ReferenceCache:
+    def __init__(self, model):
+        self.model = model
+        self.stamp = VersionStamp(model._meta.label_lower)
+        self.lock = threading.Lock()
+        self.rows = LRUCache(cache_size())
+        self.representations = LRUCache(cache_size())
+        self.version = None
+        self.stats = metrics.CacheStats(model._meta.label_lower)
+        self.representation_stats = metrics.CacheStats(model._meta.label_lower + ':representation')
+
+    def _rows(self):
+        version = self.stamp.current()
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.rows = LRUCache(cache_size())
+                    self.representations = LRUCache(cache_size())
+                    self.version = version
+        return self.rows
+
+    def get(self, pk):
+        """Объект по pk или None, если его нет."""
+        if pk is None:
+            return None
+        pk = self.model._meta.pk.to_python(pk)
+        rows = self._rows()
+        instance = rows.get(pk)
+        if instance is None:
+            self.stats.record(0, 1)
+            instance = self.model._base_manager.filter(pk=pk).first()
+            if instance is not None:
+                rows.set(pk, instance)
+        else:
+            self.stats.record(1)
+        return instance
+
+    def get_many(self, pks):
+        """{pk: объект} в порядке pks для всех найденных, недостающие загружаются одним запросом."""
+        to_python = self.model._meta.pk.to_python
+        pks = [to_python(pk) for pk in pks if pk is not None]
+        rows = self._rows()
+        found = {}
+        for pk in pks:
+            instance = rows.get(pk)
+            if instance is not None:
+                found[pk] = instance
+        missing = [pk for pk in pks if pk not in found]
+        self.stats.record(len(pks) - len(missing), len(missing))
+        if missing:
+            loaded = self.model._base_manager.in_bulk(missing)
+            rows.update(loaded)
+            found.update(loaded)
+        return {pk: found[pk] for pk in pks if pk in found}
+
+    def representation(self, pk, request, serializer_class):
+        """
+        Копия serializer_class(объект).data. Готовый словарь кешируется по (pk, начало адресов ссылок,
+        ?format= запроса - reverse() DRF переносит его в ссылки), так что сериализатор и reverse()
+        для ссылок вызываются один раз на объект.
+        """
+        self._rows()
+        representations = self.representations
+        key = (serializer_class, pk) + (link_base(request) if request is not None else (None, None))
+        data = representations.get(key)
+        self.representation_stats.record(data is not None, data is None)
+        if data is None:
+            data = serializer_class(instance=self.get(pk), context={'request': request}).data
+            if pk is not None:
+                representations.set(key, data)
+        return dict(data)
+
+    def invalidate(self):
+        self.stamp.bump()
+        with self.lock:
+            self.rows = LRUCache(cache_size())
+            self.representations = LRUCache(cache_size())
+            self.version = self.stamp.local
+
+
+details = ReferenceCache(Detail)
+workshops = ReferenceCache(Workshop)
+
+CACHES = {
+    Detail: details,
+    Workshop: workshops,
+}
+
+
+def invalidate(model):
+    reference_cache = CACHES.get(model)
+    if reference_cache is not None:
+        reference_cache.invalidate()
@@ -0,0 +1,84 @@
+"""
+Дополнительные рендереры для больших ответов.
+
+FastJSONRenderer - замена JSONRenderer на orjson (если установлен) с тем же выводом:
+числа, которые orjson записал бы иначе (1e16 вместо 1e+16, null вместо ошибки на NaN,
+ошибка на целых больше 64 бит), отдаются обычному JSONRenderer,
+MsgPackRenderer - компактный двоичный формат (application/msgpack, ?format=msgpack).
+Типы, которые библиотеки не знают (даты, Decimal, ленивые строки), приводятся
+кодировщиком DRF, как и в JSONRenderer.
+"""
+from decimal import Decimal
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_encoder = encoders.JSONEncoder()
+
+# значения, которые orjson и json пишут одинаково: обход данных их пропускает
+_PLAIN_TYPES = {str, int, bool, type(None)}
+
+
+def _has_exotic_float(data):
+    """Есть ли в данных дробное число, которое orjson запишет не так, как json: экспонента, NaN, бесконечность."""
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            items = value.values()
+        elif isinstance(value, (list, tuple)):
+            items = value
+        else:
+            if isinstance(value, (float, Decimal)):
+                # в этом диапазоне orjson и repr() пишут конечные числа одинаково
+                value = float(value)
+                if not (value == 0 or 1e-4 <= abs(value) < 1e16):
+                    return True
+            continue
+        for item in items:
+            if type(item) not in _PLAIN_TYPES:
+                stack.append(item)
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None or _has_exotic_float(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        # datetime отдаем кодировщику DRF, чтобы формат совпадал с JSONRenderer
+        try:
+            ret = orjson.dumps(data, default=_encoder.default,
+                               option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+        except orjson.JSONEncodeError:
+            # целые больше 64 бит и то, на чем orjson спотыкается, - как в JSONRenderer
+            return super().render(data, accepted_media_type, renderer_context)
+        # как и JSONRenderer, экранируем \u2028 и \u2029
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class MsgPackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
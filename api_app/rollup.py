@@ -0,0 +1,150 @@
+"""
+Помесячные итоги выпуска (MonthlyProduction) по цеху-отправителю и детали.
+Поддерживаются инкрементально сигналами ReportLine и Report (см. api_app.signals).
+Массовые операции в обход save/delete должны вызывать rebuild().
+"""
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth
+
+from api_app.models import MonthlyProduction, Report, ReportLine
+
+
+def month_start(day: datetime.date):
+    # дата из несохраненного заново документа бывает строкой ISO, как ее передали в create()
+    if isinstance(day, str):
+        day = datetime.date.fromisoformat(day)
+    return day.replace(day=1)
+
+
+def next_month(day: datetime.date):
+    """Первое число следующего месяца или None, если выходим за datetime.date.max."""
+    if day.month == 12:
+        if day.year == datetime.MAXYEAR:
+            return None
+        return datetime.date(day.year + 1, 1, 1)
+    return datetime.date(day.year, day.month + 1, 1)
+
+
+def full_months(start_date, end_date):
+    """
+    Делит период на целые месяцы и края.
+    Возвращает (первый целый месяц, последний целый месяц) или None, если целых месяцев нет.
+    """
+    first = start_date if start_date.day == 1 else next_month(start_date)
+    following = next_month(end_date)
+    if following is None:
+        ends_month = end_date == datetime.date.max
+    else:
+        ends_month = following - datetime.timedelta(1) == end_date
+    if ends_month:
+        last = month_start(end_date)
+    elif month_start(end_date) == datetime.date.min:
+        return None
+    else:
+        last = month_start(month_start(end_date) - datetime.timedelta(1))
+    if first is None or first > last:
+        return None
+    return first, last
+
+
+def add(workshop_pk, detail_pk, month, delta):
+    if not delta or workshop_pk is None or detail_pk is None or month is None:
+        return
+    rows = MonthlyProduction.objects.filter(workshop_pk=workshop_pk, detail_pk=detail_pk, month=month)
+    if rows.update(produced=F('produced') + delta):
+        return
+    try:
+        with transaction.atomic():
+            MonthlyProduction.objects.create(workshop_pk_id=workshop_pk, detail_pk_id=detail_pk, month=month, produced=delta)
+    except IntegrityError:
+        # строку успели создать параллельно
+        rows.update(produced=F('produced') + delta)
+
+
+def _line_key(workshop_pk, detail_pk, day):
+    return workshop_pk, detail_pk, day and month_start(day)
+
+
+def line_saved(line: ReportLine):
+    old_key = _line_key(line.loaded_value('workshop_sender_pk_id'), line.loaded_value('detail_pk_id'), line.loaded_value('date'))
+    new_key = _line_key(line.workshop_sender_pk_id, line.detail_pk_id, line.date)
+    old_produced = line.loaded_value('produced') or 0
+    if old_key == new_key:
+        add(*new_key, line.produced - old_produced)
+    else:
+        add(*old_key, -old_produced)
+        add(*new_key, line.produced)
+
+
+def line_deleted(line: ReportLine):
+    if line._loaded_values is None:
+        add(*_line_key(line.workshop_sender_pk_id, line.detail_pk_id, line.date), -line.produced)
+    else:
+        add(*_line_key(line.loaded_value('workshop_sender_pk_id'), line.loaded_value('detail_pk_id'), line.loaded_value('date')),
+            -(line.loaded_value('produced') or 0))
+
+
+def lines_created(rows):
+    """Учет строк, созданных в обход save: rows - [(report_line_pk, sender_pk, receiver_pk, detail_pk, produced, date)]."""
+    totals = {}
+    for _, sender_pk, _, detail_pk, produced, day in rows:
+        key = _line_key(sender_pk, detail_pk, day)
+        totals[key] = totals.get(key, 0) + produced
+    for key, produced in totals.items():
+        add(*key, produced)
+
+
+def report_saved(report: Report):
+    """Перенос строк рапорта при смене даты или цеха-отправителя."""
+    old_key = (report.loaded_value('workshop_sender_pk_id'), month_start(report.loaded_value('date') or report.date))
+    new_key = (report.workshop_sender_pk_id, month_start(report.date))
+    if report._loaded_values is None or old_key == new_key:
+        return
+    totals = report.reportline_set.values('detail_pk').annotate(total=Sum('produced')).order_by()
+    for row in totals:
+        add(old_key[0], row['detail_pk'], old_key[1], -row['total'])
+        add(new_key[0], row['detail_pk'], new_key[1], row['total'])
+
+
+@transaction.atomic
+def rebuild():
+    MonthlyProduction.objects.all().delete()
+    totals = ReportLine.objects.filter(
+        workshop_sender_pk__isnull=False, detail_pk__isnull=False, date__isnull=False
+    ).values('workshop_sender_pk', 'detail_pk', month=TruncMonth('date')).annotate(total=Sum('produced')).order_by()
+    batch = []
+    for row in totals.iterator():
+        batch.append(MonthlyProduction(workshop_pk_id=row['workshop_sender_pk'], detail_pk_id=row['detail_pk'],
+                                       month=row['month'], produced=row['total']))
+        if len(batch) >= 1000:
+            MonthlyProduction.objects.bulk_create(batch)
+            batch.clear()
+    MonthlyProduction.objects.bulk_create(batch)
+
+
+def produced_by_detail(workshop_pk, start_date, end_date):
+    """
+    Выпуск цеха за период {detail_pk: produced}: целые месяцы берутся из итогов,
+    по строкам рапортов считаются только неполные месяцы по краям.
+    """
+    lines = ReportLine.objects.filter(workshop_sender_pk=workshop_pk).exclude(produced=0)
+    months = full_months(start_date, end_date)
+    if months is None:
+        querysets = [lines.filter(date__gte=start_date, date__lte=end_date)]
+    else:
+        first, last = months
+        following = next_month(last)
+        querysets = [
+            MonthlyProduction.objects.filter(workshop_pk=workshop_pk, month__gte=first, month__lte=last).exclude(produced=0),
+            lines.filter(date__gte=start_date, date__lt=first),
+        ]
+        if following is not None:
+            querysets.append(lines.filter(date__gte=following, date__lte=end_date))
+    produced = {}
+    for queryset in querysets:
+        for row in queryset.values('detail_pk').annotate(total=Sum('produced')).order_by():
+            produced[row['detail_pk']] = produced.get(row['detail_pk'], 0) + row['total']
+    return produced
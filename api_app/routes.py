@@ -0,0 +1,96 @@
+"""
+Межцеховые маршруты деталей (LineOfRoute) в памяти процесса.
+Граф загружается одним запросом при первом обращении и сбрасывается сигналами
+при изменении LineOfRoute или InterWorkshopRoutes (см. api_app.signals). Сброс увеличивает
+метку версии в кеше Django (VersionStamp), поэтому другие процессы тоже перечитывают граф.
+"""
+import threading
+
+from api_app import metrics
+from api_app.models import LineOfRoute
+from api_app.reference_cache import VersionStamp
+
+
+class RouteGraph:
+    def __init__(self, rows):
+        """rows - [(workshop_sender_pk, workshop_receiver_pk, detail_pk, details_amount)]."""
+        # (detail_pk, workshop_sender_pk) -> {workshop_receiver_pk: details_amount}
+        self.next = {}
+        # workshop_receiver_pk -> {detail_pk: details_amount}
+        self.inflow = {}
+        # detail_pk -> есть ли у детали хоть один маршрут
+        self.routed_details = set()
+        for sender_pk, receiver_pk, detail_pk, amount in rows:
+            receivers = self.next.setdefault((detail_pk, sender_pk), {})
+            receivers[receiver_pk] = receivers.get(receiver_pk, 0) + amount
+            inflow = self.inflow.setdefault(receiver_pk, {})
+            inflow[detail_pk] = inflow.get(detail_pk, 0) + amount
+            self.routed_details.add(detail_pk)
+
+    def next_workshops(self, detail_pk, workshop_sender_pk):
+        """Куда деталь идет дальше из цеха: {workshop_receiver_pk: details_amount}."""
+        return self.next.get((detail_pk, workshop_sender_pk), {})
+
+    def expected_inflow(self, workshop_pk):
+        """Что должно приходить в цех по маршрутам: {detail_pk: details_amount}."""
+        return self.inflow.get(workshop_pk, {})
+
+    def is_allowed(self, workshop_sender_pk, workshop_receiver_pk, detail_pk):
+        return workshop_receiver_pk in self.next.get((detail_pk, workshop_sender_pk), ())
+
+    def check_line(self, workshop_sender_pk, workshop_receiver_pk, detail_pk):
+        """Текст ошибки, если передача не соответствует маршрутам, иначе None."""
+        if detail_pk not in self.routed_details:
+            return f'No routes for detail {detail_pk}'
+        if not self.is_allowed(workshop_sender_pk, workshop_receiver_pk, detail_pk):
+            return f'Detail {detail_pk} is not routed from workshop {workshop_sender_pk} to workshop {workshop_receiver_pk}'
+        return None
+
+    def check_lines(self, workshop_sender_pk, lines):
+        """Ошибки по строкам [(report_line_pk, workshop_receiver_pk, detail_pk)]: [{'report_line_pk': ..., 'error': ...}]."""
+        errors = []
+        for report_line_pk, receiver_pk, detail_pk in lines:
+            error = self.check_line(workshop_sender_pk, receiver_pk, detail_pk)
+            if error:
+                errors.append({'report_line_pk': report_line_pk, 'error': error})
+        return errors
+
+    def check_report(self, report):
+        """Ошибки по строкам рапорта: [{'report_line_pk': ..., 'error': ...}]."""
+        return self.check_lines(report.workshop_sender_pk_id, report.reportline_set.values_list(
+            'report_line_pk', 'workshop_receiver_pk', 'detail_pk'))
+
+
+_graph = None
+_version = None
+_generation = 0
+_lock = threading.Lock()
+_stamp = VersionStamp('routes')
+_stats = metrics.CacheStats('routes')
+
+
+def get_graph() -> RouteGraph:
+    global _graph, _version
+    version = _stamp.current()
+    graph = _graph if _version == version else None
+    _stats.record(graph is not None, graph is None)
+    if graph is None:
+        with _lock:
+            graph = _graph if _version == version else None
+            if graph is None:
+                generation = _generation
+                graph = RouteGraph(LineOfRoute.objects.values_list(
+                    'workshop_sender_pk', 'workshop_receiver_pk', 'detail_pk', 'details_amount'
+                ))
+                # маршруты могли измениться во время загрузки - тогда не кешируем
+                if generation == _generation:
+                    _graph = graph
+                    _version = version
+    return graph
+
+
+def invalidate():
+    global _graph, _generation
+    _stamp.bump()
+    _generation += 1
+    _graph = None
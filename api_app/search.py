@@ -0,0 +1,233 @@
+"""
+Индексированный поиск по деталям и цехам.
+
+На SQLite с токенизатором trigram (3.34+) используются виртуальные таблицы FTS5,
+rowid которых совпадает с первичным ключом: <db_table>_search (trigram) для поиска подстрок
+и <db_table>_prefix (unicode61 с префиксным индексом) для подсказок по началу значения.
+На остальных СУБД - таблица n-грамм SearchGram: подстроки длиной 1..3 каждого значения,
+поиск - подзапрос по ее индексу и проверка LIKE только найденных записей. Индекс хранится в базе,
+поэтому одинаков для всех процессов. Оба поддерживаются сигналами save/delete
+(см. api_app.signals), после массовых операций нужно вызвать rebuild().
+
+Поиск повторяет семантику SearchFilter: каждое слово запроса должно входить
+(без учета регистра) хотя бы в одно из полей.
+"""
+import operator
+import sqlite3
+import threading
+from functools import reduce
+
+from django.db import OperationalError, connection
+from django.db.models import Count, Q
+from django.db.models.expressions import RawSQL
+
+from api_app.models import Detail, SearchGram, Workshop
+
+INDEXED_FIELDS = {
+    Detail: ('detail_name', 'cipher_detail'),
+    Workshop: ('workshop_name', 'cipher_workshop'),
+}
+
+NGRAM = 3
+
+
+def table_name(model):
+    return f'{model._meta.db_table}_search'
+
+
+def prefix_table_name(model):
+    return f'{model._meta.db_table}_prefix'
+
+
+def fts_supported(vendor):
+    return vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def _fill_fts(db, model, fields, quote):
+    columns = ', '.join(quote(field) for field in fields)
+    with db.cursor() as cursor:
+        for table in (table_name(model), prefix_table_name(model)):
+            cursor.execute(f'INSERT INTO {quote(table)} (rowid, {columns}) '
+                           f'SELECT {quote(model._meta.pk.column)}, {columns} FROM {quote(model._meta.db_table)}')
+
+
+def _like_pattern(text):
+    text = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{text}%'
+
+
+class FTSIndex:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.quote = connection.ops.quote_name
+        self.table = self.quote(table_name(model))
+        self.prefix_table = self.quote(prefix_table_name(model))
+
+    def _columns_condition(self, fields, text):
+        condition = ' OR '.join(f"{self.quote(field)} LIKE %s ESCAPE '\\'" for field in fields)
+        return condition, [_like_pattern(text)] * len(fields)
+
+    def filter(self, queryset, terms, fields):
+        for term in terms:
+            if len(term) >= NGRAM:
+                columns = ' '.join(fields)
+                phrase = '"' + term.replace('"', '""') + '"'
+                sql = f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s'
+                params = [f'{{{columns}}}: {phrase}']
+            else:
+                # слова короче триграммы - обычный LIKE по таблице поиска (регистр без учета только для ASCII)
+                condition, params = self._columns_condition(fields, term)
+                sql = f'SELECT rowid FROM {self.table} WHERE {condition}'
+            queryset = queryset.filter(pk__in=RawSQL(sql, params))
+        return queryset
+
+    def autocomplete(self, prefix, limit):
+        # ^ - совпадение с начала значения поля, * - префикс последнего слова
+        query = '{%s} : ^"%s"*' % (' '.join(self.fields), prefix.replace('"', '""'))
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(f'SELECT rowid FROM {self.prefix_table} WHERE {self.prefix_table} MATCH %s LIMIT %s', [query, limit])
+            except OperationalError:
+                # в префиксе нет ни одного символа слова
+                return []
+            return [row[0] for row in cursor.fetchall()]
+
+    def update(self, instance):
+        columns = ', '.join(self.quote(field) for field in self.fields)
+        placeholders = ', '.join(['%s'] * (len(self.fields) + 1))
+        with connection.cursor() as cursor:
+            for table in (self.table, self.prefix_table):
+                cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [instance.pk])
+                cursor.execute(f'INSERT INTO {table} (rowid, {columns}) VALUES ({placeholders})',
+                               [instance.pk] + [getattr(instance, field) for field in self.fields])
+
+    def remove(self, pk):
+        with connection.cursor() as cursor:
+            for table in (self.table, self.prefix_table):
+                cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [pk])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            for table in (self.table, self.prefix_table):
+                cursor.execute(f'DELETE FROM {table}')
+        _fill_fts(connection, self.model, self.fields, self.quote)
+
+
+def grams(value):
+    """N-граммы длиной 1..NGRAM значения в нижнем регистре."""
+    value = (value or '').lower()
+    return {value[i:i + size] for size in range(1, NGRAM + 1) for i in range(len(value) - size + 1)}
+
+
+class GramIndex:
+    """Индекс в таблице SearchGram: записи-кандидаты по n-граммам слова, затем LIKE только по ним."""
+    BATCH_SIZE = 5000
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.table = model._meta.db_table
+
+    def _rows(self, pk, values):
+        rows = []
+        for field, value in zip(self.fields, values):
+            rows += [SearchGram(model=self.table, field=field, gram=gram, object_pk=pk) for gram in grams(value)]
+            value = (value or '').lower()
+            rows += [SearchGram(model=self.table, field=f'^{field}', gram=value[:size], object_pk=pk)
+                     for size in range(1, min(len(value), NGRAM) + 1)]
+        return rows
+
+    def _candidates(self, fields, term_grams):
+        """pk записей, у которых в одном из полей есть все n-граммы term_grams (подзапрос)."""
+        return SearchGram.objects.filter(model=self.table, field__in=fields, gram__in=term_grams) \
+            .values('object_pk', 'field').annotate(found=Count('gram', distinct=True)) \
+            .filter(found=len(term_grams)).values('object_pk')
+
+    def filter(self, queryset, terms, fields):
+        for term in terms:
+            term_grams = {term.lower()} if len(term) <= NGRAM else \
+                {term.lower()[i:i + NGRAM] for i in range(len(term) - NGRAM + 1)}
+            queryset = queryset.filter(
+                reduce(operator.or_, (Q(**{f'{field}__icontains': term}) for field in fields)),
+                pk__in=self._candidates(fields, term_grams),
+            )
+        return queryset
+
+    def autocomplete(self, prefix, limit):
+        start = prefix.lower()[:NGRAM]
+        found = []
+        for field in self.fields:
+            candidates = SearchGram.objects.filter(model=self.table, field=f'^{field}', gram=start).values('object_pk')
+            pks = self.model._base_manager.filter(pk__in=candidates, **{f'{field}__istartswith': prefix}) \
+                .exclude(pk__in=found).order_by(field, 'pk').values_list('pk', flat=True)[:limit - len(found)]
+            found += pks
+            if len(found) >= limit:
+                break
+        return found
+
+    def update(self, instance):
+        self.remove(instance.pk)
+        SearchGram.objects.bulk_create(self._rows(instance.pk, [getattr(instance, field) for field in self.fields]))
+
+    def remove(self, pk):
+        SearchGram.objects.filter(model=self.table, object_pk=pk).delete()
+
+    def rebuild(self):
+        SearchGram.objects.filter(model=self.table).delete()
+        batch = []
+        for row in self.model._base_manager.values_list('pk', *self.fields).iterator():
+            batch += self._rows(row[0], row[1:])
+            if len(batch) >= self.BATCH_SIZE:
+                SearchGram.objects.bulk_create(batch)
+                batch.clear()
+        SearchGram.objects.bulk_create(batch)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _fts_table_exists(model):
+    return table_name(model) in connection.introspection.table_names()
+
+
+def get_index(model):
+    """Индекс модели или None, если модель не индексируется."""
+    if model not in INDEXED_FIELDS:
+        return None
+    key = (connection.alias, model)
+    index = _indexes.get(key)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                if fts_supported(connection.vendor) and _fts_table_exists(model):
+                    index = FTSIndex(model, INDEXED_FIELDS[model])
+                else:
+                    index = GramIndex(model, INDEXED_FIELDS[model])
+                _indexes[key] = index
+    return index
+
+
+def autocomplete(model, prefix, limit=10):
+    """pk записей, у которых одно из индексируемых полей начинается с prefix."""
+    if not prefix:
+        return []
+    return get_index(model).autocomplete(prefix, limit)
+
+
+def update(instance):
+    index = get_index(type(instance))
+    if index is not None:
+        index.update(instance)
+
+
+def remove(instance):
+    index = get_index(type(instance))
+    if index is not None:
+        index.remove(instance.pk)
+
+
+def rebuild(model):
+    get_index(model).rebuild()
@@ -1,8 +1,135 @@
-from rest_framework import serializers
-from .models import Detail, Report, ReportLine, VedomostLine, Vedomost, Workshop
+from collections import Counter
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from . import doc_numbers, quarterly, reference_cache, routes
+from .models import Detail, Report, ReportLine, VedomostLine, Vedomost, Workshop, Job, ProductionProgramForTheQuarterByMonth
+
+
+def parse_field_spec(value):
+    """'a,b.c,b.d' -> {'a': {}, 'b': {'c': {}, 'd': {}}}."""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in filter(None, (part.strip() for part in path.split('.'))):
+            node = node.setdefault(name, {})
+    return tree
+
+
+class DynamicFieldsMixin:
+    """
+    Выбор полей ответа параметрами запроса, вложенные поля через точку:
+    ?fields=report_pk,report_lines.produced - только перечисленные поля,
+    ?omit=url,report_lines.detail - все, кроме перечисленных,
+    ?expand=report_lines - раскрыть только перечисленные вложенные поля (collapsed_fields),
+    остальные сворачиваются (в список pk или убираются). Без ?expand= раскрыто все, как раньше.
+    Параметры действуют только на чтение и только для сериализатора представления (в контексте есть view),
+    либо задаются явно аргументом field_spec.
+    Невыбранные поля не создаются вовсе, а optimize_queryset() префетчит только нужные вложенные списки.
+    """
+    # поле -> фабрика свернутого поля или None, если свернутое поле убирается
+    collapsed_fields = {}
+
+    def __init__(self, *args, field_spec=None, **kwargs):
+        # field_spec - (fields, omit, expand) вместо параметров запроса, например для внутренних ответов
+        self._field_spec = field_spec
+        super().__init__(*args, **kwargs)
+
+    def get_field_spec(self):
+        """(fields, omit, expand) - деревья из parse_field_spec или None, если параметра нет."""
+        spec = getattr(self, '_field_spec', None)
+        if spec is not None:
+            return spec
+        request = self.context.get('request')
+        if 'view' not in self.context or request is None or request.method not in SAFE_METHODS:
+            return None, None, None
+        params = request.query_params
+        return tuple(parse_field_spec(params[name]) if name in params else None for name in ('fields', 'omit', 'expand'))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        only, omit, expand = self.get_field_spec()
+        if only:
+            fields = {name: field for name, field in fields.items() if name in only}
+        for name, subtree in (omit or {}).items():
+            if not subtree:
+                fields.pop(name, None)
+        if expand is not None:
+            for name, collapsed in self.collapsed_fields.items():
+                if name in fields and name not in expand:
+                    if collapsed is None:
+                        del fields[name]
+                    else:
+                        fields[name] = collapsed()
+
+        # передаем вложенным сериализаторам их часть параметров
+        self.nested_field_specs = {}
+        for name, field in fields.items():
+            spec = ((only or {}).get(name) or None, (omit or {}).get(name) or None,
+                    None if expand is None else expand.get(name, {}))
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(nested, DynamicFieldsMixin):
+                nested._field_spec = spec
+            else:
+                self.nested_field_specs[name] = spec
+        return fields
+
+    def restrict(self, name, data):
+        """Применяет ?fields=/?omit= к словарю, который поле name строит само (SerializerMethodField)."""
+        only, omit, _ = self.nested_field_specs.get(name, (None, None, None))
+        if only:
+            data = {key: value for key, value in data.items() if key in only}
+        for key, subtree in (omit or {}).items():
+            if not subtree:
+                data.pop(key, None)
+        return data
 
-class DetailSerializer(serializers.ModelSerializer):
+    def optimize_queryset(self, queryset):
+        """Префетч обратных связей только для полей, которые попадут в ответ."""
+        related_models = {relation.get_accessor_name(): relation.related_model for relation in queryset.model._meta.related_objects}
+        for field in self.fields.values():
+            if field.source not in related_models:
+                continue
+            nested = getattr(field, 'child', None)
+            related_model = related_models[field.source]
+            related = related_model._default_manager.all()
+            if isinstance(nested, DynamicFieldsMixin):
+                related = nested.optimize_queryset(related)
+            queryset = queryset.prefetch_related(Prefetch(field.source, queryset=related))
+        return queryset
+
+
+class DocNumberMixin:
+    """
+    Номер рапорта или ведомости уникален внутри цеха. Документ без doc_num получает следующий номер
+    своего цеха (api_app.doc_numbers), при переносе в другой цех без нового номера - следующий номер того цеха.
+    """
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        doc_num = attrs.get('doc_num')
+        if doc_num is not None:
+            _, field = doc_numbers.DOCUMENTS[self.Meta.model]
+            workshop = attrs[field] if field in attrs else getattr(self.instance, field, None)
+            workshop_pk = workshop.workshop_pk if workshop else None
+            if doc_numbers.taken(self.Meta.model, [(workshop_pk, doc_num)], self.instance and self.instance.pk):
+                raise serializers.ValidationError({'doc_num': [f'Document number {doc_num} is already used in this workshop']})
+        return attrs
+
+    def document_number(self, validated_data, instance=None):
+        """Номер документа после create (instance=None) или update."""
+        _, field = doc_numbers.DOCUMENTS[self.Meta.model]
+        workshop = validated_data.get(field, getattr(instance, field, None))
+        workshop_pk = workshop.workshop_pk if workshop else None
+        if instance is not None and 'doc_num' not in validated_data and workshop_pk == getattr(instance, f'{field}_id'):
+            return instance.doc_num
+        return doc_numbers.number(self.Meta.model, workshop_pk, validated_data.get('doc_num'))
+
+
+class DetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name='api:detail-detail')
 
     class Meta:
@@ -10,6 +137,11 @@ class DetailSerializer(serializers.ModelSerializer):
         fields = ['url', 'detail_pk', 'detail_name', 'cipher_detail']
 
 
+def detail_data(detail_pk, request):
+    """Представление детали из кеша - изменяемая копия DetailSerializer(...).data."""
+    return reference_cache.details.representation(detail_pk, request, DetailSerializer)
+
+
 class WorkshopSerializer(serializers.ModelSerializer):
     url = serializers.HyperlinkedIdentityField(view_name='api:workshop-detail')
 
@@ -18,25 +150,84 @@ class WorkshopSerializer(serializers.ModelSerializer):
         fields = ['url', 'workshop_pk', 'workshop_name', 'cipher_workshop']
 
 
-class ReportLineSerializer(serializers.ModelSerializer):
+class ReportLineSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     detail = serializers.SerializerMethodField()
     url = serializers.HyperlinkedIdentityField(view_name='api:report-line-detail')
+    collapsed_fields = {'detail': None}
 
     def get_detail(self, obj):
-        data = DetailSerializer(instance=obj.detail_pk, context={'request': self.context['request']}).data
+        data = detail_data(obj.detail_pk_id, self.context['request'])
         data.pop('detail_pk')
-        return data
+        return self.restrict('detail', data)
 
     class Meta:
         model = ReportLine
         fields = ['url', 'report_line_pk', 'report_pk', 'detail_pk', 'produced', 'detail', 'workshop_receiver_pk']
 
 
-class ReportSerializer(serializers.ModelSerializer):
+class ReportSerializer(DocNumberMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     report_lines = ReportLineSerializer(read_only=True, many=True, allow_null=True, source='reportline_set', required=False)
     url = serializers.HyperlinkedIdentityField(view_name='api:report-detail')
+    collapsed_fields = {
+        'report_lines': lambda: serializers.PrimaryKeyRelatedField(read_only=True, many=True, source='reportline_set'),
+    }
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if self.validate_routes_enabled():
+            self.validate_routes(attrs)
+        return attrs
+
+    def validate_routes_enabled(self):
+        """Проверка по маршрутам включается настройкой API_VALIDATE_ROUTES или параметром ?validate_routes=1."""
+        request = self.context.get('request')
+        if request is not None and 'validate_routes' in request.query_params:
+            return request.query_params['validate_routes'] not in ('0', 'false', '')
+        return getattr(settings, 'API_VALIDATE_ROUTES', False)
+
+    def validate_routes(self, attrs):
+        """
+        Все строки проверяются по графу маршрутов за один проход, без запросов на строку.
+        При изменении рапорта недостающие в запросе поля строк берутся из сохраненных строк,
+        а если строки не переданы, но меняется цех-отправитель, проверяются сохраненные строки.
+        """
+        if 'workshop_sender_pk' in attrs:
+            sender = attrs['workshop_sender_pk']
+        else:
+            sender = self.instance.workshop_sender_pk if self.instance else None
+        sender_pk = sender.workshop_pk if sender else None
+        graph = routes.get_graph()
+        if 'report_lines' not in self.initial_data:
+            if self.instance is not None and sender_pk != self.instance.workshop_sender_pk_id:
+                errors = graph.check_lines(sender_pk, self.instance.reportline_set.values_list(
+                    'report_line_pk', 'workshop_receiver_pk', 'detail_pk'))
+                if errors:
+                    raise serializers.ValidationError({'workshop_sender_pk': errors})
+            return
+
+        stored = {}
+        if self.instance is not None:
+            stored = {pk: {'workshop_receiver_pk': receiver_pk, 'detail_pk': detail_pk}
+                      for pk, receiver_pk, detail_pk in self.instance.reportline_set.values_list(
+                          'report_line_pk', 'workshop_receiver_pk', 'detail_pk')}
+        errors = []
+        for line in self.initial_data['report_lines']:
+            error = None
+            try:
+                line = {**stored.get(line.get('report_line_pk'), {}), **line}
+                receiver_pk = int(line['workshop_receiver_pk']) if line.get('workshop_receiver_pk') is not None else None
+                detail_pk = int(line['detail_pk']) if line.get('detail_pk') is not None else None
+            except (TypeError, ValueError, AttributeError):
+                # некорректные значения отсеет сама строка рапорта
+                detail_pk = None
+            if detail_pk is not None:
+                error = graph.check_line(sender_pk, receiver_pk, detail_pk)
+            errors.append({'route': [error]} if error else {})
+        if any(errors):
+            raise serializers.ValidationError({'report_lines': errors})
 
     def create(self, validated_data):
+        validated_data['doc_num'] = self.document_number(validated_data)
         report = Report.objects.create(**validated_data)
         lines = self.initial_data.get('report_lines', [])
         for line in lines:
@@ -47,12 +238,15 @@ class ReportSerializer(serializers.ModelSerializer):
         return report
 
     def update(self, instance: Report, validated_data):
-        instance.doc_num = validated_data.get('doc_num', instance.doc_num)
+        instance.doc_num = self.document_number(validated_data, instance)
         instance.date = validated_data.get('date', instance.date)
         instance.workshop_sender_pk = validated_data.get('workshop_sender_pk', instance.workshop_sender_pk)
         instance.save()
 
-        new_lines = self.initial_data.get('report_lines', [])
+        # без report_lines в запросе строки остаются как есть
+        if 'report_lines' not in self.initial_data:
+            return instance
+        new_lines = self.initial_data['report_lines']
         old_lines = instance.reportline_set.all()
         old_lines = [dict(ReportLineSerializer(instance=line, context={'request': self.context['request']}).data) for line in old_lines]
 
@@ -102,27 +296,36 @@ class ReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = Report
         fields = ['url', 'report_pk', 'doc_num', 'date', 'workshop_sender_pk', 'report_lines']
+        # без номера рапорт получает следующий номер своего цеха
+        extra_kwargs = {'doc_num': {'required': False}}
+        # уникальность номера в цехе проверяет DocNumberMixin: UniqueTogetherValidator требовал бы doc_num
+        validators = []
 
 
-class VedomostLineSerializer(serializers.ModelSerializer):
+class VedomostLineSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     detail = serializers.SerializerMethodField()
     url = serializers.HyperlinkedIdentityField(view_name='api:vedomost-line-detail')
+    collapsed_fields = {'detail': None}
 
     def get_detail(self, obj):
-        data = DetailSerializer(instance=obj.detail_pk, context={'request': self.context['request']}).data
+        data = detail_data(obj.detail_pk_id, self.context['request'])
         data.pop('detail_pk')
-        return data
+        return self.restrict('detail', data)
 
     class Meta:
         model = VedomostLine
         fields = ['url', 'vedomost_line_pk', 'vedomost_pk', 'detail_pk', 'amount', 'detail']
 
 
-class VedomostSerializer(serializers.ModelSerializer):
+class VedomostSerializer(DocNumberMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     vedomost_lines = VedomostLineSerializer(read_only=True, many=True, allow_null=True, source='vedomostline_set', required=False)
     url = serializers.HyperlinkedIdentityField(view_name='api:vedomost-detail')
+    collapsed_fields = {
+        'vedomost_lines': lambda: serializers.PrimaryKeyRelatedField(read_only=True, many=True, source='vedomostline_set'),
+    }
 
     def create(self, validated_data):
+        validated_data['doc_num'] = self.document_number(validated_data)
         vedomost = Vedomost.objects.create(**validated_data)
         lines = self.initial_data.get('vedomost_lines', [])
         for line in lines:
@@ -133,12 +336,15 @@ class VedomostSerializer(serializers.ModelSerializer):
         return vedomost
 
     def update(self, instance: Vedomost, validated_data):
-        instance.doc_num = validated_data.get('doc_num', instance.doc_num)
+        instance.doc_num = self.document_number(validated_data, instance)
         instance.creation_date = validated_data.get('creation_date', instance.creation_date)
         instance.workshop_pk = validated_data.get('workshop_pk', instance.workshop_pk)
         instance.save()
 
-        new_lines = self.initial_data.get('vedomost_lines', [])
+        # без vedomost_lines в запросе строки остаются как есть
+        if 'vedomost_lines' not in self.initial_data:
+            return instance
+        new_lines = self.initial_data['vedomost_lines']
         old_lines = instance.vedomostline_set.all()
         old_lines = [dict(VedomostLineSerializer(instance=line, context={'request': self.context['request']}).data) for line in old_lines]
 
@@ -188,3 +394,145 @@ class VedomostSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vedomost
         fields = ['url', 'vedomost_pk', 'doc_num', 'creation_date', 'workshop_pk', 'vedomost_lines']
+        # без номера ведомость получает следующий номер своего цеха
+        extra_kwargs = {'doc_num': {'required': False}}
+        # уникальность номера в цехе проверяет DocNumberMixin: UniqueTogetherValidator требовал бы doc_num
+        validators = []
+
+
+class JobSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(view_name='api:job-detail')
+
+    class Meta:
+        model = Job
+        fields = ['url', 'job_pk', 'kind', 'params', 'status', 'progress', 'total', 'result', 'error',
+                  'created_at', 'started_at', 'finished_at']
+
+
+class ImportReportLineSerializer(serializers.Serializer):
+    detail_pk = serializers.IntegerField()
+    workshop_receiver_pk = serializers.IntegerField(required=False, allow_null=True)
+    produced = serializers.IntegerField()
+
+
+class ImportReportSerializer(serializers.Serializer):
+    doc_num = serializers.IntegerField(required=False)
+    date = serializers.DateField()
+    workshop_sender_pk = serializers.IntegerField(required=False, allow_null=True)
+    report_lines = ImportReportLineSerializer(many=True, required=False)
+
+
+class ImportVedomostLineSerializer(serializers.Serializer):
+    detail_pk = serializers.IntegerField()
+    amount = serializers.IntegerField()
+
+
+class ImportVedomostSerializer(serializers.Serializer):
+    doc_num = serializers.IntegerField(required=False)
+    creation_date = serializers.DateField()
+    workshop_pk = serializers.IntegerField(required=False, allow_null=True)
+    vedomost_lines = ImportVedomostLineSerializer(many=True, required=False)
+
+
+class DocumentImportSerializer(serializers.Serializer):
+    """Тело загрузки документов. Ссылки на детали и цеха проверяет уже задача (api_app.bulk.import_documents)."""
+    reports = ImportReportSerializer(many=True, required=False)
+    vedomosts = ImportVedomostSerializer(many=True, required=False)
+
+
+class QuarterMatrixRowSerializer(serializers.Serializer):
+    detail_pk = serializers.IntegerField()
+    months = serializers.DictField(child=serializers.IntegerField(allow_null=True))
+
+    def validate_months(self, value):
+        try:
+            months = {int(month_number): amount for month_number, amount in value.items()}
+        except ValueError:
+            raise serializers.ValidationError('Month numbers must be integers')
+        wrong = sorted(month_number for month_number in months if not 1 <= month_number <= 12)
+        if wrong:
+            raise serializers.ValidationError(f'Month numbers must be within 1..12: {wrong}')
+        return months
+
+
+def validate_matrix_months(rows, quarter_number):
+    """Месяцы матрицы должны принадлежать кварталу программы."""
+    allowed = quarterly.quarter_months(quarter_number)
+    wrong = sorted({month_number for row in rows for month_number in row['months'] if month_number not in allowed})
+    if wrong:
+        raise serializers.ValidationError({
+            'matrix': f'Month numbers of quarter {quarter_number} must be within {allowed[0]}..{allowed[-1]}: {wrong}'
+        })
+
+
+class QuarterMatrixSerializer(serializers.Serializer):
+    """Квартальная программа в виде матрицы деталь x месяц."""
+    matrix = QuarterMatrixRowSerializer(many=True)
+
+    def validate_matrix(self, rows):
+        counts = Counter(row['detail_pk'] for row in rows)
+        duplicates = sorted(detail_pk for detail_pk, count in counts.items() if count > 1)
+        if duplicates:
+            raise serializers.ValidationError(f'Duplicate detail_pk rows: {duplicates}')
+        detail_pks = set(counts)
+        missing = detail_pks - set(Detail.objects.filter(detail_pk__in=detail_pks).values_list('detail_pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(f'Details not found: {sorted(missing)}')
+        return rows
+
+    def validate(self, attrs):
+        validate_matrix_months(attrs['matrix'], self.instance.quarter_number)
+        return attrs
+
+    def update(self, instance, validated_data):
+        quarterly.store_matrix(instance, validated_data['matrix'], replace=not self.partial)
+        return instance
+
+    def to_representation(self, instance):
+        return {
+            'production_program_quarter_pk': instance.production_program_quarter_pk,
+            'quarter_number': instance.quarter_number,
+            'matrix': quarterly.load_matrix(instance),
+        }
+
+
+class QuarterProgramSerializer(serializers.ModelSerializer):
+    url = serializers.HyperlinkedIdentityField(view_name='api:quarter-program-detail')
+    matrix_url = serializers.HyperlinkedIdentityField(view_name='api:quarter-program-matrix')
+    matrix = QuarterMatrixRowSerializer(many=True, write_only=True, required=False)
+
+    def validate_quarter_number(self, value):
+        if not 1 <= value <= 4:
+            raise serializers.ValidationError('Quarter number must be within 1..4')
+        return value
+
+    def validate_matrix(self, rows):
+        return QuarterMatrixSerializer().validate_matrix(rows)
+
+    def validate(self, attrs):
+        quarter_number = attrs.get('quarter_number', getattr(self.instance, 'quarter_number', None))
+        if 'matrix' in attrs:
+            validate_matrix_months(attrs['matrix'], quarter_number)
+        elif self.instance is not None and quarter_number != self.instance.quarter_number:
+            # смена квартала без новой матрицы: проверяются уже записанные месяцы
+            validate_matrix_months(quarterly.load_matrix(self.instance), quarter_number)
+        return attrs
+
+    @transaction.atomic
+    def create(self, validated_data):
+        matrix = validated_data.pop('matrix', [])
+        program = super().create(validated_data)
+        quarterly.store_matrix(program, matrix)
+        return program
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        matrix = validated_data.pop('matrix', None)
+        instance = super().update(instance, validated_data)
+        if matrix is not None:
+            quarterly.store_matrix(instance, matrix, replace=not self.partial)
+        return instance
+
+    class Meta:
+        model = ProductionProgramForTheQuarterByMonth
+        fields = ['url', 'matrix_url', 'production_program_quarter_pk', 'quarter_number', 'matrix']
@@ -0,0 +1,102 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api_app import bom, documents, events, inventory, reference_cache, rollup, routes, search, stock, sync
+from api_app.models import Detail, InterWorkshopRoutes, LineOfRoute, Report, ReportLine, UsingInstruction, UsingLine, Vedomost, \
+    VedomostLine, Workshop
+
+
+@receiver(post_save, sender=ReportLine)
+def report_line_saved(sender, instance: ReportLine, **kwargs):
+    rollup.line_saved(instance)
+    stock.line_saved(instance)
+    events.report_line_saved(instance)
+
+
+@receiver(post_delete, sender=ReportLine)
+def report_line_deleted(sender, instance: ReportLine, **kwargs):
+    rollup.line_deleted(instance)
+    events.report_line_deleted(instance)
+
+
+@receiver(post_save, sender=Report)
+def report_saved(sender, instance: Report, created, **kwargs):
+    if not created:
+        documents.report_saved(instance)
+
+
+@receiver(post_save, sender=Vedomost)
+def vedomost_saved(sender, instance: Vedomost, created, **kwargs):
+    if not created:
+        documents.vedomost_saved(instance)
+
+
+@receiver(post_save, sender=VedomostLine)
+def vedomost_line_saved(sender, instance: VedomostLine, **kwargs):
+    events.vedomost_line_changed(instance)
+
+
+@receiver(post_delete, sender=VedomostLine)
+def vedomost_line_deleted(sender, instance: VedomostLine, **kwargs):
+    events.vedomost_line_changed(instance, deleted=True)
+
+
+@receiver(post_save, sender=Vedomost)
+@receiver(post_delete, sender=Vedomost)
+@receiver(post_save, sender=VedomostLine)
+@receiver(post_delete, sender=VedomostLine)
+def inventory_changed(sender, **kwargs):
+    inventory.invalidate()
+    # другие потоки могли перечитать ведомости до коммита
+    transaction.on_commit(inventory.invalidate)
+
+
+@receiver(post_save, sender=LineOfRoute)
+@receiver(post_delete, sender=LineOfRoute)
+@receiver(post_save, sender=InterWorkshopRoutes)
+@receiver(post_delete, sender=InterWorkshopRoutes)
+def routes_changed(sender, **kwargs):
+    routes.invalidate()
+    # другие потоки могли успеть загрузить граф до коммита
+    transaction.on_commit(routes.invalidate)
+
+
+@receiver(post_save, sender=UsingInstruction)
+@receiver(post_delete, sender=UsingInstruction)
+@receiver(post_save, sender=UsingLine)
+@receiver(post_delete, sender=UsingLine)
+def bom_changed(sender, **kwargs):
+    bom.invalidate()
+    # другие потоки могли успеть загрузить состав до коммита
+    transaction.on_commit(bom.invalidate)
+
+
+@receiver(post_save, sender=Detail)
+@receiver(post_save, sender=Workshop)
+def search_object_saved(sender, instance, **kwargs):
+    search.update(instance)
+
+
+@receiver(post_delete, sender=Detail)
+@receiver(post_delete, sender=Workshop)
+def search_object_deleted(sender, instance, **kwargs):
+    search.remove(instance)
+
+
+@receiver(post_save, sender=Detail)
+@receiver(post_delete, sender=Detail)
+@receiver(post_save, sender=Workshop)
+@receiver(post_delete, sender=Workshop)
+def reference_object_changed(sender, **kwargs):
+    reference_cache.invalidate(sender)
+    # другие процессы могли перечитать старую запись до коммита
+    transaction.on_commit(lambda: reference_cache.invalidate(sender))
+
+
+@receiver(post_delete, sender=Report)
+@receiver(post_delete, sender=ReportLine)
+@receiver(post_delete, sender=Vedomost)
+@receiver(post_delete, sender=VedomostLine)
+def document_deleted(sender, instance, **kwargs):
+    sync.record_delete(instance)
@@ -0,0 +1,304 @@
+"""
+Остатки деталей по цеху.
+
+Движения по строкам рапортов хранятся в журнале StockMovement, который ведется сигналами
+ReportLine и Report (см. api_app.signals); массовые операции в обход save должны вызывать rebuild().
+Остатки на дату - последняя ведомость инвентаризации (api_app.inventory) плюс один GROUP BY по журналу от ее даты,
+после чего ушедшие детали, которых нет в остатке, раскладываются по составу (api_app.bom).
+Разложение зависит от остатка на момент расчета, поэтому в журнал оно не записывается.
+Если позиций много и есть NumPy, остаток и ушедшие детали считаются плотными векторами int64
+по позициям деталей (Slots), в словари переводятся только ненулевые позиции результата.
+Иначе используется тот же расчет на словарях.
+"""
+from django.db import transaction
+from django.db.models import Sum
+
+from api_app.bom import get_bom
+from api_app.lazy import optional_module
+from api_app.models import ReportLine, StockMovement, UsingInstruction
+
+numpy = optional_module('numpy')
+
+BATCH_SIZE = 1000
+# на меньшем числе позиций словари быстрее векторов (manage.py bench_leftovers)
+VECTOR_MIN_SIZE = 1000
+
+
+def _movements(line_pk, sender_pk, receiver_pk, detail_pk, produced, date, sign=1):
+    if not produced or detail_pk is None or date is None:
+        return []
+    movements = []
+    if receiver_pk is not None:
+        movements.append(StockMovement(report_line_pk_id=line_pk, workshop_pk_id=receiver_pk, detail_pk_id=detail_pk,
+                                       direction=StockMovement.RECEIVED, date=date, delta=sign * produced))
+    if sender_pk is not None:
+        movements.append(StockMovement(report_line_pk_id=line_pk, workshop_pk_id=sender_pk, detail_pk_id=detail_pk,
+                                       direction=StockMovement.SENT, date=date, delta=-sign * produced))
+    return movements
+
+
+def line_saved(line: ReportLine):
+    new = (line.workshop_sender_pk_id, line.workshop_receiver_pk_id, line.detail_pk_id, line.produced, line.date)
+    movements = []
+    if line._loaded_values is not None:
+        old = (line.loaded_value('workshop_sender_pk_id'), line.loaded_value('workshop_receiver_pk_id'),
+               line.loaded_value('detail_pk_id'), line.loaded_value('produced') or 0, line.loaded_value('date'))
+        if old == new:
+            return
+        # сторно старых значений
+        movements += _movements(line.pk, *old, sign=-1)
+    movements += _movements(line.pk, *new)
+    StockMovement.objects.bulk_create(movements)
+
+
+def lines_created(rows):
+    """Движения строк, созданных в обход save: rows - [(report_line_pk, sender_pk, receiver_pk, detail_pk, produced, date)]."""
+    StockMovement.objects.bulk_create([movement for row in rows for movement in _movements(*row)], batch_size=BATCH_SIZE)
+
+
+def report_saved(report):
+    """Смена даты или отправителя рапорта переносит движения всех его строк."""
+    if report._loaded_values is None:
+        return
+    old_sender_pk, old_date = report.loaded_value('workshop_sender_pk_id'), report.loaded_value('date')
+    if (old_sender_pk, old_date) == (report.workshop_sender_pk_id, report.date):
+        return
+    movements = []
+    for line_pk, receiver_pk, detail_pk, produced in report.reportline_set.values_list(
+            'report_line_pk', 'workshop_receiver_pk', 'detail_pk', 'produced'):
+        movements += _movements(line_pk, old_sender_pk, receiver_pk, detail_pk, produced, old_date, sign=-1)
+        movements += _movements(line_pk, report.workshop_sender_pk_id, receiver_pk, detail_pk, produced, report.date)
+    StockMovement.objects.bulk_create(movements, batch_size=BATCH_SIZE)
+
+
+@transaction.atomic
+def rebuild():
+    """Пересоздает журнал по строкам рапортов: по паре движений на строку, без сторно."""
+    StockMovement.objects.all().delete()
+    lines = ReportLine.objects.exclude(produced=0).values_list(
+        'report_line_pk', 'workshop_sender_pk', 'workshop_receiver_pk', 'detail_pk', 'produced', 'date'
+    )
+    batch = []
+    for line in lines.iterator():
+        batch += _movements(*line)
+        if len(batch) >= BATCH_SIZE:
+            StockMovement.objects.bulk_create(batch)
+            batch.clear()
+    StockMovement.objects.bulk_create(batch)
+
+
+def resolve_python(stock, outgoing, bom):
+    stock = dict(stock)
+    pending = {detail_pk: amount for detail_pk, amount in outgoing.items() if amount}
+    for _ in range(bom.depth + 1):
+        for detail_pk, amount in pending.items():
+            if detail_pk in stock:
+                subtrahend = min(amount, stock[detail_pk])
+                stock[detail_pk] -= subtrahend
+                pending[detail_pk] = amount - subtrahend
+        pending = {detail_pk: amount for detail_pk, amount in pending.items() if amount}
+        stock = {detail_pk: amount for detail_pk, amount in stock.items() if amount}
+        if not any(detail_pk in bom.components for detail_pk in pending):
+            break
+        # в остатке нет ничего из состава ушедших деталей - раскладываем сразу до конца
+        if bom.is_closed(pending) and not bom.reaches(pending, stock):
+            pending = bom.explode(pending)
+            break
+        split = {}
+        for detail_pk, amount in pending.items():
+            for component_pk, component_amount in bom.components.get(detail_pk, [(detail_pk, 1)]):
+                split[component_pk] = split.get(component_pk, 0) + component_amount * amount
+        pending = split
+    return stock, {detail_pk: amount for detail_pk, amount in pending.items() if amount}
+
+
+def _keys(amounts):
+    return numpy.fromiter(amounts.keys(), dtype=numpy.int64, count=len(amounts))
+
+
+def _values(amounts):
+    return numpy.fromiter(amounts.values(), dtype=numpy.int64, count=len(amounts))
+
+
+class Slots:
+    """
+    Позиции деталей в плотных векторах. Строится по массивам pk сразу, нумерация -
+    в порядке первого появления; slots(n) - позиции элементов n-го массива.
+    """
+
+    def __init__(self, *pk_arrays):
+        unique, first, inverse = numpy.unique(numpy.concatenate(pk_arrays), return_index=True, return_inverse=True)
+        order = numpy.argsort(first, kind='stable')
+        self.pks = unique[order]
+        by_unique = numpy.empty(len(unique), dtype=numpy.intp)
+        by_unique[order] = numpy.arange(len(unique))
+        all_slots = by_unique[inverse]
+        bounds = numpy.cumsum([len(pks) for pks in pk_arrays])[:-1]
+        self.arrays = numpy.split(all_slots, bounds)
+
+    def __len__(self):
+        return len(self.pks)
+
+    def slots(self, n):
+        return self.arrays[n]
+
+    def vector(self, n, amounts):
+        """Плотный вектор int64: суммы amounts по позициям n-го массива pk."""
+        vector = numpy.zeros(len(self), dtype=numpy.int64)
+        numpy.add.at(vector, self.slots(n), amounts)
+        return vector
+
+    def mask(self, n):
+        mask = numpy.zeros(len(self), dtype=bool)
+        mask[self.slots(n)] = True
+        return mask
+
+    def to_dict(self, vector):
+        """{detail_pk: amount} для ненулевых позиций вектора."""
+        nonzero = numpy.flatnonzero(vector)
+        return dict(zip(self.pks[nonzero].tolist(), vector[nonzero].tolist()))
+
+
+def resolve_vectors(stock_pks, stock_amounts, outgoing_pks, outgoing_amounts, bom):
+    """То же, что resolve_python, на плотных векторах. Повторы pk в остатке и ушедших суммируются."""
+    slots = Slots(stock_pks, outgoing_pks, numpy.frombuffer(bom.pks, dtype=numpy.int64))
+    remaining = slots.vector(0, stock_amounts)
+    # на первом шаге в остатке есть все переданные позиции, включая нулевые
+    present = slots.mask(0)
+    pending = slots.vector(1, outgoing_amounts)
+    # списываются только позиции, которые ушли или получены раскладыванием, включая нулевые
+    pending_present = pending != 0
+    # позиции деталей состава (bom.pks) в векторах
+    bom_slots = slots.slots(2)
+    manufactured = numpy.frombuffer(bom.manufactured, dtype=numpy.int8).astype(bool)
+    closed = numpy.frombuffer(bom.closed, dtype=numpy.int8).astype(bool)
+    has_bom = numpy.zeros(len(slots), dtype=bool)
+    has_bom[bom_slots] = manufactured
+    for _ in range(bom.depth + 1):
+        subtrahend = numpy.where(present & pending_present, numpy.minimum(pending, remaining), 0)
+        remaining -= subtrahend
+        pending -= subtrahend
+        present = remaining != 0
+        pending_present = pending != 0
+        if not (pending_present & has_bom).any():
+            break
+        split_parents = pending_present[bom_slots] & manufactured
+        if closed[split_parents].all():
+            # в остатке нет ничего из состава ушедших деталей - раскладываем сразу до конца
+            reached = pending_present.copy()
+            reached[bom_slots] |= bom.closure.pattern().rmatvec(split_parents.astype(numpy.int64)) != 0
+            if not (reached & present).any():
+                pending[bom_slots] = bom.explosion.rmatvec(pending[bom_slots])
+                break
+        # изделия заменяются деталями состава, остальное остается как есть
+        split = numpy.where(has_bom, 0, pending)
+        split[bom_slots] += bom.matrix.rmatvec(numpy.where(manufactured, pending[bom_slots], 0))
+        pending_present &= ~has_bom
+        pending_present[bom_slots] |= bom.matrix.pattern().rmatvec(split_parents.astype(numpy.int64)) != 0
+        pending = split
+    return slots.to_dict(remaining), slots.to_dict(pending)
+
+
+def resolve_numpy(stock, outgoing, bom):
+    return resolve_vectors(_keys(stock), _values(stock), _keys(outgoing), _values(outgoing), bom)
+
+
+def resolve(stock, outgoing, bom):
+    """
+    Списывает ушедшие детали outgoing {detail_pk: amount} с остатка stock {detail_pk: amount}.
+    То, чего нет в остатке, раскладывается по составу bom (api_app.bom.Bom) и списывается снова,
+    пока есть что раскладывать. Возвращает (остаток, не списанное) - словари без нулевых значений.
+    """
+    if numpy is None or len(stock) + len(outgoing) < VECTOR_MIN_SIZE:
+        return resolve_python(stock, outgoing, bom)
+    return resolve_numpy(stock, outgoing, bom)
+
+
+def leftovers(inventory, date, bom=None):
+    """
+    Остатки цеха на дату от ведомости inventory (api_app.inventory.Inventory):
+    (остаток {detail_pk: amount}, не списанное {detail_pk: amount}).
+    """
+    totals = StockMovement.objects.filter(
+        workshop_pk=inventory.workshop_pk, date__gte=inventory.date, date__lte=date
+    ).values_list('direction', 'detail_pk').annotate(total=Sum('delta')).order_by()
+    received, outgoing = {}, {}
+    for direction, detail_pk, total in totals:
+        if not total:
+            continue
+        if direction == StockMovement.RECEIVED:
+            received[detail_pk] = total
+        else:
+            outgoing[detail_pk] = -total
+    bom = get_bom() if bom is None else bom
+    if numpy is None or len(inventory.details) + len(received) + len(outgoing) < VECTOR_MIN_SIZE:
+        stock = inventory.stock()
+        for detail_pk, total in received.items():
+            stock[detail_pk] = stock.get(detail_pk, 0) + total
+        return resolve_python(stock, outgoing, bom)
+    # строки ведомости берутся из массивов хронологии без копирования
+    stock_pks = numpy.concatenate([numpy.frombuffer(inventory.details, dtype=numpy.int64), _keys(received)])
+    stock_amounts = numpy.concatenate([numpy.frombuffer(inventory.amounts, dtype=numpy.int64), _values(received)])
+    return resolve_vectors(stock_pks, stock_amounts, _keys(outgoing), _values(outgoing), bom)
+
+
+def legacy_leftovers(vedomost, date):
+    """
+    Прежний расчет по строкам рапортов, без журнала: для сверки (manage.py check_stock_ledger).
+    Возвращает то же, что leftovers().
+    """
+    workshop_pk = vedomost.workshop_pk_id
+    lines = ReportLine.objects.filter(date__lte=date, date__gte=vedomost.creation_date).exclude(produced=0)
+    details = {}
+    for vedomost_line in vedomost.vedomostline_set.all():
+        if vedomost_line.amount:
+            details[vedomost_line.detail_pk_id] = vedomost_line.amount
+    for detail_pk, produced in lines.filter(workshop_receiver_pk=workshop_pk).values_list('detail_pk', 'produced'):
+        details[detail_pk] = details.get(detail_pk, 0) + produced
+    outcome = [[detail_pk, produced] for detail_pk, produced in
+               lines.filter(workshop_sender_pk=workshop_pk).values_list('detail_pk', 'produced')]
+    while outcome:
+        for item in outcome:
+            if item[0] in details:
+                subtrahend = min(item[1], details[item[0]])
+                details[item[0]] -= subtrahend
+                item[1] -= subtrahend
+        outcome = [item for item in outcome if item[1] != 0]
+        details = {detail_pk: amount for detail_pk, amount in details.items() if amount != 0}
+        split = []
+        changed = False
+        for detail_pk, amount in outcome:
+            try:
+                instruction = UsingInstruction.objects.get(detail_manufactured_pk=detail_pk)
+            except UsingInstruction.DoesNotExist:
+                split.append([detail_pk, amount])
+                continue
+            changed = True
+            split += [[line.detail_pk_id, line.amount * amount] for line in instruction.usingline_set.all()]
+        if not changed:
+            break
+        outcome = split
+    stuck = {}
+    for detail_pk, amount in outcome:
+        stuck[detail_pk] = stuck.get(detail_pk, 0) + amount
+    return details, {detail_pk: amount for detail_pk, amount in stuck.items() if amount}
+
+
+def check_ledger():
+    """Расхождения журнала со строками рапортов: [(workshop_pk, detail_pk, direction, по журналу, по строкам)]."""
+    expected = {}
+    lines = ReportLine.objects.exclude(produced=0).filter(detail_pk__isnull=False, date__isnull=False)
+    for field, direction, sign in (('workshop_receiver_pk', StockMovement.RECEIVED, 1),
+                                   ('workshop_sender_pk', StockMovement.SENT, -1)):
+        for workshop_pk, detail_pk, total in lines.filter(**{f'{field}__isnull': False}).values_list(
+                field, 'detail_pk').annotate(total=Sum('produced')).order_by():
+            expected[workshop_pk, detail_pk, direction] = sign * total
+    actual = {
+        (workshop_pk, detail_pk, direction): total
+        for workshop_pk, detail_pk, direction, total in StockMovement.objects.values_list(
+            'workshop_pk', 'detail_pk', 'direction').annotate(total=Sum('delta')).order_by()
+    }
+    return [
+        key + (actual.get(key, 0), expected.get(key, 0))
+        for key in sorted(set(expected) | set(actual)) if actual.get(key, 0) != expected.get(key, 0)
+    ]
@@ -0,0 +1,109 @@
+"""
+Синхронизация документов по токенам.
+
+Report, ReportLine, Vedomost и VedomostLine получают sync_token из общего счетчика при каждом
+сохранении (SyncTokenMixin), удаления записываются в SyncTombstone с токеном из того же счетчика.
+Клиент запоминает последний полученный токен и запрашивает только то, что изменилось после него.
+Массовые операции должны создавать записи через bulk_create(), менять через update()
+и удалять через api_app.deletion, которые выделяют токены блоками.
+"""
+from django.db import transaction
+
+from api_app.models import Report, ReportLine, SyncCounter, SyncTombstone, Vedomost, VedomostLine
+
+# модель -> ключ раздела в ответе и в SyncTombstone.model
+TRACKED_MODELS = {
+    Report: 'reports',
+    ReportLine: 'report_lines',
+    Vedomost: 'vedomosts',
+    VedomostLine: 'vedomost_lines',
+}
+
+
+def bulk_create(model, objects):
+    """
+    bulk_create с блоком токенов на всю пачку. Токены и строки фиксируются одной транзакцией.
+    Если СУБД не возвращает pk созданных строк (MySQL), они находятся по выданным токенам.
+    """
+    if not objects:
+        return []
+    with transaction.atomic():
+        first = SyncCounter.reserve(len(objects))
+        for offset, obj in enumerate(objects):
+            obj.sync_token = first + offset
+        created = model.objects.bulk_create(objects)
+        if objects[0].pk is None:
+            pks = dict(model.objects.filter(sync_token__range=(first, first + len(objects) - 1))
+                       .values_list('sync_token', model._meta.pk.name))
+            for obj in objects:
+                obj.pk = pks[obj.sync_token]
+        return created
+
+
+def update(queryset, **values):
+    """
+    QuerySet.update(**values) с новым токеном у каждой записи: токены - один блок на все записи.
+    Внешние ключи передаются значением pk. Как и QuerySet.update(), обходит save() и сигналы.
+    Возвращает число измененных записей.
+    """
+    model = queryset.model
+    fields = [model._meta.get_field(name) for name in values]
+    with transaction.atomic(using=queryset.db):
+        objects = list(queryset.only(model._meta.pk.name).order_by(model._meta.pk.name))
+        if not objects:
+            return 0
+        first = SyncCounter.reserve(len(objects), using=queryset.db)
+        for offset, obj in enumerate(objects):
+            for field, value in zip(fields, values.values()):
+                setattr(obj, field.attname, value)
+            obj.sync_token = first + offset
+        model._base_manager.using(queryset.db).bulk_update(
+            objects, [field.name for field in fields] + ['sync_token'], batch_size=500)
+    return len(objects)
+
+
+def write_tombstones(model, pks):
+    """Записывает удаление pks модели. Вызывать в той же транзакции, что и само удаление."""
+    pks = list(pks)
+    if not pks:
+        return
+    first = SyncCounter.reserve(len(pks))
+    SyncTombstone.objects.bulk_create([
+        SyncTombstone(model=TRACKED_MODELS[model], object_pk=pk, sync_token=first + offset)
+        for offset, pk in enumerate(pks)
+    ], batch_size=1000)
+
+
+def record_delete(instance):
+    with transaction.atomic():
+        write_tombstones(type(instance), [instance.pk])
+
+
+def changes(since, limit):
+    """
+    Изменения после токена since: ({раздел: [объекты]}, {раздел: [удаленные pk]}, новый токен, есть ли еще).
+    Из каждого источника берется не больше limit записей; граница выбирается так,
+    чтобы до нее включительно были отданы все изменения из всех источников.
+    """
+    changed = {
+        name: list(model.objects.filter(sync_token__gt=since).order_by('sync_token')[:limit])
+        for model, name in TRACKED_MODELS.items()
+    }
+    tombstones = list(SyncTombstone.objects.filter(sync_token__gt=since).order_by('sync_token')
+                      .values_list('model', 'object_pk', 'sync_token')[:limit])
+
+    full = [objects[-1].sync_token for objects in changed.values() if len(objects) == limit]
+    if len(tombstones) == limit:
+        full.append(tombstones[-1][2])
+    if full:
+        token = min(full)
+    else:
+        token = max([objects[-1].sync_token for objects in changed.values() if objects] +
+                    [tombstone[2] for tombstone in tombstones[-1:]] + [since])
+
+    changed = {name: [obj for obj in objects if obj.sync_token <= token] for name, objects in changed.items()}
+    deleted = {name: [] for name in TRACKED_MODELS.values()}
+    for name, object_pk, sync_token in tombstones:
+        if sync_token <= token:
+            deleted[name].append(object_pk)
+    return changed, deleted, token, bool(full)
@@ -1,3 +1,1067 @@
-from django.test import TestCase
+import base64
+import datetime
+import importlib
+import json
+import os
+import random
+import tempfile
+import unittest
+import zlib
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import Sum
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api_app import admin as admin_site, bom, deletion, doc_numbers, events, inventory, jobs, lazy, metrics, middleware, planning, reference_cache, renderers, rollup, routes, search, stock, sync
+from api_app.models import Detail, InterWorkshopRoutes, Job, LineOfRoute, MonthlyProduction, \
+    ProductionProgramByMonth, ProductionProgramForTheQuarterByMonth, ProductionProgramForTheQuarterByMonthLine, \
+    ProgramLine, Report, ReportLine, StockMovement, SyncCounter, SyncTombstone, UsingInstruction, UsingLine, \
+    Vedomost, VedomostLine, Workshop
+from api_app.reference_cache import VersionStamp
+
+
+class ApiTestCase(TestCase):
+    """Два цеха, три детали и авторизованный клиент."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='tester')
+        cls.sender = Workshop.objects.create(workshop_name='Заготовительный', cipher_workshop='01')
+        cls.receiver = Workshop.objects.create(workshop_name='Сборочный', cipher_workshop='02')
+        cls.details = [Detail.objects.create(detail_name=name, cipher_detail=cipher)
+                       for name, cipher in (('Рама', '100'), ('Колесо', '200'), ('Спица', '300'))]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_report(self, date, lines, sender=None, doc_num=None):
+        """lines - [(detail, produced)] в цех-получатель self.receiver."""
+        report = Report.objects.create(doc_num=doc_num or Report.objects.count() + 1, date=date,
+                                       workshop_sender_pk=sender or self.sender)
+        for detail, produced in lines:
+            ReportLine.objects.create(report_pk=report, detail_pk=detail, workshop_receiver_pk=self.receiver,
+                                      produced=produced)
+        return report
+
+
+class JobTests(ApiTestCase):
+    def test_run_records_result(self):
+        job = Job.objects.create(kind='fill_details', params={'amount': 3, 'name_length': 4})
+        jobs.run(job.job_pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual(job.result, {'details': 3})
+        self.assertEqual(Detail.objects.count(), 6)
+
+    def test_fill_reports_adds_lines_to_new_reports_only(self):
+        existing = self.create_report(datetime.date(2021, 1, 15), [(self.details[0], 1)])
+        job = Job.objects.create(kind='fill_reports', params={
+            'start_date': '2021-02-01', 'end_date': '2021-02-10', 'interval': 3, 'workshop_pk': self.receiver.pk,
+            'lines_from': 2, 'lines_to': 2,
+        })
+        with mock.patch.object(rollup, 'rebuild') as rebuild_rollup, mock.patch.object(stock, 'rebuild') as rebuild_stock:
+            jobs.run(job.job_pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE, job.error)
+        self.assertEqual((job.progress, job.total), (8, 8))
+        self.assertEqual(existing.reportline_set.count(), 1)
+        self.assertEqual(ReportLine.objects.filter(report_pk__workshop_sender_pk=self.receiver).count(), 8)
+        rebuild_rollup.assert_not_called()
+        rebuild_stock.assert_not_called()
+        # итоги и журнал остатков доведены построчно
+        self.assertEqual(stock.check_ledger(), [])
+        self.assertEqual(MonthlyProduction.objects.get(workshop_pk=self.receiver).produced, 40)
+
+    def test_failed_job_stores_message_without_traceback(self):
+        job = Job.objects.create(kind='import_documents', params={'vedomosts': [
+            {'creation_date': '2021-02-01', 'workshop_pk': self.sender.pk, 'vedomost_lines': [{'detail_pk': 999, 'amount': 1}]},
+        ]})
+        with self.assertLogs('api_app.jobs', 'ERROR'):
+            jobs.run(job.job_pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertEqual(job.error, 'Unknown detail_pk: 999')
+        self.assertFalse(Vedomost.objects.exists())
+
+    def test_abandoned_jobs_fail(self):
+        old = timezone.now() - datetime.timedelta(hours=1)
+        abandoned = Job.objects.create(kind='clear', status=Job.STATUS_RUNNING, worker='dead:1:x', heartbeat_at=old)
+        alive = Job.objects.create(kind='clear', status=Job.STATUS_RUNNING, worker='other:2:x', heartbeat_at=timezone.now())
+        own = Job.objects.create(kind='clear', status=Job.STATUS_QUEUED, worker=jobs.worker_id(), heartbeat_at=old)
+        legacy = Job.objects.create(kind='clear', status=Job.STATUS_QUEUED)
+        Job.objects.filter(pk=legacy.pk).update(created_at=old)
+
+        self.assertEqual(jobs.fail_abandoned(), 2)
+        statuses = dict(Job.objects.values_list('job_pk', 'status'))
+        self.assertEqual(statuses[abandoned.pk], Job.STATUS_FAILED)
+        self.assertEqual(statuses[legacy.pk], Job.STATUS_FAILED)
+        self.assertEqual(statuses[alive.pk], Job.STATUS_RUNNING)
+        self.assertEqual(statuses[own.pk], Job.STATUS_QUEUED)
+
+    def test_jobs_require_authentication(self):
+        job = Job.objects.create(kind='clear', params={'mode': 'clear_reports'})
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get('/api/jobs/').status_code, 403)
+        self.assertEqual(anonymous.get(f'/api/jobs/{job.pk}/').status_code, 403)
+        self.assertEqual(self.client.get(f'/api/jobs/{job.pk}/').status_code, 200)
+
+    def test_invalid_fill_params(self):
+        response = self.client.get('/api/auto-fill/?type=details&amount=x')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Job.objects.exists())
+
+    def test_import_documents(self):
+        frame, wheel, _ = self.details
+        response = self.client.post('/api/import/', {
+            'reports': [
+                {'date': '2021-02-01', 'workshop_sender_pk': self.sender.pk, 'report_lines': [
+                    {'detail_pk': frame.pk, 'workshop_receiver_pk': self.receiver.pk, 'produced': 5},
+                    {'detail_pk': wheel.pk, 'workshop_receiver_pk': self.receiver.pk, 'produced': 10},
+                ]},
+                {'doc_num': 40, 'date': '2021-02-15', 'workshop_sender_pk': self.sender.pk, 'report_lines': [
+                    {'detail_pk': frame.pk, 'workshop_receiver_pk': self.receiver.pk, 'produced': 2},
+                ]},
+            ],
+            'vedomosts': [
+                {'creation_date': '2021-01-31', 'workshop_pk': self.receiver.pk, 'vedomost_lines': [
+                    {'detail_pk': wheel.pk, 'amount': 7},
+                ]},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+        jobs.run(response.data['job_pk'])
+
+        job = Job.objects.get(pk=response.data['job_pk'])
+        self.assertEqual(job.status, Job.STATUS_DONE, job.error)
+        self.assertEqual(job.result, {'reports': 2, 'vedomosts': 1})
+        # номер 40 из загрузки сдвигает последовательность цеха
+        self.assertEqual(sorted(Report.objects.values_list('doc_num', flat=True)), [40, 41])
+        report = Report.objects.get(doc_num=41)
+        self.assertEqual(report.reportline_set.count(), 2)
+        self.assertEqual(set(report.reportline_set.values_list('date', flat=True)), {datetime.date(2021, 2, 1)})
+        self.assertEqual(MonthlyProduction.objects.get(detail_pk=frame).produced, 7)
+        self.assertEqual(StockMovement.objects.filter(workshop_pk=self.receiver).count(), 3)
+        self.assertEqual(Vedomost.objects.get().vedomostline_set.get().amount, 7)
+
+    def test_import_validates_body(self):
+        response = self.client.post('/api/import/', {'reports': [{'workshop_sender_pk': self.sender.pk}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('reports', response.data)
+
+
+class DeletionTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        frame, wheel, _ = self.details
+        self.reports = [self.create_report(datetime.date(2021, 2, day), [(frame, 1), (wheel, 2)]) for day in (1, 2, 3)]
+
+    def test_cascade_with_tombstones(self):
+        deleted = deletion.chunked_delete(Report.objects.filter(pk__in=[r.pk for r in self.reports[:2]]), chunk_size=3)
+        self.assertEqual(deleted, {'api_app.StockMovement': 8, 'api_app.ReportLine': 4, 'api_app.Report': 2})
+        self.assertEqual(list(Report.objects.values_list('pk', flat=True)), [self.reports[2].pk])
+        self.assertEqual(ReportLine.objects.count(), 2)
+        self.assertEqual(SyncTombstone.objects.filter(model='reports').count(), 2)
+        self.assertEqual(SyncTombstone.objects.filter(model='report_lines').count(), 4)
+
+    def test_chunks_skip_gaps_in_pk(self):
+        for pk in (1, 10 ** 6, 10 ** 9):
+            Job.objects.create(job_pk=pk, kind='clear')
+        # по запросу границы и по COUNT на каждую пачку, сколько бы ни было между pk
+        with self.assertNumQueries(4):
+            sizes = [chunk.count() for chunk in deletion.chunks(Job.objects.all(), 2)]
+        self.assertEqual(sizes, [2, 1])
+
+    def test_set_null(self):
+        relation = ReportLine._meta.get_field('report_pk').remote_field
+        with mock.patch.object(relation, 'on_delete', models.SET_NULL):
+            deleted = deletion.chunked_delete(Report.objects.all())
+        self.assertEqual(deleted, {'api_app.Report': 3})
+        self.assertEqual(ReportLine.objects.filter(report_pk__isnull=True).count(), 6)
+
+    def test_protect_goes_through_collector(self):
+        relation = ReportLine._meta.get_field('report_pk').remote_field
+        with mock.patch.object(relation, 'on_delete', models.PROTECT):
+            self.assertEqual([step.action for step in deletion.build_plan(Report.objects.all())], [deletion.COLLECT])
+            with self.assertRaises(models.ProtectedError):
+                deletion.chunked_delete(Report.objects.all())
+        self.assertEqual(Report.objects.count(), 3)
+
+
+    def test_clear_details_drops_bom_and_routes(self):
+        frame, wheel, _ = self.details
+        instruction = UsingInstruction.objects.create(detail_manufactured_pk=frame)
+        UsingLine.objects.create(using_pk=instruction, detail_pk=wheel, amount=2)
+        self.assertEqual(len(bom.get_bom()), 1)
+        job = Job.objects.create(kind='clear', params={'mode': 'clear_details'})
+        with mock.patch.object(routes, 'invalidate', wraps=routes.invalidate) as invalidate_routes:
+            jobs.run(job.job_pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE, job.error)
+        self.assertFalse(UsingInstruction.objects.exists())
+        self.assertEqual(len(bom.get_bom()), 0)
+        invalidate_routes.assert_called_once_with()
+
+class DocumentCopyTests(ApiTestCase):
+    def test_report_change_moves_lines(self):
+        frame, wheel, _ = self.details
+        report = self.create_report(datetime.date(2021, 2, 27), [(frame, 3), (wheel, 4)])
+        other = Workshop.objects.create(workshop_name='Покрасочный', cipher_workshop='03')
+
+        report = Report.objects.get(pk=report.pk)
+        report.date = datetime.date(2021, 3, 2)
+        report.workshop_sender_pk = other
+        report.save()
+
+        self.assertEqual(set(ReportLine.objects.values_list('date', 'workshop_sender_pk')), {(datetime.date(2021, 3, 2), other.pk)})
+        self.assertEqual(set(MonthlyProduction.objects.exclude(produced=0).values_list('workshop_pk', 'month', 'produced')),
+                         {(other.pk, datetime.date(2021, 3, 1), 3), (other.pk, datetime.date(2021, 3, 1), 4)})
+        balances = StockMovement.objects.values('workshop_pk', 'date').annotate(total=Sum('delta')).exclude(total=0)
+        self.assertEqual({(row['workshop_pk'], row['date'], row['total']) for row in balances}, {
+            (other.pk, datetime.date(2021, 3, 2), -7), (self.receiver.pk, datetime.date(2021, 3, 2), 7),
+        })
+
+    def test_vedomost_change_moves_lines(self):
+        vedomost = Vedomost.objects.create(doc_num=1, creation_date=datetime.date(2021, 2, 1), workshop_pk=self.sender)
+        VedomostLine.objects.create(vedomost_pk=vedomost, detail_pk=self.details[0], amount=5)
+        vedomost = Vedomost.objects.get(pk=vedomost.pk)
+        vedomost.creation_date = datetime.date(2021, 2, 5)
+        vedomost.workshop_pk = self.receiver
+        vedomost.save()
+        self.assertEqual(list(VedomostLine.objects.values_list('creation_date', 'workshop_pk')),
+                         [(datetime.date(2021, 2, 5), self.receiver.pk)])
+
+    def test_string_dates_are_normalized(self):
+        report = Report.objects.create(doc_num=1, date='2021-01-31', workshop_sender_pk=self.sender)
+        line = ReportLine.objects.create(report_pk=report, detail_pk=self.details[0], workshop_receiver_pk=self.receiver,
+                                         produced=3)
+        self.assertEqual(line.date, datetime.date(2021, 1, 31))
+        self.assertEqual(line.loaded_value('date'), datetime.date(2021, 1, 31))
+        report.date = '2021-02-01'
+        report.save()
+        self.assertEqual(list(MonthlyProduction.objects.exclude(produced=0).values_list('month', 'produced')),
+                         [(datetime.date(2021, 2, 1), 3)])
+        self.assertEqual(stock.check_ledger(), [])
+        vedomost = Vedomost.objects.create(doc_num=1, creation_date='2021-02-01', workshop_pk=self.sender)
+        line = VedomostLine.objects.create(vedomost_pk=vedomost, detail_pk=self.details[0], amount=5)
+        self.assertEqual(line.creation_date, datetime.date(2021, 2, 1))
+
+
+class RollupTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        frame, wheel, spoke = self.details
+        self.create_report(datetime.date(2021, 1, 15), [(frame, 3), (wheel, 5)])
+        self.create_report(datetime.date(2021, 1, 31), [(frame, 2)])
+        moved = self.create_report(datetime.date(2021, 2, 1), [(wheel, 7), (spoke, 11)])
+        self.create_report(datetime.date(2021, 3, 10), [(spoke, 13), (frame, 17)])
+        self.create_report(datetime.date(2021, 4, 1), [(wheel, 19)])
+        # правки строк и перенос рапорта идут через сигналы
+        line = ReportLine.objects.get(detail_pk=frame, produced=17)
+        line.produced = 23
+        line.save()
+        ReportLine.objects.get(detail_pk=spoke, produced=13).delete()
+        moved = Report.objects.get(pk=moved.pk)
+        moved.date = datetime.date(2021, 3, 31)
+        moved.save()
+
+    def expected(self, start_date, end_date):
+        lines = ReportLine.objects.filter(workshop_sender_pk=self.sender, date__gte=start_date, date__lte=end_date)
+        return {row['detail_pk']: row['total'] for row in lines.values('detail_pk').annotate(total=Sum('produced')).order_by()}
+
+    def test_totals_match_rebuild(self):
+        incremental = set(MonthlyProduction.objects.exclude(produced=0).values_list('workshop_pk', 'detail_pk', 'month', 'produced'))
+        rollup.rebuild()
+        self.assertEqual(incremental, set(MonthlyProduction.objects.values_list('workshop_pk', 'detail_pk', 'month', 'produced')))
+
+    def test_accounting_matches_lines(self):
+        periods = [
+            (None, None), ('2021-01-01', '2021-03-31'), ('2021-01-16', '2021-03-30'), ('2021-01-31', '2021-02-01'),
+            ('2021-02-01', None), (None, '2021-01-15'), ('2021-03-31', '2021-04-30'),
+        ]
+        for start, end in periods:
+            with self.subTest(start=start, end=end):
+                params = {'workshop_pk': self.sender.pk}
+                if start:
+                    params['start_date'] = start
+                if end:
+                    params['end_date'] = end
+                response = self.client.get('/api/accounting/', params)
+                actual = {row['detail_pk']: row['actual_amount'] for row in response.data['accounting']}
+                expected = self.expected(datetime.date.fromisoformat(start) if start else datetime.date.min,
+                                         datetime.date.fromisoformat(end) if end else datetime.date.max)
+                self.assertEqual(actual, expected)
+
+
+class PlanningTests(ApiTestCase):
+    def test_numpy_matches_python(self):
+        rng = random.Random(5)
+        base = datetime.date(2021, 1, 1)
+        programs = []
+        for pk in range(1, 41):
+            start = base + datetime.timedelta(rng.randint(0, 200))
+            programs.append((pk, rng.randint(1, 4), start, start + datetime.timedelta(rng.randint(0, 90))))
+        lines = [(rng.randint(1, 40), rng.randint(1, 30), rng.randint(1, 500)) for _ in range(400)]
+        for start, end in ((base, base + datetime.timedelta(365)), (datetime.date(2021, 3, 1), datetime.date(2021, 4, 30))):
+            visible = [program for program in programs if program[2] <= end and program[3] >= start]
+            visible_pks = {program[0] for program in visible}
+            visible_lines = [line for line in lines if line[0] in visible_pks]
+            with self.subTest(start=start, end=end):
+                self.assertEqual(planning.compute_numpy(visible, visible_lines, start, end),
+                                 planning.compute_python(visible, visible_lines, start, end))
+
+    def test_planned_in_accounting(self):
+        program = ProductionProgramByMonth.objects.create(workshop_pk=self.sender, start_date=datetime.date(2021, 2, 1),
+                                                          end_date=datetime.date(2021, 2, 28),
+                                                          creation_date=datetime.date(2021, 1, 20))
+        ProgramLine.objects.create(production_program_pk=program, detail_pk=self.details[0], amount=56)
+        self.create_report(datetime.date(2021, 2, 3), [(self.details[0], 20)])
+        response = self.client.get('/api/accounting/', {'workshop_pk': self.sender.pk, 'start_date': '2021-02-01',
+                                                        'end_date': '2021-02-14'})
+        row, = response.data['accounting']
+        self.assertEqual((row['planned_amount'], row['actual_amount'], row['deviation']), (28, 20, -8))
+
+
+class QuarterProgramTests(ApiTestCase):
+    def post_program(self, quarter_number, matrix):
+        return self.client.post('/api/quarter-programs/', {'quarter_number': quarter_number, 'matrix': matrix},
+                                format='json')
+
+    def test_create_with_matrix(self):
+        frame, wheel, _ = self.details
+        response = self.post_program(2, [{'detail_pk': frame.pk, 'months': {'4': 10, '6': 30}},
+                                         {'detail_pk': wheel.pk, 'months': {'5': 20}}])
+        self.assertEqual(response.status_code, 201, response.data)
+        lines = ProductionProgramForTheQuarterByMonthLine.objects.values_list('detail_pk', 'month_number', 'amount')
+        self.assertEqual(sorted(lines), [(frame.pk, 4, 10), (frame.pk, 6, 30), (wheel.pk, 5, 20)])
+
+    def test_invalid_matrix_leaves_nothing(self):
+        frame, wheel, _ = self.details
+        for quarter_number, matrix in (
+            (2, [{'detail_pk': frame.pk, 'months': {'13': 1}}]),
+            (2, [{'detail_pk': frame.pk, 'months': {'1': 1}}]),
+            (2, [{'detail_pk': frame.pk, 'months': {'4': 1}}, {'detail_pk': frame.pk, 'months': {'5': 2}}]),
+            (5, [{'detail_pk': wheel.pk, 'months': {'4': 1}}]),
+        ):
+            with self.subTest(quarter_number=quarter_number, matrix=matrix):
+                self.assertEqual(self.post_program(quarter_number, matrix).status_code, 400)
+        self.assertFalse(ProductionProgramForTheQuarterByMonth.objects.exists())
+
+    def test_store_failure_rolls_back_program(self):
+        with mock.patch('api_app.quarterly.store_matrix', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post_program(1, [{'detail_pk': self.details[0].pk, 'months': {'1': 1}}])
+        self.assertFalse(ProductionProgramForTheQuarterByMonth.objects.exists())
+
+    def test_quarter_change_checks_stored_months(self):
+        response = self.post_program(1, [{'detail_pk': self.details[0].pk, 'months': {'2': 5}}])
+        url = f"/api/quarter-programs/{response.data['production_program_quarter_pk']}/"
+        self.assertEqual(self.client.patch(url, {'quarter_number': 3}, format='json').status_code, 400)
+        self.assertEqual(self.client.patch(f'{url}matrix/', {'matrix': [
+            {'detail_pk': self.details[0].pk, 'months': {'7': 5}}
+        ]}, format='json').status_code, 400)
+
+
+class RouteTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.route = InterWorkshopRoutes.objects.create(detail_pk=self.details[0])
+        LineOfRoute.objects.create(workshop_sender_pk=self.sender, workshop_receiver_pk=self.receiver,
+                                   detail_pk=self.details[0], details_amount=2, routes_pk=self.route)
+
+    def test_next_and_inflow(self):
+        response = self.client.get('/api/routes/next/', {'detail_pk': self.details[0].pk, 'workshop_pk': self.sender.pk})
+        self.assertEqual(response.data['next'], [{'workshop_pk': self.receiver.pk, 'details_amount': 2}])
+        response = self.client.get('/api/routes/inflow/', {'workshop_pk': self.receiver.pk})
+        self.assertEqual(response.data['inflow'], [{'detail_pk': self.details[0].pk, 'details_amount': 2}])
+
+    def test_invalid_params(self):
+        for url, params in (('/api/routes/next/', {'workshop_pk': self.sender.pk}),
+                            ('/api/routes/next/', {'detail_pk': 'x', 'workshop_pk': self.sender.pk}),
+                            ('/api/routes/inflow/', {}),
+                            ('/api/routes/inflow/', {'workshop_pk': '1.5'})):
+            with self.subTest(url=url, params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    @override_settings(API_REFERENCE_CACHE_CHECK_INTERVAL=0)
+    def test_change_in_other_process_invalidates_graph(self):
+        self.assertTrue(routes.get_graph().is_allowed(self.sender.pk, self.receiver.pk, self.details[0].pk))
+        # другой процесс: строки меняются без сигналов этого процесса, метка версии - через общий кеш
+        LineOfRoute.objects.bulk_create([LineOfRoute(workshop_sender_pk=self.receiver, workshop_receiver_pk=self.sender,
+                                                     detail_pk=self.details[0], details_amount=1, routes_pk=self.route)])
+        self.assertFalse(routes.get_graph().is_allowed(self.receiver.pk, self.sender.pk, self.details[0].pk))
+        VersionStamp('routes').bump()
+        self.assertTrue(routes.get_graph().is_allowed(self.receiver.pk, self.sender.pk, self.details[0].pk))
+
+    def test_sender_change_rechecks_stored_lines(self):
+        report = self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 5)])
+        line = report.reportline_set.get()
+        url = f'/api/reports/{report.pk}/?validate_routes=1'
+        for body in ({'workshop_sender_pk': self.receiver.pk},
+                     {'workshop_sender_pk': self.receiver.pk,
+                      'report_lines': [{'report_line_pk': line.pk, 'report_pk': report.pk, 'produced': 6}]}):
+            with self.subTest(body=body):
+                self.assertEqual(self.client.patch(url, body, format='json').status_code, 400)
+        report.refresh_from_db()
+        self.assertEqual(report.workshop_sender_pk, self.sender)
+
+        response = self.client.patch(url, {'date': '2021-02-02'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        line.refresh_from_db()
+        self.assertEqual((line.date, line.produced), (datetime.date(2021, 2, 2), 5))
+
+
+class SearchTests(ApiTestCase):
+    def test_search_filter(self):
+        response = self.client.get('/api/details/', {'search': 'олес'})
+        self.assertEqual([row['detail_pk'] for row in response.data], [self.details[1].pk])
+
+    def test_gram_index(self):
+        index = search.GramIndex(Detail, search.INDEXED_FIELDS[Detail])
+        index.rebuild()
+        frame, wheel, spoke = self.details
+        for terms, fields, expected in ((['олес'], ['detail_name'], {wheel}),
+                                        (['а'], ['detail_name'], {frame, spoke}),
+                                        (['ам', '100'], ['detail_name', 'cipher_detail'], {frame}),
+                                        (['00'], ['cipher_detail'], {frame, wheel, spoke}),
+                                        (['лсе'], ['detail_name'], set())):
+            with self.subTest(terms=terms, fields=fields):
+                self.assertEqual(set(index.filter(Detail.objects.all(), terms, fields)), expected)
+        self.assertEqual(index.autocomplete('Сп', 10), [spoke.pk])
+        self.assertEqual(index.autocomplete('2', 10), [wheel.pk])
+
+        # SQLite сравнивает LIKE без учета регистра только для ASCII
+        spoke.detail_name = 'Hub'
+        spoke.save()
+        index.update(spoke)
+        self.assertEqual(set(index.filter(Detail.objects.all(), ['HUB'], ['detail_name'])), {spoke})
+        self.assertEqual(index.autocomplete('Сп', 10), [])
+        index.remove(wheel.pk)
+        self.assertEqual(set(index.filter(Detail.objects.all(), ['олес'], ['detail_name'])), set())
+
+
+class ReferenceCacheTests(ApiTestCase):
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/reports/')
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in context.captured_queries]
+
+    def test_report_list_queries_do_not_grow(self):
+        for day in (1, 2):
+            self.create_report(datetime.date(2021, 2, day), [(detail, day) for detail in self.details])
+        self.list_queries()
+        queries = self.list_queries()
+        # детали берутся из кеша, а не запросом на строку
+        self.assertFalse([sql for sql in queries if 'FROM "detail"' in sql])
+        for day in range(3, 9):
+            self.create_report(datetime.date(2021, 2, day), [(detail, day) for detail in self.details])
+        self.assertEqual(len(self.list_queries()), len(queries))
+
+    @override_settings(API_REFERENCE_CACHE_SIZE=2)
+    def test_rows_are_bounded(self):
+        cache = reference_cache.ReferenceCache(Detail)
+        self.assertEqual(set(cache.get_many([detail.pk for detail in self.details])), {d.pk for d in self.details})
+        self.assertEqual(len(cache.rows), 2)
+        with self.assertNumQueries(0):
+            cache.get(self.details[2].pk)
+        with self.assertNumQueries(1):
+            cache.get(self.details[0].pk)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'other.test'])
+    def test_representation_follows_changes_and_host(self):
+        line = self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 1)]).reportline_set.get()
+        url = f'/api/report-lines/{line.pk}/'
+        self.assertEqual(self.client.get(url).data['detail']['detail_name'], 'Рама')
+        # представление в кеше не портится тем, что сериализатор строки убирает из него detail_pk
+        self.assertEqual(self.client.get(url).data['detail']['detail_name'], 'Рама')
+        detail = Detail.objects.get(pk=self.details[0].pk)
+        detail.detail_name = 'Рама сварная'
+        detail.save()
+        self.assertEqual(self.client.get(url).data['detail']['detail_name'], 'Рама сварная')
+        # ссылки строятся от адреса запроса, у другого хоста свое представление
+        self.assertTrue(self.client.get(url).data['detail']['url'].startswith('http://testserver/'))
+        self.assertTrue(self.client.get(url, HTTP_HOST='other.test').data['detail']['url'].startswith('http://other.test/'))
+
+    def test_representation_keeps_format_override_apart(self):
+        line = self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 1)]).reportline_set.get()
+        url = f'/api/report-lines/{line.pk}/'
+        # reverse() DRF добавляет ?format= запроса к ссылкам
+        self.assertTrue(self.client.get(url, {'format': 'json'}).data['detail']['url'].endswith('/?format=json'))
+        for path in (url, '/api/report-lines/', '/api/reports/'):
+            with self.subTest(path=path):
+                content = self.client.get(path, HTTP_ACCEPT='application/json').content.decode()
+                self.assertIn(f'/api/details/{self.details[0].pk}/', content)
+                self.assertNotIn('format=', content)
+
+    def test_create_vedomost_validates_params(self):
+        for params in ({'date': '2021-02-01'},
+                       {'date': '2021-02-01', 'workshop_pk': 'x'},
+                       {'date': '2021-02-01', 'workshop_pk': 999999},
+                       {'date': 'x', 'workshop_pk': self.sender.pk},
+                       {'date': '2021-02-01', 'workshop_pk': self.sender.pk, 'child_amount': 'x'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/auto-vedomosts/', params).status_code, 400)
+        self.assertFalse(Vedomost.objects.exists())
+
+
+@unittest.skipIf(renderers.orjson is None, 'orjson is not installed')
+class FastJSONRendererTests(unittest.TestCase):
+    def test_same_output_as_json_renderer(self):
+        for data in ({'pk': 1, 'name': 'Рама\u2028', 'date': datetime.date(2021, 2, 1), 'amount': Decimal('1.50')},
+                     [0.1, 1e15, -0.0, None, 2 ** 63],
+                     {'big': 1e16, 'small': 1e-5, 'decimal': Decimal('1e20')},
+                     [2 ** 70, -2 ** 64]):
+            with self.subTest(data=data):
+                self.assertEqual(renderers.FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_nan_raises(self):
+        for value in (float('nan'), float('inf')):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                renderers.FastJSONRenderer().render({'value': value})
+
+
+class SyncTests(ApiTestCase):
+    sections = {'reports': 'report_pk', 'report_lines': 'report_line_pk',
+                'vedomosts': 'vedomost_pk', 'vedomost_lines': 'vedomost_line_pk'}
+
+    def pull(self, mirror, since, limit):
+        """Забирает изменения страницами, как клиент, и применяет их к mirror. Возвращает новый токен."""
+        more = True
+        while more:
+            response = self.client.get('/api/sync/', {'since': since, 'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            for name, pk_name in self.sections.items():
+                for row in response.data[name]:
+                    mirror[name][row[pk_name]] = row
+                for pk in response.data['deleted'][name]:
+                    mirror[name].pop(pk, None)
+            self.assertGreaterEqual(response.data['sync_token'], since)
+            since, more = response.data['sync_token'], response.data['more']
+        return since
+
+    def assert_mirrored(self, mirror):
+        for name, model in (('reports', Report), ('report_lines', ReportLine),
+                            ('vedomosts', Vedomost), ('vedomost_lines', VedomostLine)):
+            self.assertEqual(set(mirror[name]), set(model.objects.values_list('pk', flat=True)), name)
+
+    def test_pages_cover_all_sources(self):
+        for day in range(1, 6):
+            self.create_report(datetime.date(2021, 2, day), [(detail, day) for detail in self.details])
+            vedomost = Vedomost.objects.create(doc_num=day, creation_date=datetime.date(2021, 1, day),
+                                               workshop_pk=self.receiver)
+            VedomostLine.objects.create(vedomost_pk=vedomost, detail_pk=self.details[0], amount=day)
+        mirror = {name: {} for name in self.sections}
+        token = self.pull(mirror, 0, limit=2)
+        self.assert_mirrored(mirror)
+
+        report = Report.objects.first()
+        report.reportline_set.first().delete()
+        Vedomost.objects.last().delete()
+        self.create_report(datetime.date(2021, 3, 1), [(self.details[1], 1)])
+        token = self.pull(mirror, token, limit=1)
+        self.assert_mirrored(mirror)
+        self.assertEqual(self.pull(mirror, token, limit=1), token)
+
+    def test_delete_after_create(self):
+        token = SyncCounter.objects.get_or_create(name='documents')[0].value
+        report = self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 1)])
+        line_pk = report.reportline_set.get().pk
+        report_pk = report.pk
+        report.reportline_set.all().delete()
+        report.delete()
+        changed, deleted, _, more = sync.changes(token, 100)
+        self.assertFalse(changed['reports'] or changed['report_lines'] or more)
+        self.assertEqual((deleted['reports'], deleted['report_lines']), ([report_pk], [line_pk]))
+
+    def test_document_move_bumps_line_tokens(self):
+        report = self.create_report(datetime.date(2021, 2, 1), [(detail, 1) for detail in self.details])
+        token = max(report.reportline_set.values_list('sync_token', flat=True))
+        report.date = datetime.date(2021, 2, 2)
+        report.save()
+        changed, _, _, _ = sync.changes(token, 100)
+        self.assertEqual(sorted(line.pk for line in changed['report_lines']),
+                         sorted(report.reportline_set.values_list('pk', flat=True)))
+        tokens = [line.sync_token for line in changed['report_lines']]
+        self.assertEqual(len(set(tokens)), len(tokens))
+        self.assertTrue(all(line.date == report.date for line in changed['report_lines']))
+
+    def test_set_null_bumps_tokens(self):
+        report = self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 1)])
+        line = report.reportline_set.get()
+        plan = [deletion.Step(ReportLine.objects.filter(pk=line.pk), deletion.UPDATE, {'workshop_receiver_pk': None})]
+        list(deletion.run_step(plan[0]))
+        line.refresh_from_db()
+        self.assertIsNone(line.workshop_receiver_pk)
+        self.assertGreater(line.sync_token, report.sync_token)
+
+
+class EventsTests(ApiTestCase):
+    def run_job(self, kind, **params):
+        """Выполняет задачу с двумя подписанными цехами и третьим; возвращает цеха, получившие reset."""
+        other = Workshop.objects.create(workshop_name='Малярный', cipher_workshop='03')
+        subscribers = {self.sender.pk: {}, self.receiver.pk: {}, other.pk: {}}
+        with mock.patch.object(events.broker, 'subscribers', subscribers), \
+                mock.patch.object(events.broker, 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            job = Job.objects.create(kind=kind, params=params)
+            jobs.run(job.job_pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE, job.error)
+        return {workshop_pk for call in publish.call_args_list for workshop_pk, message in call.args[0]
+                if message == events.RESET}, other
+
+    def test_import_resets_document_workshops(self):
+        reset, _ = self.run_job('import_documents', reports=[
+            {'date': '2021-02-01', 'workshop_sender_pk': self.sender.pk, 'report_lines': [
+                {'detail_pk': self.details[0].pk, 'workshop_receiver_pk': self.receiver.pk, 'produced': 1},
+            ]},
+        ])
+        self.assertEqual(reset, {self.sender.pk, self.receiver.pk})
+
+    def test_clear_resets_every_subscriber(self):
+        self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 1)])
+        reset, other = self.run_job('clear', mode='clear_reports')
+        self.assertEqual(reset, {self.sender.pk, self.receiver.pk, other.pk})
+
+    def connect(self, host='testserver', headers=()):
+        """Подключается к потоку событий и сразу отключается; возвращает статус ответа."""
+        scope = {'type': 'http', 'method': 'GET', 'path': f'/api/stock-events/{self.receiver.pk}/', 'query_string': b'',
+                 'headers': [(b'host', host.encode())] + list(headers)}
+        sent = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        # sync_to_async внутри выполняется в этом же потоке - в транзакции теста
+        async_to_sync(events.stock_events_app)(scope, receive, send)
+        return sent[0]['status']
+
+    def test_stream_access(self):
+        credentials = base64.b64encode(b'tester:tester')
+        self.assertEqual(self.connect(), 403)
+        self.assertEqual(self.connect(headers=[(b'authorization', b'Basic ' + base64.b64encode(b'tester:wrong'))]), 403)
+        self.assertEqual(self.connect(host='evil.test', headers=[(b'authorization', b'Basic ' + credentials)]), 400)
+        self.assertEqual(self.connect(headers=[(b'authorization', b'Basic ' + credentials)]), 200)
+        session = APIClient()
+        session.login(username='tester', password='tester')
+        cookie = f'sessionid={session.cookies["sessionid"].value}'.encode()
+        self.assertEqual(self.connect(headers=[(b'cookie', cookie)]), 200)
+
+    def test_movement_events(self):
+        subscribers = {self.sender.pk: {}, self.receiver.pk: {}}
+        with mock.patch.object(events.broker, 'subscribers', subscribers), \
+                mock.patch.object(events.broker, 'publish') as publish, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 3)])
+        messages = [message.decode() for call in publish.call_args_list for _, message in call.args[0]]
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(all(message.startswith('event: movement\n') for message in messages))
+        self.assertIn('"amount": -3', messages[0] + messages[1])
+
+
+class StockTests(ApiTestCase):
+    """Рама = 2 колеса, колесо = 3 спицы. Ведомость сборочного цеха на 31.01, дальше приход и отгрузки."""
+
+    def setUp(self):
+        super().setUp()
+        self.frame, self.wheel, self.spoke = self.details
+        for manufactured, component, amount in ((self.frame, self.wheel, 2), (self.wheel, self.spoke, 3)):
+            instruction = UsingInstruction.objects.create(detail_manufactured_pk=manufactured)
+            UsingLine.objects.create(using_pk=instruction, detail_pk=component, amount=amount)
+        self.vedomost = Vedomost.objects.create(doc_num=1, creation_date=datetime.date(2021, 1, 31),
+                                                workshop_pk=self.receiver)
+        VedomostLine.objects.create(vedomost_pk=self.vedomost, detail_pk=self.wheel, amount=10)
+        VedomostLine.objects.create(vedomost_pk=self.vedomost, detail_pk=self.spoke, amount=4)
+        # приход в сборочный цех
+        self.create_report(datetime.date(2021, 2, 3), [(self.spoke, 5)])
+        # отгрузки из сборочного цеха
+        self.shipment = self.ship(datetime.date(2021, 2, 5), [(self.frame, 3)])
+        self.ship(datetime.date(2021, 2, 8), [(self.wheel, 3), (self.frame, 1)])
+
+    def ship(self, date, lines):
+        report = Report.objects.create(doc_num=Report.objects.count() + 1, date=date, workshop_sender_pk=self.receiver)
+        for detail, produced in lines:
+            ReportLine.objects.create(report_pk=report, detail_pk=detail, workshop_receiver_pk=self.sender,
+                                      produced=produced)
+        return report
+
+    def leftovers(self, date):
+        response = self.client.get('/api/leftovers/', {'date': date, 'workshop_pk': self.receiver.pk})
+        self.assertIsNone(response.data['error'])
+        return ({row['detail_pk']: row['amount'] for row in response.data['leftovers']},
+                {row['detail_pk']: row['amount'] for row in response.data['stuck']})
+
+    def test_leftovers(self):
+        # 05.02: 3 рамы = 6 колес из 10; 08.02: 3 колеса и рама (2 колеса) - одно колесо раскладывается на спицы
+        self.assertEqual(self.leftovers('2021-02-05'), ({self.wheel.pk: 4, self.spoke.pk: 9}, {}))
+        self.assertEqual(self.leftovers('2021-02-08'), ({self.spoke.pk: 6}, {}))
+
+    def test_matches_legacy_calculation(self):
+        line = self.shipment.reportline_set.get()
+        line.produced = 7
+        line.save()
+        self.shipment.date = datetime.date(2021, 2, 2)
+        self.shipment.save()
+        self.create_report(datetime.date(2021, 2, 4), [(self.wheel, 2)]).reportline_set.get().delete()
+        self.assertEqual(stock.check_ledger(), [])
+        for day in range(1, 11):
+            date = datetime.date(2021, 2, day)
+            with self.subTest(date=date):
+                self.assertEqual(self.leftovers(date.isoformat()), stock.legacy_leftovers(self.vedomost, date))
+
+    @override_settings(API_REFERENCE_CACHE_CHECK_INTERVAL=0)
+    def test_bom_change_in_other_process_invalidates_cache(self):
+        self.assertEqual(bom.get_bom().explode({self.frame.pk: 1}), {self.spoke.pk: 6})
+        # другой процесс: состав меняется без сигналов этого процесса, метка версии - через общий кеш
+        UsingLine.objects.filter(detail_pk=self.spoke).update(amount=4)
+        self.assertEqual(bom.get_bom().explode({self.frame.pk: 1}), {self.spoke.pk: 6})
+        VersionStamp('bom').bump()
+        self.assertEqual(bom.get_bom().explode({self.frame.pk: 1}), {self.spoke.pk: 8})
+
+
+class InventoryTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dates = [datetime.date(2021, 1, day) for day in (10, 20, 20, 31)]
+        self.vedomosts = []
+        for number, date in enumerate(self.dates, 1):
+            vedomost = Vedomost.objects.create(doc_num=number, creation_date=date, workshop_pk=self.receiver)
+            VedomostLine.objects.create(vedomost_pk=vedomost, detail_pk=self.details[0], amount=number)
+            self.vedomosts.append(vedomost)
+
+    def assert_matches_database(self):
+        for day in range(45):
+            date = datetime.date(2021, 1, 1) + datetime.timedelta(days=day)
+            latest = Vedomost.objects.filter(workshop_pk=self.receiver, creation_date__lte=date) \
+                .order_by('creation_date', 'vedomost_pk').last()
+            entry = inventory.at(self.receiver.pk, date)
+            with self.subTest(date=date):
+                self.assertEqual(entry and entry.vedomost_pk, latest and latest.pk)
+                if latest:
+                    self.assertEqual(entry.stock(), {line.detail_pk_id: line.amount
+                                                     for line in latest.vedomostline_set.all() if line.amount})
+
+    def test_matches_latest_vedomost(self):
+        self.assertIsNone(inventory.at(self.receiver.pk, datetime.date(2021, 1, 9)))
+        self.assertIsNone(inventory.at(self.sender.pk, datetime.date(2021, 2, 1)))
+        # из двух ведомостей на 20.01 действует созданная последней
+        self.assertEqual(inventory.at(self.receiver.pk, datetime.date(2021, 1, 25)).vedomost_pk, self.vedomosts[2].pk)
+        self.assert_matches_database()
+
+    def test_date_move_and_delete(self):
+        self.assert_matches_database()
+        moved = self.vedomosts[3]
+        moved.creation_date = datetime.date(2021, 1, 15)
+        moved.save()
+        self.assert_matches_database()
+        line = self.vedomosts[2].vedomostline_set.get()
+        line.amount = 0
+        line.save()
+        self.assert_matches_database()
+        self.vedomosts[2].delete()
+        self.assert_matches_database()
+        self.vedomosts[0].vedomostline_set.all().delete()
+        self.assert_matches_database()
+
+    @override_settings(API_REFERENCE_CACHE_CHECK_INTERVAL=0)
+    def test_change_in_other_process_invalidates_timeline(self):
+        self.assertEqual(inventory.at(self.receiver.pk, datetime.date(2021, 2, 1)).vedomost_pk, self.vedomosts[3].pk)
+        # другой процесс: ведомость меняется без сигналов этого процесса, метка версии - через общий кеш
+        Vedomost.objects.filter(pk=self.vedomosts[3].pk).update(creation_date=datetime.date(2021, 2, 5))
+        self.assertEqual(inventory.at(self.receiver.pk, datetime.date(2021, 2, 1)).vedomost_pk, self.vedomosts[3].pk)
+        VersionStamp('inventory').bump()
+        self.assertEqual(inventory.at(self.receiver.pk, datetime.date(2021, 2, 1)).vedomost_pk, self.vedomosts[2].pk)
+
+
+@unittest.skipIf(stock.numpy is None, 'numpy is not installed')
+class ResolveTests(unittest.TestCase):
+    def random_bom(self, rng, cyclic):
+        """Изделия 1..30 собираются из деталей с большими номерами, детали 31..60 без состава."""
+        rows = []
+        for manufactured_pk in range(1, 31):
+            for detail_pk in rng.sample(range(manufactured_pk + 1, 61), rng.randint(1, 3)):
+                rows.append((manufactured_pk, detail_pk, rng.randint(1, 4)))
+        if cyclic:
+            rows += [(3, 25, 1), (25, 3, 1)]
+        detail_bom = bom.Bom(rows)
+        self.assertEqual(bool(detail_bom.cyclic), cyclic)
+        return detail_bom
+
+    def check_random_inputs(self, seed):
+        rng = random.Random(seed)
+        for cyclic in (False, True):
+            detail_bom = self.random_bom(rng, cyclic)
+            for attempt in range(100):
+                # детали вне состава тоже бывают в остатке и среди ушедших
+                stock_pks = rng.sample(range(1, 71), rng.randint(0, 40))
+                outgoing_pks = rng.sample(range(1, 71), rng.randint(0, 15))
+                detail_stock = {detail_pk: rng.randint(0, 50) for detail_pk in stock_pks}
+                outgoing = {detail_pk: rng.randint(0, 20) for detail_pk in outgoing_pks}
+                with self.subTest(cyclic=cyclic, attempt=attempt):
+                    self.assertEqual(stock.resolve_numpy(detail_stock, outgoing, detail_bom),
+                                     stock.resolve_python(detail_stock, outgoing, detail_bom))
+
+    def test_numpy_matches_python(self):
+        self.check_random_inputs(7)
+
+    def test_numpy_without_scipy(self):
+        with mock.patch.object(bom, 'sparse', None):
+            self.check_random_inputs(11)
+
+
+class MetricsTests(ApiTestCase):
+    def counts(self, view):
+        return metrics.request_duration.labels(view).count, metrics.db_queries_total.labels(view).value
+
+    def test_unknown_method_label(self):
+        before = metrics.requests_total.labels('api:detail-list', 'other', 405).value
+        self.client.generic('BREW', '/api/details/')
+        self.assertEqual(metrics.requests_total.labels('api:detail-list', 'other', 405).value, before + 1)
+        self.assertNotIn(('api:detail-list', 'BREW', '405'), metrics.requests_total.children)
+
+    @override_settings(API_STREAM_CHUNK_SIZE=1)
+    def test_streamed_response_timed_until_closed(self):
+        requests, queries = self.counts('api:detail-list')
+        response = self.client.get('/api/details/', {'stream': 1})
+        self.assertTrue(response.streaming)
+        # pk выбраны, детали еще не загружены - ответ не записан
+        self.assertEqual(self.counts('api:detail-list'), (requests, queries))
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 3)
+        # запрос pk и по запросу на каждую пачку из одной детали
+        self.assertEqual(self.counts('api:detail-list'), (requests + 1, queries + 4))
+
+
+class DocNumberTests(ApiTestCase):
+    def post_vedomost(self, **data):
+        return self.client.post('/api/vedomosts/', {'creation_date': '2021-02-01', 'workshop_pk': self.sender.pk,
+                                                    'vedomost_lines': [], **data}, format='json')
+
+    def test_assign_numbers_per_workshop(self):
+        Report.objects.create(doc_num=3, workshop_sender_pk=self.sender)
+        reports = doc_numbers.assign([Report(workshop_sender_pk=self.sender), Report(workshop_sender_pk=self.receiver),
+                                      Report(workshop_sender_pk=self.sender, doc_num=10), Report(workshop_sender_pk=self.sender),
+                                      Vedomost(workshop_pk=self.sender)])
+        # новая последовательность начинается после номеров цеха, заданный номер сдвигает ее
+        self.assertEqual([document.doc_num for document in reports], [11, 1, 10, 12, 1])
+        self.assertEqual(doc_numbers.reserve(Report, self.sender.pk), 13)
+        self.assertEqual(doc_numbers.reserve(Report, None, 2), 1)
+        self.assertEqual(doc_numbers.reserve(Report, None), 3)
+
+    def test_client_number_advances_sequence(self):
+        self.assertEqual(self.post_vedomost().data['doc_num'], 1)
+        self.assertEqual(self.post_vedomost(doc_num=50).data['doc_num'], 50)
+        self.assertEqual(self.post_vedomost().data['doc_num'], 51)
+        # меньший номер последовательность назад не двигает
+        self.assertEqual(self.post_vedomost(doc_num=20).data['doc_num'], 20)
+        self.assertEqual(self.post_vedomost().data['doc_num'], 52)
+
+    def test_duplicate_number_rejected(self):
+        vedomost_pk = self.post_vedomost(doc_num=5).data['vedomost_pk']
+        response = self.post_vedomost(doc_num=5)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('doc_num', response.data)
+        self.assertEqual(self.post_vedomost(doc_num=5, workshop_pk=self.receiver.pk).status_code, 201)
+        # свой номер при изменении не мешает
+        self.assertEqual(self.client.patch(f'/api/vedomosts/{vedomost_pk}/', {'doc_num': 5}, format='json').status_code, 200)
+
+    def test_workshop_change_renumbers(self):
+        report = self.client.post('/api/reports/', {'date': '2021-02-01', 'workshop_sender_pk': self.sender.pk,
+                                                    'report_lines': []}, format='json').data
+        Report.objects.create(doc_num=7, workshop_sender_pk=self.receiver)
+        url = f'/api/reports/{report["report_pk"]}/'
+        response = self.client.patch(url, {'workshop_sender_pk': self.receiver.pk}, format='json')
+        self.assertEqual(response.data['doc_num'], 8)
+        response = self.client.patch(url, {'workshop_sender_pk': self.sender.pk, 'doc_num': 7}, format='json')
+        self.assertEqual(response.data['doc_num'], 7)
+        # номер, занятый в новом цехе, отклоняется
+        response = self.client.patch(url, {'workshop_sender_pk': self.receiver.pk, 'doc_num': 7}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Report.objects.get(pk=report['report_pk']).workshop_sender_pk, self.sender)
+
+    def test_import_rejects_duplicates(self):
+        Vedomost.objects.create(doc_num=4, workshop_pk=self.sender)
+        for vedomosts in ([{'doc_num': 4, 'creation_date': '2021-02-01', 'workshop_pk': self.sender.pk}],
+                          [{'doc_num': 9, 'creation_date': '2021-02-01', 'workshop_pk': self.receiver.pk},
+                           {'doc_num': 9, 'creation_date': '2021-02-02', 'workshop_pk': self.receiver.pk}]):
+            job = Job.objects.create(kind='import_documents', params={'vedomosts': vedomosts})
+            with self.subTest(vedomosts=vedomosts), self.assertLogs('api_app.jobs', 'ERROR'):
+                jobs.run(job.job_pk)
+                job.refresh_from_db()
+                self.assertEqual(job.status, Job.STATUS_FAILED)
+                self.assertIn('Duplicate vedomost doc_num', job.error)
+        self.assertEqual(Vedomost.objects.count(), 1)
+
+
+class SparseFieldsTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.report = self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 5), (self.details[1], 2)])
+        self.line_pks = list(self.report.reportline_set.order_by('pk').values_list('pk', flat=True))
+
+    def get_report(self, **params):
+        response = self.client.get('/api/reports/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0] if 'results' in response.data else response.data[0]
+
+    def test_fields_and_omit(self):
+        report = self.get_report(fields='report_pk,report_lines.produced,report_lines.detail.detail_name')
+        self.assertEqual(report, {'report_pk': self.report.pk, 'report_lines': [
+            {'produced': 5, 'detail': {'detail_name': 'Рама'}}, {'produced': 2, 'detail': {'detail_name': 'Колесо'}},
+        ]})
+        report = self.get_report(omit='url,report_lines.detail,report_lines.url')
+        self.assertNotIn('url', report)
+        self.assertEqual(set(report['report_lines'][0]),
+                         {'report_line_pk', 'report_pk', 'detail_pk', 'workshop_receiver_pk', 'produced'})
+
+    def test_expand(self):
+        self.assertEqual(self.get_report(expand='')['report_lines'], self.line_pks)
+        # строки раскрыты, а их деталь (collapsed_fields = {'detail': None}) убрана
+        lines = self.get_report(expand='report_lines')['report_lines']
+        self.assertEqual([line['report_line_pk'] for line in lines], self.line_pks)
+        self.assertNotIn('detail', lines[0])
+
+    def test_unselected_lines_not_loaded(self):
+        with CaptureQueriesContext(connection) as context:
+            self.get_report(fields='report_pk,doc_num')
+        self.assertFalse([query['sql'] for query in context.captured_queries if 'FROM "report_line"' in query['sql']])
+
+    def test_write_ignores_params(self):
+        response = self.client.patch(f'/api/reports/{self.report.pk}/?fields=report_pk', {'doc_num': 9}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['doc_num'], 9)
+        self.assertIn('report_lines', response.data)
+
+
+class CompressionTests(ApiTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Detail.objects.bulk_create([Detail(detail_name=f'Деталь {i}', cipher_detail=str(1000 + i)) for i in range(40)])
+
+    @override_settings(API_STREAM_CHUNK_SIZE=7)
+    def test_stream_matches_list(self):
+        expected = json.loads(self.client.get('/api/details/').content)
+        response = self.client.get('/api/details/', {'stream': 1})
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), expected)
+
+    def test_gzip(self):
+        plain = self.client.get('/api/details/')
+        response = self.client.get('/api/details/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(zlib.decompress(response.content, 31), plain.content)
+        # маленькие ответы не сжимаются
+        response = self.client.get(f'/api/details/{self.details[0].pk}/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @override_settings(API_STREAM_CHUNK_SIZE=7)
+    def test_gzip_stream(self):
+        plain = self.client.get('/api/details/', {'stream': 1})
+        response = self.client.get('/api/details/', {'stream': 1}, HTTP_ACCEPT_ENCODING='gzip;q=1, identity;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(b''.join(response.streaming_content), 31), b''.join(plain.streaming_content))
+
+    def test_negotiate(self):
+        encodings = [('zstd', None), ('br', None), ('gzip', None)]
+        self.assertEqual(middleware.negotiate('gzip, br', encodings)[0], 'br')
+        self.assertEqual(middleware.negotiate('gzip;q=1, br;q=0.5', encodings)[0], 'gzip')
+        self.assertEqual(middleware.negotiate('*', encodings)[0], 'zstd')
+        self.assertIsNone(middleware.negotiate('identity, gzip;q=0', encodings))
+
+
+@override_settings(API_PROFILING=True)
+class ProfilingTests(ApiTestCase):
+    def test_staff_only(self):
+        response = self.client.get('/api/details/', {'_profile': 'tottime'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/details/', {'_profile': 'tottime'})
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        report = response.content.decode()
+        self.assertIn('GET /api/details/?_profile=tottime: 200', report)
+        self.assertIn('SQL:', report)
+        self.assertIn('FROM "detail"', report)
+
+    def test_saves_profile(self):
+        self.user.is_staff = True
+        with tempfile.TemporaryDirectory() as directory, override_settings(API_PROFILE_DIR=directory):
+            response = self.client.get('/api/details/', {'_profile': 1, 'stream': 1})
+            self.assertIn(f'saved to {directory}', response.content.decode())
+            self.assertEqual(sorted(name.rsplit('.', 1)[1] for name in os.listdir(directory)), ['prof', 'sql'])
+
+    @override_settings(API_PROFILING=False)
+    def test_disabled(self):
+        self.user.is_staff = True
+        response = self.client.get('/api/details/', {'_profile': 1})
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class LazyModuleTests(unittest.TestCase):
+    def test_missing_package(self):
+        self.assertIsNone(lazy.optional_module('no_such_package_for_tests'))
+        self.assertIsNone(lazy.optional_module('no_such_package_for_tests.sub'))
+
+    def test_import_on_first_attribute(self):
+        module = lazy.optional_module('json.decoder')
+        with mock.patch('importlib.import_module', wraps=importlib.import_module) as import_module:
+            self.assertIs(module.JSONDecoder, json.decoder.JSONDecoder)
+            self.assertIs(module.JSONDecoder, json.decoder.JSONDecoder)
+        import_module.assert_called_once_with('json.decoder')
+
+
+class AdminTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('admin', password='admin')
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, model, params=None):
+        url = f'/admin/api_app/{model._meta.model_name}/'
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelists_open(self):
+        self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 1)])
+        for model in admin.site._registry:
+            if model._meta.app_label == 'api_app':
+                with self.subTest(model=model.__name__):
+                    self.changelist_queries(model)
+
+    def test_line_queries_do_not_grow(self):
+        self.create_report(datetime.date(2021, 2, 1), [(self.details[0], 1)])
+        queries = self.changelist_queries(ReportLine)
+        filtered = self.changelist_queries(ReportLine, {'workshop_sender_pk__workshop_pk__exact': self.sender.pk})
+        self.create_report(datetime.date(2021, 2, 2), [(detail, 2) for detail in self.details], sender=self.receiver)
+        self.assertEqual(self.changelist_queries(ReportLine), queries)
+        self.assertEqual(self.changelist_queries(ReportLine, {'workshop_sender_pk__workshop_pk__exact': self.sender.pk}),
+                         filtered)
+
+    def test_estimated_count(self):
+        queryset = Detail.objects.order_by('pk')
+        with mock.patch.object(admin_site, 'estimated_count', return_value=500000):
+            self.assertEqual(admin_site.EstimatedCountPaginator(queryset, 100).count, 500000)
+            # с фильтром - точное число
+            self.assertEqual(admin_site.EstimatedCountPaginator(queryset.filter(detail_pk__gt=0), 100).count, 3)
+        with mock.patch.object(admin_site, 'estimated_count', return_value=50):
+            self.assertEqual(admin_site.EstimatedCountPaginator(queryset, 100).count, 3)
+        # SQLite статистики не дает
+        self.assertIsNone(admin_site.estimated_count(queryset))
@@ -6,11 +6,13 @@ app_name = 'api'
 urlpatterns = [
     path('', views.api_root, name='root'),
     path('details/', views.DetailList.as_view(), name='detail-list'),
+    path('details/autocomplete/', views.DetailAutocomplete.as_view(), name='detail-autocomplete'),
     path('details/<int:pk>/', views.DetailDetail.as_view(), name='detail-detail'),
     path('workshops/', views.WorkshopList.as_view(), name='workshop-list'),
     path('workshops/<int:pk>/', views.WorkshopDetail.as_view(), name='workshop-detail'),
     path('reports/', views.ReportList.as_view(), name='report-list'),
     path('reports/<int:pk>/', views.ReportDetail.as_view(), name='report-detail'),
+    path('reports/<int:pk>/route-check/', views.ReportRouteCheck.as_view(), name='report-route-check'),
     path('report-lines/', views.ReportLineList.as_view(), name='report-line-list'),
     path('report-lines/<int:pk>/', views.ReportLineDetail.as_view(), name='report-line-detail'),
 
@@ -19,9 +21,20 @@ urlpatterns = [
     path('vedomost-lines/', views.VedomostLineList.as_view(), name='vedomost-line-list'),
     path('vedomost-lines/<int:pk>/', views.VedomostLineDetail.as_view(), name='vedomost-line-detail'),
 
+    path('quarter-programs/', views.QuarterProgramList.as_view(), name='quarter-program-list'),
+    path('quarter-programs/<int:pk>/', views.QuarterProgramDetail.as_view(), name='quarter-program-detail'),
+    path('quarter-programs/<int:pk>/matrix/', views.QuarterProgramMatrix.as_view(), name='quarter-program-matrix'),
+
+    path('routes/next/', views.RouteNext.as_view(), name='route-next'),
+    path('routes/inflow/', views.RouteInflow.as_view(), name='route-inflow'),
+
     path('leftovers/', views.Leftovers.as_view(), name='leftovers'),
     path('accounting/', views.Accounting.as_view(), name='accounting'),
     path('auto-vedomosts/', views.CreateVedomost.as_view(), name='auto-vedomosts'),
     path('auto-fill/', views.BigDataFill.as_view(), name='auto-fill'),
+    path('import/', views.DocumentImport.as_view(), name='import'),
+    path('jobs/', views.JobList.as_view(), name='job-list'),
+    path('jobs/<int:pk>/', views.JobDetail.as_view(), name='job-detail'),
+    path('sync/', views.Sync.as_view(), name='sync'),
 
 ]
\ No newline at end of file
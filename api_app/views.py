@@ -1,28 +1,43 @@
 import datetime
 import math
-import random
-import string
 
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db.models import QuerySet, When, Case, IntegerField
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
-from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, permissions
+from django.utils.crypto import constant_time_compare
+from rest_framework import filters, permissions, status
 from rest_framework import generics
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 
+from api_app import bulk, doc_numbers, inventory, jobs, metrics, planning, reference_cache, rollup, routes, search, stock, sync
+from api_app.filters import DjangoFilterBackend, IndexedSearchFilter
+from api_app.renderers import FastJSONRenderer
 from api_app.models import Detail, Report, ReportLine, Vedomost, VedomostLine, Workshop, UsingInstruction, \
-    ProductionProgramByMonth
-from api_app.serializers import DetailSerializer, ReportSerializer, ReportLineSerializer, VedomostSerializer, \
-    VedomostLineSerializer, WorkshopSerializer
+    Job, ProductionProgramForTheQuarterByMonth
+from api_app.serializers import detail_data, DetailSerializer, ReportSerializer, ReportLineSerializer, VedomostSerializer, \
+    VedomostLineSerializer, WorkshopSerializer, JobSerializer, QuarterProgramSerializer, QuarterMatrixSerializer, \
+    DocumentImportSerializer
 
 
 def redirect_view(request):
     return redirect('api:root')
 
 
+def metrics_view(request):
+    """Метрики процесса в формате Prometheus, см. api_app.metrics. При API_METRICS_TOKEN нужен заголовок Authorization."""
+    if not getattr(settings, 'API_METRICS', True):
+        raise Http404
+    token = getattr(settings, 'API_METRICS_TOKEN', None)
+    if token and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @api_view(['GET'])
 def api_root(request, format=None):
     """Добро пожаловать в API.
@@ -60,20 +75,72 @@ def api_root(request, format=None):
         'Цеха': reverse('api:workshop-list', request=request, format=format),
         'Остатки': reverse('api:leftovers', request=request, format=format),
         'Сводный учет': reverse('api:accounting', request=request, format=format),
+        'Квартальные программы': reverse('api:quarter-program-list', request=request, format=format),
+        'Фоновые задачи': reverse('api:job-list', request=request, format=format),
+        'Синхронизация': reverse('api:sync', request=request, format=format),
     })
 
 
-class DetailList(generics.ListAPIView):
+class SparseFieldsMixin:
+    """Префетчит только те вложенные списки, которые попадут в ответ (?fields=, ?omit=, ?expand=)."""
+    def get_queryset(self):
+        return self.get_serializer().optimize_queryset(super().get_queryset())
+
+
+class StreamingListMixin:
+    """
+    ?stream=1 - список отдается потоком JSON: pk выбираются сразу, объекты загружаются
+    и кодируются пачками по API_STREAM_CHUNK_SIZE, так что ответ целиком в памяти не собирается.
+    """
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('stream') in (None, '', '0', 'false') or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        pks = list(queryset.values_list('pk', flat=True))
+        return StreamingHttpResponse(self.stream_json(queryset.order_by(), pks), content_type='application/json')
+
+    def stream_json(self, queryset, pks):
+        renderer = FastJSONRenderer()
+        chunk_size = getattr(settings, 'API_STREAM_CHUNK_SIZE', 500)
+        yield b'['
+        for start in range(0, len(pks), chunk_size):
+            chunk = pks[start:start + chunk_size]
+            objects = queryset.in_bulk(chunk)
+            data = self.get_serializer([objects[pk] for pk in chunk if pk in objects], many=True).data
+            encoded = b','.join(renderer.render(item) for item in data)
+            yield b',' + encoded if start else encoded
+        yield b']'
+
+
+class DetailList(StreamingListMixin, generics.ListAPIView):
     """
     Read-Only. Список деталей. Создавать через админку.
     Возможен поиск.
     """
     queryset = Detail.objects.all()
     serializer_class = DetailSerializer
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [IndexedSearchFilter]
     search_fields = ['detail_name']
 
 
+class DetailAutocomplete(APIView):
+    """
+    Подсказки по началу названия или шифра детали. Параметр q обязателен, limit - до 50 (по умолчанию 10):
+    /api/details/autocomplete/?q=вел&limit=5
+    """
+    def get(self, request, format=None):
+        try:
+            limit = min(int(request.GET.get('limit', 10)), 50)
+        except ValueError:
+            limit = 10
+        pks = search.autocomplete(Detail, request.GET.get('q', '').strip(), limit)
+        details = Detail.objects.in_bulk(pks)
+        return Response({'details': [
+            {'detail_pk': pk, 'detail_name': details[pk].detail_name, 'cipher_detail': details[pk].cipher_detail}
+            for pk in pks if pk in details
+        ]})
+
+
 class DetailDetail(generics.RetrieveAPIView):
     """
     Read-Only. Просмотр деталей. Создавать через админку.
@@ -92,7 +159,7 @@ class WorkshopList(generics.ListAPIView):
     """
     queryset = Workshop.objects.all()
     serializer_class = WorkshopSerializer
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend]
+    filter_backends = [IndexedSearchFilter, DjangoFilterBackend]
     search_fields = ['workshop_name', 'cipher_workshop']
     filterset_fields = ['workshop_name', 'cipher_workshop']
 
@@ -112,22 +179,28 @@ class WorkshopDetail(generics.RetrieveAPIView):
     serializer_class = WorkshopSerializer
 
 
-class ReportList(generics.ListCreateAPIView):
+class ReportList(SparseFieldsMixin, StreamingListMixin, generics.ListCreateAPIView):
     """
     Список рапортов. В графе report_lines подробный список строк. Подобные параметры напрямую менять нельзя.
     При создании и изменении они тоже не нужны.
     А работать со строками нужно через /api/report_lines/ используя ключи, тут только смотреть.
     url при создании и редактировании не нужен.
     Фильтрация по дате: /api/reports/?ordering=-date  -- в порядке убывания.
+    Выбор полей: /api/reports/?fields=report_pk,date,report_lines.produced или ?omit=url,report_lines.detail
+    Только pk строк: /api/reports/?expand= , строки без деталей: /api/reports/?expand=report_lines
+    Так же работают строки рапортов, ведомости и их строки, детали.
+    Большие списки можно получать потоком: /api/reports/?stream=1
+    Поиск по номеру: /api/reports/?workshop_sender_pk=1&doc_num=15, без doc_num при создании номер выдается сам.
     """
     queryset = Report.objects.all()
     serializer_class = ReportSerializer
-    filter_backends = [filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['workshop_sender_pk', 'doc_num']
     ordering_fields = ['date']
     ordering = ['-date']
 
 
-class ReportDetail(generics.RetrieveUpdateDestroyAPIView):
+class ReportDetail(SparseFieldsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Просмотр и действия с рапортом.
     url и вложенные массивы и объекты при редактировании не нужны.
@@ -136,7 +209,7 @@ class ReportDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ReportSerializer
 
 
-class ReportLineList(generics.ListCreateAPIView):
+class ReportLineList(StreamingListMixin, generics.ListCreateAPIView):
     """
     Список всех строк рапортов.
     Фильтрация по рапорту: /api/report-lines/?report_pk=1
@@ -155,22 +228,24 @@ class ReportLineDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ReportLineSerializer
 
 
-class VedomostList(generics.ListCreateAPIView):
+class VedomostList(SparseFieldsMixin, StreamingListMixin, generics.ListCreateAPIView):
     """
     Список ведомостей. В графе vedomost_lines подробный список строк. Подобные параметры напрямую менять нельзя.
     При создании и изменении они тоже не нужны.
     А работать со строками нужно через /api/vedomost_lines/ используя ключи, тут только смотреть.
     url при создании и редактировании не нужен.
     Фильтрация по дате: /api/reports/?ordering=-creation_date  -- в порядке убывания.
+    Поиск по номеру: /api/vedomosts/?workshop_pk=1&doc_num=15, без doc_num при создании номер выдается сам.
     """
     queryset = Vedomost.objects.all()
     serializer_class = VedomostSerializer
-    filter_backends = [filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = ['workshop_pk', 'doc_num']
     ordering_fields = ['creation_date']
     ordering = ['-creation_date']
 
 
-class VedomostDetail(generics.RetrieveUpdateDestroyAPIView):
+class VedomostDetail(SparseFieldsMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     Просмотр ведомости.
     url и вложенные массивы и объекты при редактировании не нужны.
@@ -179,7 +254,7 @@ class VedomostDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = VedomostSerializer
 
 
-class VedomostLineList(generics.ListCreateAPIView):
+class VedomostLineList(StreamingListMixin, generics.ListCreateAPIView):
     """
     Список всех строк ведомостей.
     Фильтрация по ведомости: /api/vedomost-lines/?vedomost_pk=1
@@ -198,24 +273,84 @@ class VedomostLineDetail(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = VedomostLineSerializer
 
 
-def split_details(details, request):
-    details = details.copy()
-    details_to_add = []
-    details_to_remove = []
-    for detail in details:
+class QuarterProgramList(generics.ListCreateAPIView):
+    """
+    Список квартальных программ.
+    При создании можно сразу передать матрицу план по месяцам:
+    {"quarter_number": 2, "matrix": [{"detail_pk": 1, "months": {"4": 100, "5": 120, "6": 90}}]}
+    Фильтрация по кварталу: /api/quarter-programs/?quarter_number=2
+    """
+    queryset = ProductionProgramForTheQuarterByMonth.objects.all()
+    serializer_class = QuarterProgramSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['quarter_number']
+
+
+class QuarterProgramDetail(generics.RetrieveUpdateDestroyAPIView):
+    """
+    Просмотр и редактирование квартальной программы. Матрица - по ссылке matrix_url.
+    """
+    queryset = ProductionProgramForTheQuarterByMonth.objects.all()
+    serializer_class = QuarterProgramSerializer
+
+
+class QuarterProgramMatrix(generics.RetrieveUpdateAPIView):
+    """
+    Квартальная программа в виде матрицы деталь x месяц.
+    GET - строки программы, развернутые по месяцам.
+    PUT - заменить матрицу целиком (ячейки, которых нет в запросе, удаляются).
+    PATCH - изменить или добавить только переданные ячейки.
+    Формат: {"matrix": [{"detail_pk": 1, "months": {"4": 100, "5": 120, "6": 90}}]}
+    """
+    queryset = ProductionProgramForTheQuarterByMonth.objects.all()
+    serializer_class = QuarterMatrixSerializer
+
+
+class RouteNext(APIView):
+    """
+    Куда деталь идет дальше по межцеховым маршрутам. Необходимы параметры detail_pk и workshop_pk:
+    /api/routes/next/?detail_pk=3&workshop_pk=2
+    """
+    def get(self, request, format=None):
+        try:
+            detail_pk = int(request.GET['detail_pk'])
+            workshop_pk = int(request.GET['workshop_pk'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Url params detail_pk and workshop_pk are required and must be integers',
+                             'next': []}, status=status.HTTP_400_BAD_REQUEST)
+        receivers = routes.get_graph().next_workshops(detail_pk, workshop_pk)
+        return Response({
+            'error': None,
+            'next': [{'workshop_pk': pk, 'details_amount': amount} for pk, amount in receivers.items()]
+        })
+
+
+class RouteInflow(APIView):
+    """
+    Какие детали должны приходить в цех по межцеховым маршрутам. Необходим параметр workshop_pk:
+    /api/routes/inflow/?workshop_pk=2
+    """
+    def get(self, request, format=None):
         try:
-            instruction = UsingInstruction.objects.get(detail_manufactured_pk__detail_pk=detail['detail_pk'])
-            for using_line in instruction.usingline_set.all():
-                data = DetailSerializer(instance=using_line.detail_pk, context={'request': request}).data
-                data['amount'] = using_line.amount * detail['amount']
-                details_to_add.append(data)
-            details_to_remove.append(detail)
-        except UsingInstruction.DoesNotExist:
-            pass
-    for detail in details_to_remove:
-        details.remove(detail)
-    details.extend(details_to_add)
-    return details
+            workshop_pk = int(request.GET['workshop_pk'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Url param workshop_pk is required and must be an integer', 'inflow': []},
+                            status=status.HTTP_400_BAD_REQUEST)
+        inflow = routes.get_graph().expected_inflow(workshop_pk)
+        return Response({
+            'error': None,
+            'inflow': [{'detail_pk': pk, 'details_amount': amount} for pk, amount in inflow.items()]
+        })
+
+
+class ReportRouteCheck(generics.GenericAPIView):
+    """
+    Проверка строк рапорта по межцеховым маршрутам: список строк, которые отправлены не по маршруту.
+    """
+    queryset = Report.objects.all()
+
+    def get(self, request, pk, format=None):
+        return Response({'errors': routes.get_graph().check_report(self.get_object())})
 
 
 class Leftovers(APIView):
@@ -228,83 +363,24 @@ class Leftovers(APIView):
             return Response({'error': 'Url params date and workshop_pk are required', 'leftovers': [], 'stuck': []})
         date = datetime.date.fromisoformat(request.GET.get('date'))
         workshop_pk = request.GET.get('workshop_pk')
-        try:
-            # последняя ведомость инвентаризации
-            vedomost: Vedomost = Vedomost.objects.filter(
-                creation_date__lte=date,
-                workshop_pk=workshop_pk
-            ).latest()
-        except Vedomost.DoesNotExist:
+        # последняя ведомость инвентаризации - из хронологии цеха в памяти
+        vedomost = inventory.at(workshop_pk, date)
+        if vedomost is None:
             return Response({'error': f'No vedomosts were found before {date}', 'leftovers': [], 'stuck': []})
-        # входные партии
-        income_lines: QuerySet[ReportLine] = ReportLine.objects.filter(
-            workshop_receiver_pk__workshop_pk=workshop_pk,
-            report_pk__date__lte=date,
-            report_pk__date__gte=vedomost.creation_date
-        )
-        # выходные партии
-        outcome_lines: QuerySet[ReportLine] = ReportLine.objects.filter(
-            report_pk__workshop_sender_pk__workshop_pk=workshop_pk,
-            report_pk__date__lte=date,
-            report_pk__date__gte=vedomost.creation_date
-        )
-        # словарь для расчета остатков
-        details = {}
-        # записываем данные инвентаризации
-        for vedomost_line in vedomost.vedomostline_set.all():
-            if vedomost_line.amount:
-                data = DetailSerializer(instance=vedomost_line.detail_pk, context={'request': request}).data
-                data['amount'] = vedomost_line.amount
-                details[vedomost_line.detail_pk.detail_pk] = data
-        # прибавляем входные партии
-        for line in income_lines:
-            if line.produced:
-                if line.detail_pk.detail_pk in details:
-                    details[line.detail_pk.detail_pk]['amount'] += line.produced
-                else:
-                    data = DetailSerializer(instance=line.detail_pk, context={'request': request}).data
-                    data['amount'] = line.produced
-                    details[line.detail_pk.detail_pk] = data
-        # преобразуем выходные партии в удобный формат
+        # движения из журнала от даты ведомости и разложение ушедших деталей по составу
+        amounts, stuck = stock.leftovers(vedomost, date)
+        # подгружаем недостающие в кеше справочников детали одним запросом
+        reference_cache.details.get_many(set(amounts) | set(stuck))
+        details = []
+        for detail_pk, amount in amounts.items():
+            data = detail_data(detail_pk, request)
+            data['amount'] = amount
+            details.append(data)
         outcome_details = []
-        for line in outcome_lines:
-            if line.produced:
-                data = DetailSerializer(instance=line.detail_pk, context={'request': request}).data
-                data['amount'] = line.produced
-                outcome_details.append(data)
-        # вычитаем выходные
-        while outcome_details:
-            # отнимаем вышедшие детали
-            for detail in outcome_details:
-                if details.get(detail['detail_pk']):
-                    subtrahend = min(detail['amount'], details.get(detail['detail_pk'])['amount'])
-                    details.get(detail['detail_pk'])['amount'] -= subtrahend
-                    detail['amount'] -= subtrahend
-            # очищаем у которых количество на нуле
-            outcome_details = list(filter(lambda d: d['amount'] != 0, outcome_details))
-            for key in list(filter(lambda k: details[k]['amount'] == 0, details)):
-                del details[key]
-            # разбиваем
-            new_outcome_details = split_details(outcome_details, request)
-            if new_outcome_details == outcome_details:
-                break
-            else:
-                outcome_details = new_outcome_details
-        details = list(details.values())
-        for detail1 in details:
-            for detail2 in details:
-                if detail1['detail_pk'] == detail2['detail_pk']:
-                    reduce = detail1['amount']
-                    detail2['amount'] += reduce
-                    detail1['amount'] -= reduce
-        for detail1 in outcome_details:
-            for detail2 in outcome_details:
-                if detail1['detail_pk'] == detail2['detail_pk']:
-                    reduce = detail1['amount']
-                    detail2['amount'] += reduce
-                    detail1['amount'] -= reduce
-        details = list(filter(lambda detail: detail['amount'], details))
-        outcome_details = list(filter(lambda detail: detail['amount'], outcome_details))
+        for detail_pk, amount in stuck.items():
+            data = detail_data(detail_pk, request)
+            data['amount'] = amount
+            outcome_details.append(data)
         return Response({
             'leftovers': details,
             'stuck': outcome_details,
@@ -343,38 +419,18 @@ class Accounting(APIView):
             )
         workshop_pk = request.GET.get('workshop_pk')
 
-        report_lines: QuerySet[ReportLine] = ReportLine.objects.filter(
-            report_pk__workshop_sender_pk=workshop_pk,
-            report_pk__date__lte=end_date, report_pk__date__gte=start_date
-        ).order_by('report_pk__date')
-        programs: QuerySet[ProductionProgramByMonth] = ProductionProgramByMonth.objects.filter(
-            workshop_pk=workshop_pk, start_date__lte=end_date, end_date__gte=start_date
-        ).order_by('start_date')
+        # фактический выпуск: целые месяцы из помесячных итогов, края периода по строкам рапортов
+        produced = rollup.produced_by_detail(workshop_pk, start_date, end_date)
+        # план: пропорционально пересечению программ с периодом
+        planned = planning.planned_by_detail(workshop_pk, start_date, end_date)
 
         details = {}
-        for line in report_lines:
-            if line.produced:
-                if line.detail_pk.detail_pk in details:
-                    details[line.detail_pk.detail_pk]['actual_amount'] += line.produced
-                else:
-                    data = DetailSerializer(instance=line.detail_pk, context={'request': request}).data
-                    data['actual_amount'] = line.produced
-                    data['planned_amount'] = 0
-                    details[line.detail_pk.detail_pk] = data
-
-        for program in programs:
-            left_border = max(start_date, program.start_date)
-            right_border = min(end_date, program.end_date)
-            coefficient = ((right_border - left_border).days + 1) / ((program.end_date - program.start_date).days + 1)
-            for line in program.programline_set.all():
-                if line.amount:
-                    if line.detail_pk.detail_pk in details:
-                        details[line.detail_pk.detail_pk]['planned_amount'] += round(line.amount * coefficient)
-                    else:
-                        data = DetailSerializer(instance=line.detail_pk, context={'request': request}).data
-                        data['planned_amount'] = round(line.amount * coefficient)
-                        data['actual_amount'] = 0
-                        details[line.detail_pk.detail_pk] = data
+        detail_objects = reference_cache.details.get_many(sorted(set(produced) | set(planned)))
+        for detail in detail_objects.values():
+            data = detail_data(detail.detail_pk, request)
+            data['actual_amount'] = produced.get(detail.detail_pk, 0)
+            data['planned_amount'] = planned.get(detail.detail_pk, 0)
+            details[detail.detail_pk] = data
 
         details = list(details.values())
         for detail in details:
@@ -388,12 +444,20 @@ class Accounting(APIView):
 
 class CreateVedomost(APIView):
     def get(self, request, format=None):
-        date = datetime.date.fromisoformat(request.GET.get('date'))
-        child_amount = request.GET.get('child_amount')
-        teen_amount = request.GET.get('teen_amount')
-        adult_amount = request.GET.get('adult_amount')
-        workshop_pk = request.GET.get('workshop_pk')
-        vedomost = Vedomost.objects.create(doc_num=random.randint(1000, 10000), creation_date=date, workshop_pk=Workshop.objects.get(workshop_pk=workshop_pk))
+        try:
+            date = datetime.date.fromisoformat(request.GET['date'])
+            child_amount = int(request.GET.get('child_amount') or 0)
+            teen_amount = int(request.GET.get('teen_amount') or 0)
+            adult_amount = int(request.GET.get('adult_amount') or 0)
+            workshop = reference_cache.workshops.get(request.GET['workshop_pk'])
+        except (KeyError, ValueError, ValidationError):
+            return Response({'status': 'error',
+                             'error': 'Url params date and workshop_pk are required, amounts must be integers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if workshop is None:
+            return Response({'status': 'error', 'error': f"Workshop {request.GET['workshop_pk']} not found"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        vedomost = Vedomost.objects.create(doc_num=doc_numbers.reserve(Vedomost, workshop.pk), creation_date=date, workshop_pk=workshop)
         
         if child_amount:
             for line in UsingInstruction.objects.get(detail_manufactured_pk__detail_name='Велосипед детский').usingline_set.all():
@@ -415,6 +479,8 @@ class BigDataFill(APIView):
     Шаблоны:
     Детали - ?type=details&amount=1000&name_length=9
     Доки - ?type=reports&start_date=2021-02-01&end_date=2021-04-20&interval=2&workshop_pk=2
+    Очистка - ?type=clear_all (clear_details, clear_reports, clear_vedomosts)
+    Операция выполняется в фоне, в ответе ссылка на задачу: /api/jobs/<job_pk>/
     """
 
     permission_classes = [permissions.IsAuthenticated]
@@ -422,95 +488,118 @@ class BigDataFill(APIView):
     def get(self, request, format=None):
         type_ = request.GET.get('type', 'reports')
         if type_ == 'reports' or type_ == 'vedomosts':
-            start_date = datetime.date.fromisoformat(request.GET.get('start_date'))
-            end_date = datetime.date.fromisoformat(request.GET.get('end_date'))
-            interval = int(request.GET.get('interval', 1))
-            workshop_pk = int(request.GET.get('workshop_pk'))
-            lines_from = int(request.GET.get('lines_from', 5))
-            lines_to = int(request.GET.get('lines_to', 5))
-            if type_ == 'reports':
-                objects = []
-                for num, date in enumerate((start_date + datetime.timedelta(i) for i in range(0, (end_date - start_date).days + 1, interval))):
-                    objects.append(Report(doc_num=num + 1, date=date, workshop_sender_pk_id=workshop_pk))
-                    if len(objects) > 50:
-                        Report.objects.bulk_create(objects)
-                        objects.clear()
-                else:
-                    Report.objects.bulk_create(objects)
-                    objects.clear()
-
-                detail = Detail.objects.all()[0]
-                for report in Report.objects.all():
-                    objects.extend([
-                        ReportLine(report_pk=report, detail_pk=detail, workshop_receiver_pk_id=workshop_pk, produced=5)
-                        for _ in range(random.randint(lines_from, lines_to))
-                    ])
-                    if len(objects) > 50:
-                        ReportLine.objects.bulk_create(objects)
-                        objects.clear()
-                else:
-                    ReportLine.objects.bulk_create(objects)
-                    objects.clear()
-            elif type_ == 'vedomosts':
-                objects = []
-                for num, date in enumerate((start_date + datetime.timedelta(i) for i in range(0, (end_date - start_date).days + 1, interval))):
-                    objects.append(Vedomost(doc_num=num + 1, creation_date=date, workshop_pk_id=workshop_pk))
-                    if len(objects) > 50:
-                        Vedomost.objects.bulk_create(objects)
-                        objects.clear()
-                else:
-                    Vedomost.objects.bulk_create(objects)
-                    objects.clear()
-
-                detail = Detail.objects.all()[0]
-                for vedomost in Vedomost.objects.all():
-                    objects.extend([
-                        VedomostLine(vedomost_pk=vedomost, detail_pk=detail, amount=5)
-                        for _ in range(random.randint(lines_from, lines_to))
-                    ])
-                    if len(objects) > 50:
-                        VedomostLine.objects.bulk_create(objects)
-                        objects.clear()
-                else:
-                    VedomostLine.objects.bulk_create(objects)
-                    objects.clear()
+            try:
+                params = {
+                    'start_date': datetime.date.fromisoformat(request.GET.get('start_date')).isoformat(),
+                    'end_date': datetime.date.fromisoformat(request.GET.get('end_date')).isoformat(),
+                    'interval': int(request.GET.get('interval', 1)),
+                    'workshop_pk': int(request.GET.get('workshop_pk')),
+                    'lines_from': int(request.GET.get('lines_from', 5)),
+                    'lines_to': int(request.GET.get('lines_to', 5)),
+                }
+            except (TypeError, ValueError):
+                return Response({'status': 'error', 'error': 'Url params start_date, end_date and workshop_pk are required'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            job = jobs.submit(f'fill_{type_}', **params)
         elif type_ == 'details':
-            amount = int(request.GET.get('amount', 100))
-            name_length = int(request.GET.get('name_length', 10))
-            details = []
-            for i in range(amount):
-                details.append(Detail(
-                    detail_name=''.join(random.choices(string.ascii_letters, k=name_length)),
-                    cipher_detail=''.join(random.choices(string.digits, k=name_length))
-                ))
-                if len(details) > 50:
-                    Detail.objects.bulk_create(details)
-                    details.clear()
-            else:
-                Detail.objects.bulk_create(details)
-                details.clear()
-        elif type_ == 'clear_all':
-            Report.objects.all().delete()
-            Vedomost.objects.all().delete()
-            Detail.objects.all().delete()
-        elif type_ == 'clear_details':
-            Detail.objects.all().delete()
-        elif type_ == 'clear_reports':
-            Report.objects.all().delete()
-        elif type_ == 'clear_vedomosts':
-            Vedomost.objects.all().delete()
-        return Response({'status': 'success'})
+            try:
+                params = {
+                    'amount': int(request.GET.get('amount', 100)),
+                    'name_length': int(request.GET.get('name_length', 10)),
+                }
+            except ValueError:
+                return Response({'status': 'error', 'error': 'Url params amount and name_length must be integers'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            job = jobs.submit('fill_details', **params)
+        elif type_ in bulk.CLEAR_MODELS:
+            job = jobs.submit('clear', mode=type_)
+        else:
+            return Response({'status': 'error', 'error': f'Unknown type {type_}'}, status=status.HTTP_400_BAD_REQUEST)
+        return job_response(job, request, format)
 
-                
-        
-                
-            
-            
 
+def job_response(job, request, format=None):
+    return Response({
+        'status': job.status,
+        'job_pk': job.job_pk,
+        'job': reverse('api:job-detail', kwargs={'pk': job.job_pk}, request=request, format=format),
+    }, status=status.HTTP_202_ACCEPTED)
 
 
+class DocumentImport(APIView):
+    """
+    Загрузка рапортов и ведомостей со строками в фоне, в ответе ссылка на задачу: /api/jobs/<job_pk>/
+    POST {"reports": [{"doc_num": 1, "date": "2021-02-01", "workshop_sender_pk": 2,
+                       "report_lines": [{"detail_pk": 1, "workshop_receiver_pk": 3, "produced": 5}]}],
+          "vedomosts": [{"creation_date": "2021-02-01", "workshop_pk": 2, "vedomost_lines": [{"detail_pk": 1, "amount": 5}]}]}
+    Без doc_num документ получает следующий номер своего цеха. Номер, который уже есть в цехе
+    или повторяется в загрузке, завершает задачу ошибкой до записи.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, format=None):
+        serializer = DocumentImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return job_response(jobs.submit('import_documents', **serializer.data), request, format)
+
+
+class JobList(generics.ListAPIView):
+    """
+    Read-Only. Список фоновых задач, новые сверху.
+    Фильтрация по статусу: /api/jobs/?status=running
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['status', 'kind']
+
+    def get_queryset(self):
+        # задачи остановленных процессов получают статус failed до того, как их покажут
+        jobs.check_abandoned()
+        return super().get_queryset().order_by('-job_pk')
+
 
+class JobDetail(generics.RetrieveAPIView):
+    """
+    Read-Only. Состояние фоновой задачи: status (queued, running, done, failed), progress из total,
+    result после завершения и error при ошибке.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        jobs.check_abandoned()
+        return super().get_queryset()
 
 
+class Sync(APIView):
+    """
+    Изменения документов после токена синхронизации since (при первой синхронизации - 0), limit до 5000:
+    /api/sync/?since=0
+    /api/sync/?since=1520&limit=1000
+    В ответе созданные и измененные рапорта, ведомости и их строки (рапорта и ведомости без вложенных строк),
+    pk удаленных в deleted и sync_token для следующего запроса. Если more = true, нужно сразу запросить еще.
+    """
+    serializers = {
+        'reports': (ReportSerializer, (None, {'report_lines': {}}, None)),
+        'report_lines': (ReportLineSerializer, None),
+        'vedomosts': (VedomostSerializer, (None, {'vedomost_lines': {}}, None)),
+        'vedomost_lines': (VedomostLineSerializer, None),
+    }
 
+    def get(self, request, format=None):
+        try:
+            since = int(request.GET.get('since', 0))
+            limit = min(max(int(request.GET.get('limit', 500)), 1), 5000)
+        except ValueError:
+            return Response({'error': 'since and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        changed, deleted, token, more = sync.changes(since, limit)
+        data = {
+            name: serializer_class(changed[name], many=True, context={'request': request}, field_spec=field_spec).data
+            for name, (serializer_class, field_spec) in self.serializers.items()
+        }
+        data.update({'deleted': deleted, 'sync_token': token, 'more': more})
+        return Response(data)